@@ -0,0 +1,263 @@
+"""
+Offline benchmark of the ingest pipeline against a fake TLC server, with
+configurable latency and bandwidth, and a fake Cloud Storage endpoint, see
+fakes. Each scenario runs main() in a fresh process and reports files/s, MB/s,
+peak RSS, and per-stage timings aggregated from its metrics as a JSON line:
+    python -m dtc_de.extract_load.benchmark --scenario download ingest --latency 0.05 --bandwidth 20000000
+
+Append reports to a file to track regressions and the effect of settings
+over time:
+    python -m dtc_de.extract_load.benchmark --max-concurrency 16 --output benchmark.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from dtc_de.extract_load import fakes, metrics, sinks
+from dtc_de.extract_load import extract_load_trips_from_tlc_to_gs as extract_load
+
+
+BUCKET_NAME = "benchmark"
+ROWS = 100_000
+YEAR = 2022
+MONTHS = 3
+VEHICLE_TYPES = ("green", "yellow", "fhvhv")
+
+# main() options of each scenario, on top of common ones
+SCENARIOS = {
+    "download": dict(local_dest=True),
+    "ingest": dict(bucket_name=True),
+    "ingest-partitioned": dict(bucket_name=True, hive_partitioning=True),
+    "fanout": dict(bucket_name=True, local_dest=True),
+    "ingest-local": dict(sink_url=True),
+    "ingest-zones": dict(bucket_name=True, zone_lookup=True),
+}
+
+
+def get_peak_rss():
+    """
+    Get peak resident set size in bytes of this process. Transform workers
+    run under a forkserver rather than as children of this process, so their
+    peak is measured within them and read from metrics, see aggregate_metrics.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def aggregate_metrics(path):
+    """
+    Aggregate metrics JSON lines written by main() into per-stage count, total
+    and max seconds, totals of counters, and maxima of peaks
+    """
+    stages = {}
+    counters = dict.fromkeys(metrics.COUNTERS, 0)
+    peaks = dict.fromkeys(metrics.PEAKS, 0)
+    with open(path) as file:
+        for line in file:
+            record = json.loads(line)
+            for span in record["spans"]:
+                stage = stages.setdefault(span["stage"], dict(count=0, total=0, max=0))
+                stage["count"] += 1
+                stage["total"] += span["seconds"]
+                stage["max"] = max(stage["max"], span["seconds"])
+            for key in metrics.COUNTERS:
+                counters[key] += record[key]
+            for key in metrics.PEAKS:
+                peaks[key] = max(peaks[key], record[f"peak_{key}"])
+
+    return (stages, counters, peaks)
+
+
+def run_scenario(main_kwargs, results):
+    """
+    Run main() in a fresh process, putting report with stage timings
+    aggregated from its metrics to results queue
+    """
+    start = time.perf_counter()
+    summary = extract_load.main(**main_kwargs)
+    seconds = time.perf_counter() - start
+
+    (stages, counters, peaks) = aggregate_metrics(main_kwargs["metrics_output"])
+    results.put(dict(
+        seconds=seconds,
+        summary=summary,
+        peak_rss=get_peak_rss(),
+        peak_rss_workers=peaks["rss"],
+        stages=stages,
+        counters=counters,
+    ))
+
+
+async def run_in_process(main_kwargs):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_scenario, args=(main_kwargs, results))
+    process.start()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, process.join)
+    if process.exitcode != 0:
+        raise RuntimeError(f"Scenario failed with exit code {process.exitcode}")
+
+    return results.get()
+
+
+def make_source_files(directory, vehicle_types, year, months, rows):
+    """
+    Write synthetic source files shaped like schemas of vehicle types, return
+    their sizes by basename
+    """
+    sizes = {}
+    for vehicle_type in vehicle_types:
+        schema = extract_load.VEHICLE_TYPE_SCHEMA_MAP[vehicle_type]
+        for month in range(1, months + 1):
+            basename = f"{vehicle_type}_tripdata_{year}-{month:02}.parquet"
+            path = os.path.join(directory, basename)
+            fakes.make_trips_file(path, schema, year, month, rows, seed=month)
+            sizes[basename] = os.path.getsize(path)
+
+    return sizes
+
+
+async def benchmark(
+    scenarios=tuple(SCENARIOS),
+    vehicle_types=VEHICLE_TYPES,
+    year=YEAR,
+    months=MONTHS,
+    rows=ROWS,
+    latency=0,
+    bandwidth=None,
+    repeat=1,
+    main_options=None,
+):
+    """
+    Run each scenario repeat times against fake servers serving months files
+    of rows rows for each vehicle type, yielding reports
+    """
+    main_options = main_options or {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        (source_dir, gcs_dir) = (f"{tmp_dir}/source", f"{tmp_dir}/gcs")
+        os.makedirs(source_dir)
+        os.makedirs(f"{gcs_dir}/{BUCKET_NAME}")
+        sizes = make_source_files(source_dir, vehicle_types, year, months, rows)
+        zone_lookup = f"{tmp_dir}/taxi_zone_lookup.csv"
+        fakes.make_zone_lookup_file(zone_lookup)
+
+        tlc = fakes.FakeTLCServer(source_dir, latency, bandwidth)
+        gcs = fakes.FakeGCSServer(gcs_dir)
+        runners = [await fakes.start_server(tlc), await fakes.start_server(gcs)]
+        try:
+            for scenario in scenarios:
+                for run in range(repeat):
+                    local_dest = f"{tmp_dir}/local"
+                    sink_dir = f"{tmp_dir}/sink"
+                    metrics_output = f"{tmp_dir}/metrics_{scenario}_{run}.jsonl"
+                    main_kwargs = dict(
+                        vehicle_type=list(vehicle_types),
+                        year=year,
+                        month=list(range(1, months + 1)),
+                        force=True,
+                        catalog_ttl=0,
+                        gcs_endpoint=gcs.url,
+                        tlc_web_url=tlc.get_web_url(),
+                        tlc_base_url=tlc.get_base_url(),
+                        metrics_output=metrics_output,
+                        **main_options,
+                    )
+                    main_kwargs.update(SCENARIOS[scenario])
+                    main_kwargs["bucket_name"] = BUCKET_NAME if main_kwargs.get("bucket_name") else None
+                    main_kwargs["local_dest"] = local_dest if main_kwargs.get("local_dest") else None
+                    main_kwargs["sink_url"] = f"file://{sink_dir}" if main_kwargs.get("sink_url") else None
+                    main_kwargs["zone_lookup"] = zone_lookup if main_kwargs.get("zone_lookup") else None
+
+                    result = await run_in_process(main_kwargs)
+                    shutil.rmtree(local_dest, ignore_errors=True)
+                    shutil.rmtree(sink_dir, ignore_errors=True)
+
+                    nbytes = sum(sizes.values())
+                    seconds = result["seconds"]
+                    yield dict(
+                        scenario=scenario,
+                        run=run,
+                        files=len(sizes),
+                        bytes=nbytes,
+                        seconds=round(seconds, 3),
+                        files_per_s=round(len(sizes) / seconds, 3),
+                        mb_per_s=round(nbytes / seconds / 1e6, 3),
+                        peak_rss_mb=round(result["peak_rss"] / 1e6, 1),
+                        peak_rss_workers_mb=round(result["peak_rss_workers"] / 1e6, 1),
+                        stages={
+                            name: {key: round(value, 3) for (key, value) in stage.items()}
+                            for (name, stage) in result["stages"].items()
+                        },
+                        **{key: round(value, 3) for (key, value) in result["counters"].items()},
+                        summary={key: len(value) for (key, value) in result["summary"].items()},
+                        options=dict(
+                            rows=rows, latency=latency, bandwidth=bandwidth, **main_options),
+                    )
+        finally:
+            for runner in runners:
+                await runner.cleanup()
+
+
+async def main(output=None, **kwargs):
+    async for report in benchmark(**kwargs):
+        line = json.dumps(report)
+        print(line)
+        if output is not None:
+            with open(output, "a") as file:
+                file.write(line + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", default=list(SCENARIOS), nargs="+", choices=list(SCENARIOS))
+    parser.add_argument("--vehicle-type", default=list(VEHICLE_TYPES), nargs="+")
+    parser.add_argument("--year", default=YEAR, type=int)
+    parser.add_argument("--months", default=MONTHS, type=int)
+    parser.add_argument("--rows", default=ROWS, type=int)
+    parser.add_argument("--latency", default=0, type=float)
+    parser.add_argument("--bandwidth", default=None, type=float)
+    parser.add_argument("--repeat", default=1, type=int)
+    parser.add_argument("--output", default=None)
+    main_parser = parser.add_argument_group("main() options")
+    main_parser.add_argument("--min-concurrency", type=int)
+    main_parser.add_argument("--max-concurrency", type=int)
+    main_parser.add_argument("--chunk-size", type=int)
+    main_parser.add_argument("--segment-size", type=int)
+    main_parser.add_argument("--segments", type=int)
+    main_parser.add_argument("--batch-size", type=int)
+    main_parser.add_argument("--transform-workers", type=int)
+    main_parser.add_argument("--upload-workers", type=int)
+    main_parser.add_argument("--writer-profile", nargs="+")
+    main_parser.add_argument("--memory-budget", type=int)
+    main_parser.add_argument("--files-in-memory", action="store_true", default=None)
+    main_parser.add_argument("--deduplicate", action="store_true", default=None)
+    main_parser.add_argument("--out-of-month", choices=["drop", "quarantine"])
+    main_parser.add_argument("--projection", choices=list(extract_load.PROJECTIONS))
+    main_parser.add_argument("--compact", action="store_true", default=None)
+    main_parser.add_argument("--preflight", choices=["warn", "fail"])
+    main_parser.add_argument("--upload-strategy", choices=list(sinks.UPLOAD_STRATEGIES))
+
+    args = vars(parser.parse_args())
+    main_options = {
+        key: args.pop(key)
+        for key in [action.dest for action in main_parser._group_actions]
+    }
+    asyncio.run(main(
+        output=args["output"],
+        scenarios=args["scenario"],
+        vehicle_types=args["vehicle_type"],
+        year=args["year"],
+        months=args["months"],
+        rows=args["rows"],
+        latency=args["latency"],
+        bandwidth=args["bandwidth"],
+        repeat=args["repeat"],
+        main_options={key: value for (key, value) in main_options.items() if value is not None},
+    ))
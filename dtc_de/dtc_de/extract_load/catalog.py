@@ -0,0 +1,194 @@
+"""
+Catalog of trips parquet files published by TLC, parsed from TLC web page and
+cached with a TTL and ETag revalidation so planning takes zero or one requests
+"""
+
+import json
+import os
+import re
+import time
+
+
+BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+WEB_URL = "https://www.nyc.gov/site/tlc/about/tlc-trip-record-data.page"
+
+CATALOG_BLOB_NAME = "catalog/tlc_catalog.json"
+CATALOG_TTL = 24 * 60 * 60  # seconds
+BASENAME_PATTERN = r"([a-z]+)_tripdata_(\d{4})-(\d{2})\.parquet"
+
+
+def parse_basename(file_basename):
+    """
+    Parse (vehicle_type, year, month) of file basename, or None if it does not
+    follow TLC naming
+    """
+    match = re.fullmatch(BASENAME_PATTERN, file_basename)
+    if match is None:
+        return None
+
+    (vehicle_type, year, month) = match.groups()
+    return (vehicle_type, int(year), int(month))
+
+
+def parse_entries(html, base_url=BASE_URL):
+    """
+    Parse catalog entries from TLC web page:
+        [{"vehicle_type": "green", "year": 2022, "month": 1, "url": "..."}, ...]
+    """
+    exp = re.compile(re.escape(base_url) + "/" + BASENAME_PATTERN)
+    entries = {}
+    for match in exp.finditer(html):
+        (vehicle_type, year, month) = match.groups()
+        entries[match.group(0)] = dict(
+            vehicle_type=vehicle_type,
+            year=int(year),
+            month=int(month),
+            url=match.group(0),
+        )
+
+    return sorted(entries.values(), key=lambda e: (e["vehicle_type"], e["year"], e["month"]))
+
+
+class Catalog:
+    """
+    Queryable catalog of available files along with its fetch state:
+        catalog.query(vehicle_type="green", year=2022)
+        catalog.latest("green")  # (year, month) of latest published file
+    """
+
+    def __init__(self, entries, fetched_at=0, etag=None, last_modified=None):
+        self.entries = entries
+        self.fetched_at = fetched_at
+        self.etag = etag
+        self.last_modified = last_modified
+        self._urls = {e["url"]: e for e in entries}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["entries"],
+            data.get("fetched_at", 0),
+            data.get("etag"),
+            data.get("last_modified"),
+        )
+
+    def to_dict(self):
+        return dict(
+            entries=self.entries,
+            fetched_at=self.fetched_at,
+            etag=self.etag,
+            last_modified=self.last_modified,
+        )
+
+    def is_fresh(self, ttl=CATALOG_TTL):
+        return (time.time() - self.fetched_at) < ttl
+
+    def query(self, vehicle_type=None, year=None, month=None):
+        return [
+            e for e in self.entries
+            if ((vehicle_type is None) or (e["vehicle_type"] == vehicle_type))
+            and ((year is None) or (e["year"] == year))
+            and ((month is None) or (e["month"] == month))
+        ]
+
+    def latest(self, vehicle_type):
+        """
+        Get (year, month) of latest published file for vehicle_type, or None
+        """
+        entries = self.query(vehicle_type=vehicle_type)
+        if len(entries) == 0:
+            return None
+
+        return max((e["year"], e["month"]) for e in entries)
+
+    def validate(self, urls):
+        valid_urls = [url for url in urls if url in self._urls]
+        invalid_urls = [url for url in urls if url not in self._urls]
+
+        return (valid_urls, invalid_urls)
+
+
+class LocalCache:
+    """
+    Catalog cache stored as a local file
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    async def read(self):
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, "r") as file:
+            return file.read()
+
+    async def write(self, text):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as file:
+            file.write(text)
+
+
+class SinkCache:
+    """
+    Catalog cache stored as an object of a sink, such as a Cloud Storage
+    bucket, shared by all runs ingesting to the same sink, see sinks.Sink
+    """
+
+    def __init__(self, sink, blob_name=CATALOG_BLOB_NAME):
+        self.sink = sink
+        self.blob_name = blob_name
+
+    async def read(self):
+        data = await self.sink.get_bytes(self.blob_name)
+        return None if data is None else data.decode("utf-8")
+
+    async def write(self, text):
+        await self.sink.put_bytes(self.blob_name, text.encode("utf-8"), content_type="application/json")
+
+
+async def load_catalog(session, cache=None, ttl=CATALOG_TTL, web_url=WEB_URL, base_url=BASE_URL):
+    """
+    Load catalog from cache if fresher than ttl, taking no requests. Otherwise,
+    revalidate cached catalog if any, see revalidate_catalog.
+    """
+    catalog = None
+    if cache is not None:
+        text = await cache.read()
+        if text:
+            catalog = Catalog.from_dict(json.loads(text))
+            if catalog.is_fresh(ttl):
+                return catalog
+
+    return await revalidate_catalog(session, catalog, cache, web_url, base_url)
+
+
+async def revalidate_catalog(session, catalog=None, cache=None, web_url=WEB_URL, base_url=BASE_URL):
+    """
+    Request TLC web page, conditionally on ETag and Last-Modified of catalog
+    if defined, and store updated catalog in cache if defined
+    """
+    headers = {}
+    if catalog is not None:
+        if catalog.etag:
+            headers["If-None-Match"] = catalog.etag
+        if catalog.last_modified:
+            headers["If-Modified-Since"] = catalog.last_modified
+
+    async with session.get(web_url, headers=headers) as res:
+        if (catalog is not None) and (res.status == 304):
+            catalog.fetched_at = time.time()
+        else:
+            res.raise_for_status()
+            html = (await res.read()).decode("utf-8")
+            catalog = Catalog(
+                parse_entries(html, base_url),
+                fetched_at=time.time(),
+                etag=res.headers.get("ETag"),
+                last_modified=res.headers.get("Last-Modified"),
+            )
+
+    if cache is not None:
+        await cache.write(json.dumps(catalog.to_dict()))
+
+    return catalog
@@ -0,0 +1,157 @@
+"""
+CRC32C and MD5 digests computed while bytes stream through the pipeline, in
+the base64 encoding used by Cloud Storage object metadata, so uploads can be
+validated server-side without reading files again
+"""
+
+import base64
+import hashlib
+
+import google_crc32c
+
+
+CRC32C_POLY = 0x82F63B78  # reversed Castagnoli polynomial
+
+
+def gf2_matrix_times(matrix, vector):
+    total = 0
+    for row in matrix:
+        if vector == 0:
+            break
+        if vector & 1:
+            total ^= row
+        vector >>= 1
+
+    return total
+
+
+def gf2_matrix_square(matrix):
+    return [gf2_matrix_times(matrix, row) for row in matrix]
+
+
+def crc32c_combine(crc1, crc2, length2):
+    """
+    Get CRC32C of two concatenated byte sequences from CRC32C of each and
+    length of second, as zlib crc32_combine() for the Castagnoli polynomial
+    """
+    if length2 == 0:
+        return crc1
+
+    # Operator shifting CRC by one zero bit, then squared to shift by 2, 4 bits
+    odd = [CRC32C_POLY] + [1 << n for n in range(31)]
+    even = gf2_matrix_square(odd)
+    odd = gf2_matrix_square(even)
+    while True:
+        even = gf2_matrix_square(odd)
+        if length2 & 1:
+            crc1 = gf2_matrix_times(even, crc1)
+        length2 >>= 1
+        if length2 == 0:
+            break
+
+        odd = gf2_matrix_square(even)
+        if length2 & 1:
+            crc1 = gf2_matrix_times(odd, crc1)
+        length2 >>= 1
+        if length2 == 0:
+            break
+
+    return crc1 ^ crc2
+
+
+def encode(digest):
+    return base64.b64encode(digest).decode()
+
+
+class Digest:
+    """
+    CRC32C and, unless md5 is False, MD5 of bytes updated chunk by chunk.
+    Digests of consecutive byte ranges, such as download segments, combine
+    into the digest of the whole with extend(), where only CRC32C is kept
+    since MD5 does not combine.
+    """
+
+    def __init__(self, md5=True):
+        self.crc32c = 0
+        self.md5 = hashlib.md5() if md5 else None
+        self.nbytes = 0
+
+    def reset(self):
+        self.crc32c = 0
+        self.md5 = None if self.md5 is None else hashlib.md5()
+        self.nbytes = 0
+
+    def update(self, chunk):
+        self.crc32c = google_crc32c.extend(self.crc32c, chunk)
+        if self.md5 is not None:
+            self.md5.update(chunk)
+        self.nbytes += len(chunk)
+
+    def extend(self, other):
+        """
+        Extend digest with digest of bytes following those of this digest
+        """
+        self.md5 = other.md5 if (self.nbytes == 0) else None
+        self.crc32c = crc32c_combine(self.crc32c, other.crc32c, other.nbytes)
+        self.nbytes += other.nbytes
+
+    def to_dict(self):
+        """
+        Get base64 digests as dict(crc32c, md5_hash), where md5_hash is None
+        if not computed
+        """
+        return dict(
+            crc32c=encode(self.crc32c.to_bytes(4, "big")),
+            md5_hash=None if self.md5 is None else encode(self.md5.digest()),
+        )
+
+
+class DigestWriter:
+    """
+    Binary file object writing to path while updating digest of bytes
+    written, for writers streaming sequentially such as pq.ParquetWriter
+    """
+
+    def __init__(self, path, digest=None):
+        self.file = open(path, "wb")
+        self.digest = digest or Digest()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def tell(self):
+        return self.file.tell()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def update_from_file(digest, path, size=None, chunk_size=1024 * 1024):
+    """
+    Update digest with first size bytes of file at path, or all of them
+    """
+    with open(path, "rb") as file:
+        remaining = size
+        while (remaining is None) or (remaining > 0):
+            chunk = file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    return digest
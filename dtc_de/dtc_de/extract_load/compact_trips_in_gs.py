@@ -0,0 +1,705 @@
+"""
+Compact monthly trips files ingested to Cloud Storage into files of about a
+target size sorted by pickup datetime, per vehicle type and year
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+import time
+
+import aiofiles
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from dtc_de.extract_load import catalog, checksum, metrics, sinks, transform
+from dtc_de.extract_load import extract_load_trips_from_tlc_to_gs as extract_load
+
+
+COMPACTED_PREFIX = "compacted"  # read through reader manifests instead of "raw"
+TARGET_FILE_SIZE = 256 * 1024 * 1024  # bytes per compacted file, approximate
+SORT_RUN_SIZE = 256 * 1024 * 1024  # bytes of Arrow memory sorted at once
+RUN_BATCH_SIZE = 16 * 1024  # rows per record batch of sorted runs, one per run merging
+RUN_COMPRESSION = "lz4"  # fast codec of sorted runs spilled to local disk
+
+
+def get_sort_indices(table, sort_column):
+    return pc.sort_indices(table, sort_keys=[(sort_column, "ascending")])
+
+
+def write_run(batches, path, sort_column):
+    """
+    Sort record batches by sort_column and write them to Arrow IPC file at
+    path, in record batches of RUN_BATCH_SIZE rows
+    """
+    table = pa.Table.from_batches(batches)
+    table = table.take(get_sort_indices(table, sort_column))
+    options = pa.ipc.IpcWriteOptions(compression=RUN_COMPRESSION)
+    with pa.OSFile(path, "wb") as sink, \
+            pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table, max_chunksize=RUN_BATCH_SIZE)
+
+
+def sort_runs(
+    src, runs_dir, sort_column, schema=None, batch_size=transform.BATCH_SIZE, run_size=SORT_RUN_SIZE
+):
+    """
+    Split parquet file at src, cast to schema if defined, into runs sorted by
+    sort_column of about run_size bytes of Arrow memory each, written as
+    "BASENAME-N.arrow" files of runs_dir, so memory usage depends on run_size
+    rather than file size:
+        sort_runs("green_tripdata_2022-01.parquet", "runs", "lpep_pickup_datetime", schema)
+
+    Return (paths of runs, schema drift, see transform.CastPlan, stats of
+    transform, see transform.get_stats, with sort time).
+    """
+    stats = dict(transform.get_stats(src), sort=0.0)
+    parquet_file = pq.ParquetFile(src)
+    plan = None if schema is None else transform.get_cast_plan(parquet_file.schema_arrow, schema)
+    basename = os.path.splitext(os.path.basename(src))[0]
+    os.makedirs(runs_dir, exist_ok=True)
+
+    runs = []
+    buffered = []
+    nbytes = 0
+
+    def flush():
+        start = time.perf_counter()
+        path = f"{runs_dir}/{basename}-{len(runs)}.arrow"
+        write_run(buffered, path, sort_column)
+        runs.append(path)
+        stats["sort"] += time.perf_counter() - start
+
+    for batch in transform.iter_batches(parquet_file, plan, batch_size, stats):
+        buffered.append(batch)
+        nbytes += batch.nbytes
+        if nbytes >= run_size:
+            flush()
+            (buffered, nbytes) = ([], 0)
+    if len(buffered) > 0:
+        flush()
+
+    return (runs, transform.get_drift(plan), stats)
+
+
+def iter_run(path):
+    """
+    Iterate record batches of sorted run file at path, reading one at a time
+    """
+    with pa.OSFile(path, "rb") as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def merge_runs(runs, sort_column, stats=None):
+    """
+    Iterate tables of rows of sorted run files merged by sort_column, holding
+    one record batch per run. Each table holds rows of all runs up to the
+    smallest last key of held batches, sorted with vectorized Arrow compute:
+    rows after it in any run are not smaller, so tables follow each other in
+    order. Null keys come last, as sorted by default. Decode and sort times
+    are added to stats if defined.
+    """
+    readers = [iter_run(path) for path in runs]
+    held = [None] * len(readers)
+    while True:
+        start = time.perf_counter()
+        for (i, reader) in enumerate(readers):
+            while (reader is not None) and ((held[i] is None) or (held[i].num_rows == 0)):
+                held[i] = next(reader, None)
+                if held[i] is None:
+                    readers[i] = reader = None
+        active = [i for i in range(len(held)) if (held[i] is not None) and (held[i].num_rows > 0)]
+        decoded = time.perf_counter()
+        if len(active) == 0:
+            break
+
+        index = held[active[0]].schema.get_field_index(sort_column)
+        last_keys = pa.concat_arrays([
+            held[i].column(index).slice(held[i].num_rows - 1) for i in active])
+        frontier = pc.min(last_keys)
+
+        parts = []
+        for i in active:
+            batch = held[i]
+            if frontier.is_valid:
+                num_rows = pc.sum(pc.less_equal(batch.column(index), frontier)).as_py() or 0
+            else:
+                num_rows = batch.num_rows
+            parts.append(batch.slice(0, num_rows))
+            held[i] = batch.slice(num_rows)
+
+        table = pa.Table.from_batches(parts)
+        table = table.take(get_sort_indices(table, sort_column))
+        if stats is not None:
+            stats["decode"] += decoded - start
+            stats["sort"] += time.perf_counter() - decoded
+            stats["rows"] += table.num_rows
+        yield table
+
+
+class SizedParquetWriter:
+    """
+    Parquet writer rolling over to a new file "BASENAME-N.parquet" of
+    dest_dir once another row group as large as the last written one would
+    take the current one over target_file_size bytes, so files stay within
+    one row group of it.
+    Files are written through checksum.DigestWriter, listed by files as
+    dict(name, rows, bytes, digest).
+    """
+
+    def __init__(self, dest_dir, basename, schema, target_file_size=TARGET_FILE_SIZE, **options):
+        self.dest_dir = dest_dir
+        self.basename = basename
+        self.schema = schema
+        self.target_file_size = target_file_size
+        self.options = options
+        self.files = []
+        self._sink = None
+        self._writer = None
+        self._rows = 0
+
+    def write_table(self, table, row_group_size=transform.ROW_GROUP_SIZE):
+        """
+        Write table in row groups of row_group_size rows, rolling over
+        between row groups
+        """
+        for offset in range(0, table.num_rows, row_group_size):
+            if self._writer is None:
+                name = f"{self.basename}-{len(self.files)}.parquet"
+                self._sink = checksum.DigestWriter(f"{self.dest_dir}/{name}")
+                self._writer = pq.ParquetWriter(self._sink, self.schema, **self.options)
+                self._rows = 0
+
+            row_group = table.slice(offset, row_group_size)
+            size = self._sink.tell()
+            self._writer.write_table(row_group, row_group_size=row_group_size)
+            self._rows += row_group.num_rows
+            if 2 * self._sink.tell() - size > self.target_file_size:
+                self.close()
+
+    def close(self):
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._sink.close()
+        name = f"{self.basename}-{len(self.files)}.parquet"
+        self.files.append(dict(
+            name=name,
+            rows=self._rows,
+            bytes=os.path.getsize(f"{self.dest_dir}/{name}"),
+            digest=self._sink.digest.to_dict(),
+        ))
+        (self._sink, self._writer) = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def merge_runs_to_files(
+    runs,
+    dest_dir,
+    basename,
+    sort_column,
+    target_file_size=TARGET_FILE_SIZE,
+    writer_profile=None,
+    bytes_per_row=None,
+):
+    """
+    Merge sorted run files into parquet files of dest_dir of about
+    target_file_size bytes, encoded with writer_profile, see merge_runs and
+    SizedParquetWriter. Row groups are capped to rows fitting target file
+    size based on bytes_per_row of source files if defined, as in
+    transform.partition_parquet_file. Run files are deleted once merged.
+
+    Return (written files, see SizedParquetWriter, stats of merge, see
+    transform.get_stats, with sort time).
+    """
+    stats = dict(
+        started=time.time(), decode=0.0, sort=0.0, encode=0.0, rows=0,
+        bytes_in=sum(os.path.getsize(path) for path in runs), bytes_out=0,
+    )
+    os.makedirs(dest_dir, exist_ok=True)
+    if len(runs) == 0:
+        return ([], stats)
+
+    with pa.OSFile(runs[0], "rb") as source:
+        schema = pa.ipc.open_file(source).schema
+
+    profile = transform.get_writer_profile(writer_profile)
+    row_group_size = profile["row_group_size"]
+    if bytes_per_row:
+        row_group_size = max(1, min(row_group_size, int(target_file_size / bytes_per_row)))
+
+    batches = (
+        batch for table in merge_runs(runs, sort_column, stats) for batch in table.to_batches())
+    options = profile["options"]
+    with SizedParquetWriter(dest_dir, basename, schema, target_file_size, **options) as writer:
+        transform.write_batches(writer, batches, row_group_size, stats)
+    for path in runs:
+        os.remove(path)
+    stats["bytes_out"] = sum(f["bytes"] for f in writer.files)
+
+    return (writer.files, stats)
+
+
+def get_monthly_keys(keys, prefix, vehicle_type, years=None):
+    """
+    Group keys of monthly files of vehicle type directly under prefix by
+    year, among years if defined, skipping other objects such as hive
+    partitions
+    """
+    groups = {}
+    for key in keys:
+        parsed = catalog.parse_basename(key[len(prefix):])
+        if (parsed is None) or (parsed[0] != vehicle_type):
+            continue
+
+        (_, year, _) = parsed
+        if (years is None) or (year in years):
+            groups.setdefault(year, []).append(key)
+
+    return {year: sorted(group) for (year, group) in sorted(groups.items())}
+
+
+def get_fingerprint(sources, **params):
+    """
+    Get fingerprint of source objects [(key, info)], see sinks.Sink, and
+    compaction params, changing whenever any source object is rewritten
+    """
+    text = json.dumps(dict(
+        sources=[
+            [key, info["size"], info["crc32c"], info["metadata"].get("schema_version")]
+            for (key, info) in sources
+        ],
+        **params,
+    ), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+class Compaction:
+    """
+    Compaction of monthly files "SUBPATH/VEHICLE_TYPE_tripdata_YYYY-MM.parquet"
+    of sink, such as ingested to "raw/VEHICLE_TYPE/" by extract_load, into
+    files "compacted/VEHICLE_TYPE/YYYY/FINGERPRINT/VEHICLE_TYPE_tripdata_YYYY-N.parquet"
+    per year, cast to schema if defined, sorted by sort_column and of about
+    target_file_size bytes, encoded with writer_profile.
+
+    A year never needs to fit in memory: each monthly file is copied to a
+    local work directory and split into sorted runs of run_size bytes on
+    transform_executor (a process pool), at most workers files at a time,
+    and runs spilled to local disk are merged into compacted files in a
+    single pass, see sort_runs and merge_runs_to_files.
+
+    Compaction is idempotent: compacted objects of a year are written under
+    a generation prefix named by fingerprint of source objects and params,
+    see get_fingerprint, and listed in a manifest at
+    "manifests/compacted/VEHICLE_TYPE/YYYY.json" recording fingerprint in
+    its metadata, so a year is unchanged if incremental and fingerprint
+    matches, and a rerun after a failure rewrites the same objects.
+
+    Readers never list "compacted/", which holds objects of several
+    generations while a year is swapped, but read the reader manifest
+    "manifests/compacted/VEHICLE_TYPE.txt" naming the objects of the current
+    generation of every year, one URL per line, such as an external table
+    with file_set_spec_type NEW_LINE_DELIMITED_MANIFEST. Year manifest and
+    reader manifest are written once all compacted objects are uploaded,
+    swapping the generation in as single object writes, then objects of other
+    generations are deleted, also when a year is unchanged.
+    """
+
+    def __init__(
+        self,
+        sink,
+        vehicle_type,
+        subpath=None,
+        schema=None,
+        sort_column=None,
+        target_file_size=TARGET_FILE_SIZE,
+        run_size=SORT_RUN_SIZE,
+        batch_size=transform.BATCH_SIZE,
+        writer_profile=None,
+        transform_executor=None,
+        workers=1,
+        incremental=True,
+    ):
+        self.sink = sink
+        self.vehicle_type = vehicle_type
+        self.subpath = subpath or f"raw/{vehicle_type}"
+        self.schema = schema
+        self.sort_column = sort_column
+        self.target_file_size = target_file_size
+        self.run_size = run_size
+        self.batch_size = batch_size
+        self.writer_profile = writer_profile
+        self.transform_executor = transform_executor
+        self.workers = workers
+        self.incremental = incremental
+        self.schema_version = extract_load.get_schema_version(schema)
+        if writer_profile is not None:
+            self.schema_version += f"+{writer_profile}"
+        self.dest_subpath = f"{COMPACTED_PREFIX}/{vehicle_type}"
+
+    def get_manifest_name(self, year):
+        return f"{extract_load.MANIFEST_PREFIX}/{self.dest_subpath}/{year}.json"
+
+    def get_blob_prefix(self, year):
+        return f"{self.dest_subpath}/{year}/"
+
+    def get_reader_manifest_name(self):
+        return f"{extract_load.MANIFEST_PREFIX}/{self.dest_subpath}.txt"
+
+    async def list_years(self, years=None):
+        """
+        Get {year: keys of monthly files}, among years if defined
+        """
+        prefix = f"{self.subpath}/"
+        keys = await self.sink.list_keys(prefix)
+        return get_monthly_keys(keys, prefix, self.vehicle_type, years)
+
+    async def sort_source(self, key, tmp_dir, semaphore, file_metrics):
+        """
+        Copy monthly file at key to tmp_dir and split it into sorted runs,
+        return (paths of runs, rows)
+        """
+        loop = asyncio.get_running_loop()
+        file_basename = os.path.basename(key)
+        local_file = f"{tmp_dir}/{file_basename}"
+        async with semaphore:
+            with file_metrics.span("download", object=key) as span:
+                info = await self.sink.get_file(key, local_file)
+                if info is None:
+                    raise ValueError(f"Missing monthly file: {self.sink.get_url(key)}")
+                span["bytes"] = info["size"]
+            file_metrics.add(bytes_in=info["size"])
+            try:
+                (runs, drift, stats) = await loop.run_in_executor(
+                    self.transform_executor, transform.run_transform, sort_runs,
+                    local_file, f"{tmp_dir}/runs", self.sort_column, self.schema,
+                    self.batch_size, self.run_size,
+                )
+            finally:
+                os.remove(local_file)
+
+        extract_load.print_drift(file_basename, drift)
+        for stage in ("decode", "cast", "sort"):
+            file_metrics.add_span(stage, stats[stage], object=key)
+        file_metrics.add(rows=stats["rows"])
+        file_metrics.peak(rss=stats["peak_rss"])
+
+        return (runs, stats["rows"])
+
+    async def compact(self, year, keys, work_dir=None, file_metrics=None):
+        """
+        Compact monthly files at keys of year, return name of group or
+        extract_load.Unchanged if compacted objects are up to date
+        """
+        name = f"{self.vehicle_type}/{year}"
+        file_metrics = file_metrics or metrics.FileMetrics(name)
+        infos = await asyncio.gather(*[self.sink.get_info(key) for key in keys])
+        fingerprint = get_fingerprint(
+            list(zip(keys, infos)),
+            schema_version=self.schema_version,
+            sort_column=self.sort_column,
+            target_file_size=self.target_file_size,
+        )
+        manifest_name = self.get_manifest_name(year)
+        if self.incremental:
+            info = await self.sink.get_info(manifest_name)
+            if (info is not None) and (info["metadata"].get("source_fingerprint") == fingerprint):
+                manifest = json.loads(await self.sink.get_bytes(manifest_name))
+                await self.publish_reader_manifest(manifest["objects"])
+                await self.delete_stale(year, manifest["objects"])
+                return extract_load.Unchanged(name)
+
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.workers)
+        async with aiofiles.tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+            sorted_sources = await asyncio.gather(*[
+                self.sort_source(key, tmp_dir, semaphore, file_metrics) for key in keys])
+            runs = [path for (paths, _) in sorted_sources for path in paths]
+            rows = sum(num_rows for (_, num_rows) in sorted_sources)
+
+            basename = f"{self.vehicle_type}_tripdata_{year}"
+            (files, stats) = await loop.run_in_executor(
+                self.transform_executor, transform.run_transform, merge_runs_to_files,
+                runs, f"{tmp_dir}/compacted", basename, self.sort_column,
+                self.target_file_size, self.writer_profile,
+                sum(info["size"] for info in infos) / max(rows, 1),
+            )
+            file_metrics.peak(rss=stats["peak_rss"])
+            target = self.sink.get_url(self.dest_subpath)
+            for stage in ("decode", "sort", "encode"):
+                file_metrics.add_span(f"merge_{stage}", stats[stage], target=target)
+
+            metadata = dict(source_fingerprint=fingerprint, schema_version=self.schema_version)
+            prefix = f"{self.get_blob_prefix(year)}{fingerprint}"
+            blob_names = [f"{prefix}/{f['name']}" for f in files]
+            await asyncio.gather(*[
+                self.sink.put_file(
+                    f"{tmp_dir}/compacted/{f['name']}", blob_name, metadata, f["digest"],
+                    file_metrics)
+                for (f, blob_name) in zip(files, blob_names)
+            ])
+
+        await self.swap_manifest(year, keys, blob_names, metadata)
+        print(json.dumps(dict(
+            compacted=name,
+            sources=len(keys),
+            files=[
+                dict(object=blob_name, rows=f["rows"], bytes=f["bytes"])
+                for (f, blob_name) in zip(files, blob_names)
+            ],
+        )))
+
+        return name
+
+    async def swap_manifest(self, year, keys, blob_names, metadata):
+        """
+        Write manifest listing blob_names compacted from keys of year and
+        reader manifest, then delete other compacted objects of year, see
+        delete_stale
+        """
+        await self.sink.put_bytes(
+            self.get_manifest_name(year),
+            json.dumps(dict(sources=keys, objects=blob_names)).encode(),
+            metadata,
+            "application/json",
+        )
+        await self.publish_reader_manifest()
+        await self.delete_stale(year, blob_names)
+
+    async def publish_reader_manifest(self, blob_names=None):
+        """
+        Write reader manifest listing URLs of objects of all year manifests,
+        unless it already lists blob_names if defined, so a year whose
+        manifest was swapped by a run failing before publishing it is
+        published before objects of its previous generation are deleted
+        """
+        name = self.get_reader_manifest_name()
+        if blob_names is not None:
+            info = await self.sink.get_info(name)
+            if info is not None:
+                urls = set((await self.sink.get_bytes(name)).decode().splitlines())
+                if all(self.sink.get_url(key) in urls for key in blob_names):
+                    return
+
+        prefix = f"{extract_load.MANIFEST_PREFIX}/{self.dest_subpath}/"
+        keys = [key for key in await self.sink.list_keys(prefix) if key.endswith(".json")]
+        manifests = await asyncio.gather(*[self.sink.get_bytes(key) for key in keys])
+        data = "".join(
+            f"{self.sink.get_url(key)}\n"
+            for manifest in manifests for key in json.loads(manifest)["objects"]
+        )
+        await self.sink.put_bytes(name, data.encode(), None, "text/plain")
+
+    async def delete_stale(self, year, blob_names):
+        """
+        Delete compacted objects of year other than blob_names listed in its
+        manifest, of other generations or of failed runs, including objects
+        left by a run that failed between swapping manifest and deleting them
+        """
+        existing = await self.sink.list_keys(self.get_blob_prefix(year))
+        await self.sink.delete(sorted(set(existing) - set(blob_names)))
+
+
+async def compact_trips(
+    vehicle_types,
+    years=None,
+    bucket_name=None,
+    sink_url=None,
+    gcs_endpoint=None,
+    upload_strategy="chunked",
+    target_file_size=TARGET_FILE_SIZE,
+    run_size=SORT_RUN_SIZE,
+    batch_size=transform.BATCH_SIZE,
+    writer_profile=None,
+    projection=None,
+    transform_workers=None,
+    upload_workers=extract_load.UPLOAD_WORKERS,
+    work_dir=None,
+    incremental=True,
+    metrics_output=None,
+    metrics_textfile=None,
+):
+    """
+    Compact monthly files of vehicle_types ingested to Cloud Storage
+    bucket_name, or to sink at sink_url if defined, for all years found or
+    years if defined, one year at a time, see Compaction. Files are cast to
+    schema of vehicle type, projected to named projection if defined, see
+    extract_load.PROJECTIONS, and sorted by its pickup column.
+
+    Sorting runs on a process pool with transform_workers processes,
+    defaulting to the number of CPUs available to the container, and uploads
+    run on a thread pool limited to upload_workers concurrent uploads. Peak
+    memory is about transform_workers times twice run_size, while sorting
+    runs. Per-year spans and counters are recorded to metrics_output and
+    metrics_textfile if defined, see metrics.Recorder. Return per-year summary.
+    """
+    if transform_workers is None:
+        transform_workers = extract_load.get_available_cpus()
+
+    if (sink_url is None) and bucket_name:
+        sink_url = f"gs://{bucket_name}"
+
+    if work_dir:
+        os.makedirs(work_dir, exist_ok=True)
+
+    names = []
+    results = []
+    with extract_load.create_transform_executor(transform_workers) as transform_executor, \
+            concurrent.futures.ThreadPoolExecutor(upload_workers) as upload_executor, \
+            metrics.Recorder(metrics_output, metrics_textfile) as recorder:
+        sink = sinks.get_sink(sink_url, upload_executor, gcs_endpoint, upload_strategy)
+        for vehicle_type in extract_load.as_list(vehicle_types):
+            schema = extract_load.VEHICLE_TYPE_SCHEMA_MAP.get(vehicle_type)
+            sort_column = extract_load.VEHICLE_TYPE_PICKUP_COLUMN_MAP.get(vehicle_type)
+            if (schema is None) or (sort_column is None):
+                raise ValueError(
+                    f"Unknown schema or pickup column for vehicle type: {vehicle_type}")
+
+            columns = extract_load.PROJECTIONS[projection].get(vehicle_type) if projection else None
+            if columns is not None:
+                schema = transform.project_schema(schema, columns)
+
+            compaction = Compaction(
+                sink,
+                vehicle_type,
+                schema=schema,
+                sort_column=sort_column,
+                target_file_size=target_file_size,
+                run_size=run_size,
+                batch_size=batch_size,
+                writer_profile=writer_profile,
+                transform_executor=transform_executor,
+                workers=transform_workers,
+                incremental=incremental,
+            )
+            groups = await compaction.list_years(extract_load.as_list(years) if years else None)
+            print(f"Compacting {len(groups)} years of {compaction.subpath}...")
+            for (year, keys) in groups.items():
+                name = f"{vehicle_type}/{year}"
+                file_metrics = recorder.file(name)
+                try:
+                    result = await compaction.compact(year, keys, work_dir, file_metrics)
+                except Exception as error:
+                    error_message = f"{type(error).__name__}: {error}"
+                    recorder.emit(file_metrics, status="failed", error=error_message)
+                    result = error
+                else:
+                    unchanged = isinstance(result, extract_load.Unchanged)
+                    recorder.emit(file_metrics, status="unchanged" if unchanged else "succeeded")
+                names.append(name)
+                results.append(result)
+
+    return extract_load.summarize("Compacted", names, results)
+
+
+def main(
+    bucket_name=None,
+    sink_url=None,
+    vehicle_type="green",
+    year=None,
+    gcs_endpoint=None,
+    upload_strategy="chunked",
+    target_file_size=TARGET_FILE_SIZE,
+    run_size=SORT_RUN_SIZE,
+    batch_size=transform.BATCH_SIZE,
+    writer_profile=None,
+    projection=None,
+    transform_workers=None,
+    upload_workers=extract_load.UPLOAD_WORKERS,
+    work_dir=None,
+    force=False,
+    metrics_output=None,
+    metrics_textfile=None,
+):
+    """
+    Compact monthly files of "BUCKET_NAME/raw/vehicle_type/" into files of
+    about 256 MB sorted by pickup datetime under
+    "BUCKET_NAME/compacted/vehicle_type/", listed in reader manifest
+    "BUCKET_NAME/manifests/compacted/vehicle_type.txt", for all years found:
+        main(bucket_name="BUCKET_NAME", vehicle_type="fhvhv")
+
+    Define years and vehicle types:
+        main(bucket_name="BUCKET_NAME", vehicle_type=["green", "yellow"], year=[2021, 2022])
+
+    Years whose monthly files are unchanged since last compaction with same
+    params are skipped, unless forced:
+        main(bucket_name="BUCKET_NAME", vehicle_type="green", year=2022, force=True)
+
+    Compact files of a local directory with the same layout as the bucket,
+    see sinks.get_sink, spilling sorted runs to a work directory:
+        main(sink_url="file:///data/tlc", vehicle_type="green", work_dir="/mnt/scratch")
+
+    Encode compacted files with a writer profile, see transform.WRITER_PROFILES:
+        main(bucket_name="BUCKET_NAME", vehicle_type="yellow", writer_profile="bq-scan-optimized")
+    """
+    vehicle_types = extract_load.as_list(vehicle_type)
+    years = extract_load.as_list(year)
+    assert bucket_name or sink_url, "bucket_name or sink_url is required"
+    assert all(type(v) is str for v in vehicle_types), "vehicle_type must be str or list of str"
+    if year is not None:
+        assert all(type(y) is int for y in years), "year must be int or list of int"
+    assert (projection is None) or (projection in extract_load.PROJECTIONS), \
+        f"projection must be None or one of {list(extract_load.PROJECTIONS)}"
+    if writer_profile is not None:
+        transform.get_writer_profile(writer_profile)
+
+    return asyncio.run(compact_trips(
+        vehicle_types,
+        years=years if year is not None else None,
+        bucket_name=bucket_name,
+        sink_url=sink_url,
+        gcs_endpoint=gcs_endpoint,
+        upload_strategy=upload_strategy,
+        target_file_size=target_file_size,
+        run_size=run_size,
+        batch_size=batch_size,
+        writer_profile=writer_profile,
+        projection=projection,
+        transform_workers=transform_workers,
+        upload_workers=upload_workers,
+        work_dir=work_dir,
+        incremental=not force,
+        metrics_output=metrics_output,
+        metrics_textfile=metrics_textfile,
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bucket-name", default=None)
+    parser.add_argument("--sink-url", default=None)
+    parser.add_argument("--vehicle-type", required=True, nargs="+")
+    parser.add_argument("--year", default=None, type=int, nargs="+")
+    parser.add_argument("--gcs-endpoint", default=None)
+    parser.add_argument(
+        "--upload-strategy", default="chunked", choices=list(sinks.UPLOAD_STRATEGIES))
+    parser.add_argument("--target-file-size", default=TARGET_FILE_SIZE, type=int)
+    parser.add_argument("--run-size", default=SORT_RUN_SIZE, type=int)
+    parser.add_argument("--batch-size", default=transform.BATCH_SIZE, type=int)
+    parser.add_argument("--writer-profile", default=None, choices=list(transform.WRITER_PROFILES))
+    parser.add_argument("--projection", default=None, choices=list(extract_load.PROJECTIONS))
+    parser.add_argument("--transform-workers", default=None, type=int)
+    parser.add_argument("--upload-workers", default=extract_load.UPLOAD_WORKERS, type=int)
+    parser.add_argument("--work-dir", default=None)
+    parser.add_argument("--force", default=False, action="store_true")
+    parser.add_argument("--metrics-output", default=None)
+    parser.add_argument("--metrics-textfile", default=None)
+
+    args = vars(parser.parse_args())
+    print("Args:", args)
+    summary = main(**args)
+    if summary["failed"]:
+        sys.exit(1)
@@ -0,0 +1,403 @@
+"""
+HTTP downloads streamed to files, either as a single stream or as concurrent
+segments requested with Range headers, resuming interrupted transfers from
+their last written byte
+"""
+
+import asyncio
+import json
+import os
+import random
+
+import aiofiles
+import aiohttp
+
+from dtc_de.extract_load import checksum
+
+
+CHUNK_SIZE = 1024 * 1024  # bytes buffered per transfer while streaming
+SEGMENT_SIZE = 32 * 1024 * 1024  # bytes per Range request
+SEGMENTS = 4  # concurrent Range requests per file
+RETRIES = 5  # retries per stream or segment after first attempt
+BACKOFF = 1  # seconds, base of exponential backoff between retries
+BACKOFF_MAX = 60  # seconds
+
+RETRYABLE_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError)
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class Progress:
+    """
+    Bytes written by a stream, kept up to date while streaming so that
+    interrupted transfers know where to resume, and their digest if defined,
+    see checksum.Digest
+    """
+
+    def __init__(self, digest=None):
+        self.nbytes = 0
+        self.digest = digest
+
+    def reset(self):
+        self.nbytes = 0
+        if self.digest is not None:
+            self.digest.reset()
+
+
+def is_retryable(error):
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRYABLE_STATUSES
+
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+async def retry(fn, retries=RETRIES, backoff=BACKOFF, on_retry=None):
+    """
+    Await fn() retrying on transient errors with exponential backoff and full
+    jitter: sleep random time up to min(BACKOFF_MAX, backoff * 2 ** attempt).
+    on_retry(error) is called before each retry if defined.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await fn()
+        except Exception as error:
+            if (attempt == retries) or not is_retryable(error):
+                raise
+
+            delay = random.uniform(0, min(BACKOFF_MAX, backoff * 2 ** attempt))
+            print(f"Retrying in {delay:.1f}s after error: {error!r}")
+            if on_retry is not None:
+                on_retry(error)
+            await asyncio.sleep(delay)
+
+
+async def stream_to_file(res, file, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Write response body to file in chunks so at most chunk_size bytes are held
+    in memory. Return number of bytes written, also added to progress if
+    defined, along with digest of progress.
+    """
+    nbytes = 0
+    async for chunk in res.content.iter_chunked(chunk_size):
+        await file.write(chunk)
+        nbytes += len(chunk)
+        if progress is not None:
+            progress.nbytes += len(chunk)
+            if progress.digest is not None:
+                progress.digest.update(chunk)
+
+    return nbytes
+
+
+async def head(session, url):
+    """
+    Get metadata of file at url through a HEAD request
+    """
+    async with session.head(url) as res:
+        res.raise_for_status()
+        return dict(
+            accept_ranges=res.headers.get("Accept-Ranges"),
+            content_length=res.headers.get("Content-Length"),
+            etag=res.headers.get("ETag"),
+            last_modified=res.headers.get("Last-Modified"),
+        )
+
+
+def get_validator(metadata):
+    """
+    Get validator of file version from metadata returned by head() for
+    If-Range requests: its strong ETag, or its Last-Modified otherwise, or
+    None if neither is defined
+    """
+    etag = (metadata or {}).get("etag")
+    if (etag is not None) and not etag.startswith("W/"):
+        return etag
+
+    return (metadata or {}).get("last_modified")
+
+
+def get_range_size(metadata):
+    """
+    Get file size from metadata returned by head(), or None if server does not
+    advertise support for byte Range requests
+    """
+    accept_ranges = (metadata.get("accept_ranges") or "").lower()
+    content_length = metadata.get("content_length")
+    if (accept_ranges != "bytes") or (content_length is None):
+        return None
+
+    return int(content_length)
+
+
+def read_validator(path):
+    """
+    Get validator of file version whose bytes partial file at path holds,
+    recorded in "PATH.validator", or None if unknown
+    """
+    if not os.path.exists(f"{path}.validator"):
+        return None
+
+    with open(f"{path}.validator") as file:
+        return file.read()
+
+
+def write_validator(path, validator):
+    if validator is None:
+        remove_validator(path)
+        return
+
+    with open(f"{path}.validator", "w") as file:
+        file.write(validator)
+
+
+def remove_validator(path):
+    if os.path.exists(f"{path}.validator"):
+        os.remove(f"{path}.validator")
+
+
+async def download_stream(
+    session,
+    url,
+    path,
+    chunk_size=CHUNK_SIZE,
+    progress=None,
+    validator=None,
+    size=None,
+):
+    """
+    Download url to path as a single stream. If a partial file exists at path,
+    download resumes from its size through a `Range: bytes=N-` request,
+    conditioned by `If-Range` with validator of the version partial file was
+    downloaded from, see read_validator, so a file changed at source since
+    is sent whole. A partial file without recorded validator cannot be
+    matched to a version, so it is downloaded again from scratch, as is a
+    partial file the server answers 416 for while its size is not size, the
+    Content-Length of file if known. Download restarts from scratch if server
+    does not honor range, resetting bytes and digest of progress, recording
+    validator of file version downloaded if defined, see get_validator.
+    Return number of bytes downloaded by this call.
+    """
+    progress = progress or Progress()
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    partial_validator = read_validator(path) if offset > 0 else None
+    if partial_validator is None:
+        offset = 0
+
+    headers = {}
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = partial_validator
+    async with session.get(url, headers=headers) as res:
+        if (offset > 0) and (res.status == 416):
+            if (size is not None) and (offset == size):
+                return 0  # partial file is already complete
+
+            remove_validator(path)
+            os.remove(path)
+            progress.reset()
+            return await download_stream(session, url, path, chunk_size, progress, validator, size)
+
+        res.raise_for_status()
+        if res.status != 206:
+            offset = 0
+            progress.reset()
+            write_validator(path, validator)
+
+        async with aiofiles.open(path, "r+b" if offset > 0 else "wb") as f:
+            await f.seek(offset)
+            return await stream_to_file(res, f, chunk_size, progress)
+
+
+async def download_range(
+    session,
+    url,
+    path,
+    start,
+    end,
+    chunk_size=CHUNK_SIZE,
+    progress=None,
+    validator=None,
+):
+    """
+    Download inclusive byte range [start, end] of url into same offsets of
+    existing file at path, conditioned by `If-Range: validator` if defined
+    """
+    headers = {"Range": f"bytes={start}-{end}"}
+    if validator is not None:
+        headers["If-Range"] = validator
+    async with session.get(url, headers=headers) as res:
+        res.raise_for_status()
+        if res.status != 206:
+            raise ValueError(f"Range request not honored by server, or file changed at source: {url}")
+
+        async with aiofiles.open(path, "r+b") as f:
+            await f.seek(start)
+            return await stream_to_file(res, f, chunk_size, progress)
+
+
+def read_segments(path, validator, size, segment_size):
+    """
+    Get {start: (crc32c, nbytes)} of segments completed by a previous
+    segmented download of the same file version to path, recorded in
+    "PATH.segments", or {} if there is none to resume
+    """
+    segments_path = f"{path}.segments"
+    if (validator is None) or not os.path.exists(segments_path) or not os.path.exists(path):
+        return {}
+
+    with open(segments_path) as file:
+        state = json.load(file)
+    if (state["validator"], state["size"], state["segment_size"]) != (validator, size, segment_size) \
+            or os.path.getsize(path) != size:
+        return {}
+
+    return {int(start): tuple(segment) for (start, segment) in state["segments"].items()}
+
+
+def write_segments(path, validator, size, segment_size, completed):
+    """
+    Record completed segments of file at path in "PATH.segments", replaced
+    atomically, see read_segments
+    """
+    segments_path = f"{path}.segments"
+    state = dict(
+        validator=validator,
+        size=size,
+        segment_size=segment_size,
+        segments={str(start): list(segment) for (start, segment) in completed.items()},
+    )
+    with open(f"{segments_path}.tmp", "w") as file:
+        json.dump(state, file)
+    os.replace(f"{segments_path}.tmp", segments_path)
+
+
+async def download_segmented(
+    session,
+    url,
+    path,
+    size,
+    chunk_size=CHUNK_SIZE,
+    segment_size=SEGMENT_SIZE,
+    segments=SEGMENTS,
+    retries=RETRIES,
+    backoff=BACKOFF,
+    on_retry=None,
+    digest=None,
+    validator=None,
+):
+    """
+    Download file of known size from url to path through Range requests of
+    segment_size bytes, up to `segments` at a time, each one written at its
+    offset in a file preallocated to size. Each segment is retried on its own,
+    resuming from its last written byte. CRC32C of each segment is computed
+    while streaming and combined into digest if defined.
+
+    If validator of file version is defined, see get_validator, requests are
+    conditioned by it and completed segments are recorded next to the file,
+    so a failed download keeps file and is resumed by next call fetching only
+    missing segments of the same version. Otherwise a failed download leaves
+    holes in the file, so file is removed rather than kept for resuming.
+    Return number of bytes downloaded by this call.
+    """
+    completed = read_segments(path, validator, size, segment_size)
+    if len(completed) == 0:
+        async with aiofiles.open(path, "wb") as f:
+            await f.truncate(size)
+
+    semaphore = asyncio.Semaphore(segments)
+
+    async def download_segment(start):
+        end = min(start + segment_size, size) - 1
+        progress = Progress(checksum.Digest(md5=False))
+        async with semaphore:
+            await retry(
+                lambda: download_range(
+                    session, url, path, start + progress.nbytes, end,
+                    chunk_size, progress, validator,
+                ),
+                retries,
+                backoff,
+                on_retry,
+            )
+
+        completed[start] = (progress.digest.crc32c, progress.nbytes)
+        if validator is not None:
+            write_segments(path, validator, size, segment_size, completed)
+        return progress
+
+    starts = range(0, size, segment_size)
+    try:
+        progresses = await asyncio.gather(*[
+            download_segment(start) for start in starts if start not in completed])
+    except BaseException:
+        if validator is None:
+            os.remove(path)
+        raise
+
+    if os.path.exists(f"{path}.segments"):
+        os.remove(f"{path}.segments")
+    if digest is not None:
+        for start in starts:
+            segment_digest = checksum.Digest(md5=False)
+            (segment_digest.crc32c, segment_digest.nbytes) = completed[start]
+            digest.extend(segment_digest)
+
+    return sum(progress.nbytes for progress in progresses)
+
+
+async def download(
+    session,
+    url,
+    path,
+    chunk_size=CHUNK_SIZE,
+    segment_size=SEGMENT_SIZE,
+    segments=SEGMENTS,
+    retries=RETRIES,
+    backoff=BACKOFF,
+    metadata=None,
+    on_retry=None,
+    digest=None,
+):
+    """
+    Download url to path, as concurrent segments if file is larger than
+    segment_size and server supports Range requests, or as a single stream
+    otherwise. Transient errors are retried with backoff, resuming from last
+    written byte. Return number of bytes downloaded.
+
+    If digest is defined, it is updated with digest of file while streaming,
+    see checksum.Digest, only reading back a partial file being resumed. MD5
+    is only computed for single streams, since segments arrive out of order.
+
+    metadata returned by head() is requested if segments are enabled and it
+    is not provided. Resumed transfers are conditioned by validator of
+    metadata if provided, recorded next to partial files, so a file changed
+    at source is not appended to a partial file of its previous version, see
+    get_validator. on_retry is passed to retry().
+    """
+    size = None
+    if segments > 1:
+        if metadata is None:
+            metadata = await retry(lambda: head(session, url), retries, backoff, on_retry)
+        size = get_range_size(metadata)
+
+    validator = get_validator(metadata)
+    content_length = (metadata or {}).get("content_length")
+    if (size is None) or (size <= segment_size):
+        if (digest is not None) and os.path.exists(path):
+            checksum.update_from_file(digest, path)
+        progress = Progress(digest)
+        await retry(
+            lambda: download_stream(
+                session, url, path, chunk_size, progress, validator,
+                None if content_length is None else int(content_length),
+            ),
+            retries,
+            backoff,
+            on_retry,
+        )
+        remove_validator(path)
+        return progress.nbytes
+
+    return await download_segmented(
+        session, url, path, size, chunk_size, segment_size, segments,
+        retries, backoff, on_retry, digest, validator,
+    )
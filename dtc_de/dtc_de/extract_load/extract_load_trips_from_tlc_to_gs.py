@@ -4,21 +4,32 @@ Extract trips parquet files from TCL and load them to Google Cloud Storage
 
 import argparse
 import asyncio
-import datetime as dt
-import io
+import base64
+import concurrent.futures
+import json
+import math
+import multiprocessing
 import os
 import re
+import shutil
+import sys
+import tempfile
+import time
 
 import aiofiles
-import aiohttp
 import pyarrow as pa
-import pyarrow.parquet as pq
 
-from google.cloud import storage
+from dtc_de.extract_load import catalog, checksum, download, footer, metrics, scheduler, sinks, transform, zones
 
 
-BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data"
-WEB_URL = "https://www.nyc.gov/site/tlc/about/tlc-trip-record-data.page"
+UPLOAD_WORKERS = 8  # concurrent uploads, within default HTTP pool size of storage client
+# Start method of transform processes: not forked from the event loop process
+# with its threads, open sockets and aiohttp session
+TRANSFORM_START_METHOD = "forkserver"
+SOURCE_METADATA_KEYS = ("content_length", "etag", "last_modified")
+MANIFEST_PREFIX = "manifests"  # outside data paths read by external tables
+QUARANTINE_METADATA_KEY = "quarantine_object"  # quarantine object written along a plain object
+MD5_ETAG_EXP = re.compile(r'"?([0-9a-f]{32})"?')
 
 VEHICLE_TYPE_SCHEMA_MAP = {
     "green": pa.schema([
@@ -63,77 +74,1131 @@ VEHICLE_TYPE_SCHEMA_MAP = {
         ("total_amount", pa.float64()),
         ("congestion_surcharge", pa.float64()),
         ("airport_fee", pa.float64()),
-    ])
+    ]),
+    "fhv": pa.schema([
+        ("dispatching_base_num", pa.string()),
+        ("pickup_datetime", pa.timestamp("s")),
+        ("dropOff_datetime", pa.timestamp("s")),
+        ("PUlocationID", pa.int64()),
+        ("DOlocationID", pa.int64()),
+        ("SR_Flag", pa.int64()),
+        ("Affiliated_base_number", pa.string()),
+    ]),
+    "fhvhv": pa.schema([
+        ("hvfhs_license_num", pa.string()),
+        ("dispatching_base_num", pa.string()),
+        ("originating_base_num", pa.string()),
+        ("request_datetime", pa.timestamp("s")),
+        ("on_scene_datetime", pa.timestamp("s")),
+        ("pickup_datetime", pa.timestamp("s")),
+        ("dropoff_datetime", pa.timestamp("s")),
+        ("PULocationID", pa.int64()),
+        ("DOLocationID", pa.int64()),
+        ("trip_miles", pa.float64()),
+        ("trip_time", pa.int64()),
+        ("base_passenger_fare", pa.float64()),
+        ("tolls", pa.float64()),
+        ("bcf", pa.float64()),
+        ("sales_tax", pa.float64()),
+        ("congestion_surcharge", pa.float64()),
+        ("airport_fee", pa.float64()),
+        ("tips", pa.float64()),
+        ("driver_pay", pa.float64()),
+        ("shared_request_flag", pa.string()),
+        ("shared_match_flag", pa.string()),
+        ("access_a_ride_flag", pa.string()),
+        ("wav_request_flag", pa.string()),
+        ("wav_match_flag", pa.string()),
+    ]),
 }
 
+# Named projections of columns to ingest per vehicle type, where "dbt" keeps
+# columns read by staging models stg_*_trips.sql, as named in their queries.
+# Vehicle types missing in a projection keep all columns.
+PROJECTIONS = {
+    "dbt": {
+        "green": [
+            "vendorid", "ratecodeid", "pulocationid", "dolocationid",
+            "lpep_pickup_datetime", "lpep_dropoff_datetime",
+            "store_and_fwd_flag", "passenger_count", "trip_distance", "trip_type",
+            "fare_amount", "extra", "mta_tax", "tip_amount", "tolls_amount", "ehail_fee",
+            "improvement_surcharge", "total_amount", "payment_type", "congestion_surcharge",
+        ],
+        "yellow": [
+            "vendorid", "ratecodeid", "pulocationid", "dolocationid",
+            "tpep_pickup_datetime", "tpep_dropoff_datetime",
+            "store_and_fwd_flag", "passenger_count", "trip_distance",
+            "fare_amount", "extra", "mta_tax", "tip_amount", "tolls_amount",
+            "improvement_surcharge", "total_amount", "payment_type", "congestion_surcharge",
+        ],
+        "fhv": [
+            "affiliated_base_number", "dispatching_base_num", "dolocationid", "pulocationid",
+            "dropoff_datetime", "pickup_datetime", "sr_flag",
+        ],
+    },
+}
+
+# Columns identifying a trip, as deduplicated by staging models
+VEHICLE_TYPE_DEDUP_COLUMNS_MAP = {
+    "green": ["VendorID", "lpep_pickup_datetime"],
+    "yellow": ["VendorID", "tpep_pickup_datetime"],
+}
+
+VEHICLE_TYPE_PICKUP_COLUMN_MAP = {
+    "green": "lpep_pickup_datetime",
+    "yellow": "tpep_pickup_datetime",
+    "fhv": "pickup_datetime",
+    "fhvhv": "pickup_datetime",
+}
+
+
+def get_available_cpus():
+    """
+    Get number of CPUs available to process considering CPU affinity and
+    cgroup v2 CPU quota as set by container runtimes e.g. Cloud Run
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as file:
+            quota, period = file.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+
+    return cpus
+
+
+def create_transform_executor(workers):
+    """
+    Create process pool of workers for CPU-bound transforms, started with
+    TRANSFORM_START_METHOD
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context(TRANSFORM_START_METHOD))
+
+
+def verify_etag(file_basename, digest, etag):
+    """
+    Raise ValueError if MD5 of downloaded file does not match its source ETag,
+    when ETag is a plain MD5 as for objects not uploaded in parts to S3 behind
+    CloudFront. Other ETags, or digests without MD5, are not verified.
+    """
+    match = MD5_ETAG_EXP.fullmatch(etag or "")
+    if (match is None) or (digest["md5_hash"] is None):
+        return
+
+    md5_hex = base64.b64decode(digest["md5_hash"]).hex()
+    if md5_hex != match.group(1):
+        raise ValueError(f"MD5 {md5_hex} of {file_basename} does not match source ETag {etag}")
+
+
+class Unchanged(str):
+    """
+    Basename of a file skipped because it is unchanged at destination
+    """
+
+
+def get_schema_version(schema):
+    """
+    Get fingerprint of schema applied to ingested files, or "raw" if undefined
+    """
+    if schema is None:
+        return "raw"
+
+    return transform.get_schema_fingerprint(schema)
+
+
+def get_ingestion_metadata(source_metadata, schema_version):
+    """
+    Get object metadata recording source file version and applied schema
+    version of an ingested file
+    """
+    metadata = {
+        f"source_{key}": source_metadata[key]
+        for key in SOURCE_METADATA_KEYS
+        if source_metadata.get(key) is not None
+    }
+    metadata["schema_version"] = schema_version
+
+    return metadata
+
+
+def print_drift(file_basename, drift):
+    if drift is not None:
+        print(json.dumps(dict(file=file_basename, schema_drift=drift)))
 
-async def download_single_file(session, url, dest):
-    async with session.get(url) as res:
-        data = await res.read()
 
+def is_unchanged(info, metadata):
+    """
+    Check whether existing object of info, see sinks.Sink, was ingested from
+    same source file version with same schema version as described by
+    metadata. Source files without ETag nor Last-Modified are always
+    considered as changed.
+    """
+    if (info is None) or (not info["metadata"]):
+        return False
+
+    if ("source_etag" not in metadata) and ("source_last_modified" not in metadata):
+        return False
+
+    return all(info["metadata"].get(key) == value for key, value in metadata.items())
+
+
+def write_source_metadata(path, source_metadata):
+    """
+    Record source file version downloaded to path in "PATH.source.json", so
+    a downloaded file kept in work directory is reused only for same version
+    """
+    with open(f"{path}.source.json", "w") as file:
+        json.dump({key: source_metadata.get(key) for key in SOURCE_METADATA_KEYS}, file)
+
+
+def remove_downloaded(path):
+    for file in (path, f"{path}.source.json"):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def is_downloaded(path, source_metadata):
+    """
+    Check whether file at path was completely downloaded from same source file
+    version as described by source_metadata, see write_source_metadata. Source
+    files without ETag nor Last-Modified are always considered as changed.
+    """
+    if not (os.path.exists(path) and os.path.exists(f"{path}.source.json")):
+        return False
+
+    if (source_metadata.get("etag") is None) and (source_metadata.get("last_modified") is None):
+        return False
+
+    with open(f"{path}.source.json") as file:
+        recorded = json.load(file)
+    if any(recorded.get(key) != source_metadata.get(key) for key in SOURCE_METADATA_KEYS):
+        return False
+
+    content_length = source_metadata.get("content_length")
+    return (content_length is None) or (os.path.getsize(path) == int(content_length))
+
+
+async def download_single_file(
+    session,
+    limiter,
+    url,
+    dest,
+    chunk_size=download.CHUNK_SIZE,
+    segment_size=download.SEGMENT_SIZE,
+    segments=download.SEGMENTS,
+    retries=download.RETRIES,
+    backoff=download.BACKOFF,
+    metadata=None,
+    file_metrics=None,
+    memory=None,
+    digest=None,
+):
+    """
+    Download file from url to dest directory as a transfer admitted by limiter,
+    and by memory budget if defined for its streaming buffers of chunk_size
+    bytes per segment, bounded by Content-Length, and for Content-Length of
+    downloaded file if dest is on an in-memory filesystem, kept reserved until
+    file is released, see scheduler.MemoryBudget. Large files are downloaded as
+    concurrent Range segments and transient errors are retried, see
+    download.download. Download is recorded as a span of file_metrics if
+    defined, with retries and time waiting for admission.
+
+    File is written as "BASENAME.part" and renamed when complete, so a partial
+    file left by a failed run is resumed by next run instead of downloaded again.
+
+    digest is updated while downloading if defined, see download.download, and
+    a file whose MD5 does not match source ETag is removed, see verify_etag.
+    """
     file_basename = os.path.basename(url)
-    async with aiofiles.open(f"{dest}/{file_basename}", "wb") as f:
-        await f.write(data)
+    part_file = f"{dest}/{file_basename}.part"
+    file_metrics = file_metrics or metrics.FileMetrics(file_basename)
+    memory = memory or scheduler.MemoryBudget()
+    estimate = chunk_size * max(segments, 1)
+    files = None
+    if (metadata is not None) and (metadata.get("content_length") is not None):
+        estimate = min(estimate, int(metadata["content_length"]))
+        files = {f"{dest}/{file_basename}": int(metadata["content_length"])}
+
+    async with memory.reserve(estimate, files) as reservation, limiter.transfer() as transfer:
+        file_metrics.add(queue_wait=reservation.queue_wait + transfer.queue_wait)
+        with file_metrics.span("download") as span:
+            transfer.nbytes = await download.download(
+                session, url, part_file,
+                chunk_size, segment_size, segments, retries, backoff, metadata,
+                on_retry=lambda error: file_metrics.add(retries=1),
+                digest=digest,
+            )
+            span["bytes"] = transfer.nbytes
+            if digest is not None:
+                span.update(digest.to_dict())
+        file_metrics.add(bytes_in=transfer.nbytes)
+
+    if digest is not None:
+        try:
+            verify_etag(file_basename, digest.to_dict(), (metadata or {}).get("etag"))
+        except ValueError:
+            os.remove(part_file)
+            await memory.release_files(f"{dest}/{file_basename}")
+            raise
+
+    os.replace(part_file, f"{dest}/{file_basename}")
 
     return file_basename
 
 
-async def download_files(urls, dest):
-    async with aiohttp.ClientSession() as session:
-        downloads = [download_single_file(session, url, dest) for url in urls]
-        files = await asyncio.gather(*downloads, return_exceptions=True)
+def summarize(action, urls, results):
+    """
+    Print and return per-file summary of gathered results, where exceptions
+    are failures and Unchanged results are skipped files
+    """
+    succeeded = []
+    skipped = []
+    failed = {}
+    for url, result in zip(urls, results):
+        if isinstance(result, BaseException):
+            failed[url] = f"{type(result).__name__}: {result}"
+        elif isinstance(result, Unchanged):
+            skipped.append(str(result))
+        else:
+            succeeded.append(result)
 
-    print(f"Downloaded to {dest}: {files}")
+    print(f"{action}: {len(succeeded)} succeeded, {len(skipped)} unchanged, {len(failed)} failed")
+    for file_basename in succeeded:
+        print(f"  OK {file_basename}")
+    for file_basename in skipped:
+        print(f"  UNCHANGED {file_basename}")
+    for url, error in failed.items():
+        print(f"  FAILED {url}: {error}")
 
+    return dict(succeeded=succeeded, skipped=skipped, failed=failed)
 
-async def ingest_single_file(session, url, bucket, subpath, schema=None):
-    async with session.get(url) as res:
-        data = await res.read()
 
-    async with aiofiles.tempfile.NamedTemporaryFile("wb") as local_file:
-        if schema is None:
-            await local_file.write(data)
-        else:
-            table = pq.read_table(io.BytesIO(data)).cast(schema)
-            pq.write_table(table, local_file.name)
+class BucketTarget:
+    """
+    Target ingesting files to subpath of sink, such as a Cloud Storage bucket,
+    see sinks.get_sink, cast by record batches if schema is defined and
+    encoded with writer_profile if defined. Files are uploaded as downloaded
+    if neither is defined and rows are not filtered.
 
-        file_basename = os.path.basename(url)
-        blob = bucket.blob(f"{subpath}/{file_basename}")
-        blob.upload_from_filename(local_file.name)
+    Rows repeating dedup_columns values are removed if dedup_columns is
+    defined, and rows whose month_column is outside month of file are removed
+    if month_column is defined, and uploaded to "QUARANTINE_SUBPATH/BASENAME"
+    if quarantine_subpath is defined, see transform.RowFilter. Quarantine
+    objects are recorded in metadata of plain objects, or listed in manifest
+    if partitioned, so one left by a previous ingestion is deleted when a file
+    is ingested again without out of month rows.
+
+    If compact, schema fields are cast to narrow integers and dictionary
+    encoded strings where values of each file fit, see
+    transform.fit_compact_schema. If zone_lookup is defined, borough and zone
+    of pickup and dropoff locations are added from taxi zone lookup CSV file
+    at that path, see zones.ZoneEnrichment.
+
+    If partition_column is defined, each file is split into hive partitions
+    "SUBPATH/pickup_date=YYYY-MM-DD/" by date of partition_column, with files
+    of about target_file_size bytes, see transform.partition_parquet_file.
+    Written objects of each source file are listed in a manifest object at
+    "manifests/SUBPATH/BASENAME.json", used for replacing stale objects on
+    re-ingestion. Objects of the other layout, left by ingesting file with
+    partitioning switched, are deleted once file is written.
+
+    Uploaded object metadata, or manifest metadata if partitioned, records
+    source ETag, Last-Modified, and Content-Length, and applied schema version.
+    If incremental, files whose existing object metadata matches source
+    metadata are unchanged.
+
+    Casting is CPU-bound so it runs on transform_executor (a process pool) to
+    keep the event loop free for other transfers, or on default executor
+    threads if undefined, while sink runs its blocking uploads. Transforms
+    are admitted by memory budget if defined, based on estimate from footer
+    of downloaded file, see transform.estimate_memory, plus size of
+    downloaded file as estimated size of transformed files, kept reserved
+    until they are released with tmp_dir if on an in-memory filesystem. Decode, cast, enrich,
+    encode, and upload times are recorded as spans of file metrics.
+    """
+
+    download_dir = None
+
+    def __init__(
+        self,
+        sink,
+        subpath,
+        schema=None,
+        batch_size=transform.BATCH_SIZE,
+        transform_executor=None,
+        incremental=True,
+        partition_column=None,
+        target_file_size=transform.TARGET_FILE_SIZE,
+        writer_profile=None,
+        memory=None,
+        dedup_columns=None,
+        month_column=None,
+        quarantine_subpath=None,
+        compact=False,
+        zone_lookup=None,
+    ):
+        self.sink = sink
+        self.subpath = subpath
+        self.schema = schema
+        self.batch_size = batch_size
+        self.transform_executor = transform_executor
+        self.incremental = incremental
+        self.partition_column = partition_column
+        self.target_file_size = target_file_size
+        self.writer_profile = writer_profile
+        self.memory = memory
+        self.dedup_columns = dedup_columns
+        self.month_column = month_column
+        self.quarantine_subpath = quarantine_subpath
+        self.compact = compact and (schema is not None)
+        self.zone_lookup = zone_lookup
+        self.schema_version = get_schema_version(schema)
+        if partition_column is not None:
+            self.schema_version += f"+{transform.PARTITION_KEY}"
+        if writer_profile is not None:
+            self.schema_version += f"+{writer_profile}"
+        if dedup_columns is not None:
+            self.schema_version += "+dedup"
+        if month_column is not None:
+            self.schema_version += "+month"
+        if self.compact:
+            self.schema_version += "+compact"
+        if zone_lookup is not None:
+            self.schema_version += f"+zones-{zones.get_lookup_version(zone_lookup)}"
+        self.name = sink.get_url(subpath)
+
+    def get_blob_name(self, file_basename):
+        """
+        Get name of object whose metadata describes ingestion of file
+        """
+        if self.partition_column is None:
+            return f"{self.subpath}/{file_basename}"
+
+        return f"{MANIFEST_PREFIX}/{self.subpath}/{file_basename}.json"
+
+    async def is_unchanged(self, file_basename, source_metadata):
+        if not self.incremental:
+            return False
+
+        info = await self.sink.get_info(self.get_blob_name(file_basename))
+        metadata = get_ingestion_metadata(source_metadata, self.schema_version)
+
+        return is_unchanged(info, metadata)
+
+    def preflight(self, probe):
+        """
+        Get estimated transform memory in bytes and schema drift, or None, of
+        file from its footer probe, see footer.probe_footer
+        """
+        drift = None
+        if self.schema is not None:
+            plan = transform.get_cast_plan(probe["schema"], self.schema)
+            drift = plan.drift if plan.has_drift() else None
+
+        memory = transform.estimate_metadata_memory(
+            probe["metadata"], self.batch_size, self.writer_profile,
+            self.partition_column is not None, self.get_whole_columns(),
+        )
+        return dict(memory=memory, drift=drift)
+
+    def get_whole_columns(self):
+        """
+        Get names of columns read for whole files by row filter and compact
+        schema, see transform.get_whole_columns
+        """
+        filter_columns = [*(self.dedup_columns or []), *([self.month_column] if self.month_column else [])]
+        return transform.get_whole_columns(self.schema, filter_columns, self.compact)
+
+    def get_row_filter(self, file_basename):
+        """
+        Get row filter of file, or None if rows are not filtered
+        """
+        if (self.dedup_columns is None) and (self.month_column is None):
+            return None
+
+        parsed = catalog.parse_basename(file_basename)
+        if parsed is None:
+            raise ValueError(f"Unknown month of file: {file_basename}")
+
+        (_, year, month) = parsed
+        return transform.RowFilter(year, month, self.month_column, self.dedup_columns)
+
+    def get_quarantine_file(self, file_basename, tmp_dir):
+        """
+        Get local path of out of month rows of file, or None if dropped
+        """
+        if (self.month_column is None) or (self.quarantine_subpath is None):
+            return None
+
+        return f"{tmp_dir}/quarantine_{file_basename}"
+
+    async def upload_quarantine(self, quarantine_file, file_basename, metadata, file_metrics):
+        """
+        Upload out of month rows of file if any, return object name or None
+        """
+        if (quarantine_file is None) or not os.path.exists(quarantine_file):
+            return None
+
+        blob_name = f"{self.quarantine_subpath}/{file_basename}"
+        await self.sink.put_file(quarantine_file, blob_name, metadata, file_metrics=file_metrics)
+        return blob_name
+
+    async def transform(self, fn, raw_file, output, *args, file_metrics):
+        """
+        Run transform fn(raw_file, output, *args) on transform executor once
+        admitted by memory budget, with size of raw file as estimated size of
+        output file or directory, recording its stats as spans of
+        file_metrics, see transform.get_stats. Return result of fn, ending
+        with its stats.
+        """
+        loop = asyncio.get_running_loop()
+        memory = self.memory or scheduler.MemoryBudget()
+        estimate = await loop.run_in_executor(
+            None, transform.estimate_memory,
+            raw_file, self.batch_size, self.writer_profile, self.partition_column is not None,
+            self.get_whole_columns(),
+        )
+        files = {output: os.path.getsize(raw_file)}
+        async with memory.reserve(estimate, files) as reservation:
+            submitted = time.time()
+            (*result, stats) = await loop.run_in_executor(
+                self.transform_executor, transform.run_transform, fn, raw_file, output, *args)
+        file_metrics.add(queue_wait=reservation.queue_wait + max(0, stats["started"] - submitted))
+        file_metrics.peak(rss=stats["peak_rss"])
+        for stage in ("decode", "cast", "enrich", "encode"):
+            file_metrics.add_span(stage, stats[stage], target=self.name)
+        file_metrics.add(
+            rows=stats["rows"],
+            duplicates=stats["duplicates"],
+            out_of_month=stats["out_of_month"],
+        )
+        if stats["duplicates"] + stats["out_of_month"] > 0:
+            print(json.dumps(dict(
+                file=os.path.basename(raw_file),
+                removed=dict(duplicates=stats["duplicates"], out_of_month=stats["out_of_month"]),
+            )))
+
+        return (*result, stats)
+
+    async def load(
+        self,
+        raw_file,
+        file_basename,
+        source_metadata,
+        tmp_dir,
+        file_metrics=None,
+        digest=None,
+    ):
+        """
+        Ingest raw file, validating upload of raw file by its digest computed
+        while downloading if defined, or of cast file by its digest computed
+        while encoding, see sinks.Sink.put_file
+        """
+        file_metrics = file_metrics or metrics.FileMetrics(file_basename)
+        metadata = get_ingestion_metadata(source_metadata, self.schema_version)
+        if self.partition_column is not None:
+            await self.load_partitioned(raw_file, file_basename, metadata, tmp_dir, file_metrics)
+            return
+
+        local_file = raw_file
+        row_filter = self.get_row_filter(file_basename)
+        quarantine_file = self.get_quarantine_file(file_basename, tmp_dir)
+        if (self.schema is not None) or (self.writer_profile is not None) \
+                or (row_filter is not None) or (self.zone_lookup is not None):
+            local_file = f"{tmp_dir}/cast_{file_basename}"
+            (drift, stats) = await self.transform(
+                transform.cast_parquet_file,
+                raw_file, local_file, self.schema, self.batch_size, self.writer_profile,
+                row_filter, quarantine_file, self.compact, self.zone_lookup,
+                file_metrics=file_metrics,
+            )
+            print_drift(file_basename, drift)
+            digest = stats["digest"]
+
+        blob_name = self.get_blob_name(file_basename)
+        previous = await self.sink.get_info(blob_name)
+        quarantine_blob_name = await self.upload_quarantine(
+            quarantine_file, file_basename, metadata, file_metrics)
+        if quarantine_blob_name is not None:
+            metadata = dict(metadata, **{QUARANTINE_METADATA_KEY: quarantine_blob_name})
+        await self.sink.put_file(local_file, blob_name, metadata, digest, file_metrics)
+
+        blob_names = [blob_name, quarantine_blob_name]
+        await self.delete_quarantine_of(previous, blob_names)
+        await self.delete_other_layout(file_basename, blob_names)
+
+    async def delete_quarantine_of(self, info, blob_names):
+        """
+        Delete quarantine object recorded in metadata of plain object of info,
+        if any and not among blob_names just written, so out of month rows of
+        a previous ingestion do not outlive it
+        """
+        quarantine_blob_name = ((info or {}).get("metadata") or {}).get(QUARANTINE_METADATA_KEY)
+        if (quarantine_blob_name is not None) and (quarantine_blob_name not in blob_names):
+            await self.sink.delete([quarantine_blob_name])
+
+    async def load_partitioned(self, raw_file, file_basename, metadata, tmp_dir, file_metrics):
+        parts_dir = f"{tmp_dir}/parts_{file_basename}"
+        quarantine_file = self.get_quarantine_file(file_basename, tmp_dir)
+        (parts, drift, _) = await self.transform(
+            transform.partition_parquet_file,
+            raw_file, parts_dir, self.partition_column, self.schema,
+            self.batch_size, self.target_file_size, None, self.writer_profile,
+            self.get_row_filter(file_basename), quarantine_file, self.compact, self.zone_lookup,
+            file_metrics=file_metrics,
+        )
+        print_drift(file_basename, drift)
+
+        blob_names = [f"{self.subpath}/{part}" for part in parts]
+        await self.sink.put_batch(
+            [(f"{parts_dir}/{part}", blob_name) for (part, blob_name) in zip(parts, blob_names)],
+            metadata,
+            file_metrics,
+        )
+        quarantine_blob_name = await self.upload_quarantine(
+            quarantine_file, file_basename, metadata, file_metrics)
+        if quarantine_blob_name is not None:
+            blob_names.append(quarantine_blob_name)
+
+        await self.replace_manifest(file_basename, blob_names, metadata)
+        await self.delete_other_layout(file_basename, blob_names)
+
+    async def replace_manifest(self, file_basename, blob_names, metadata):
+        """
+        Write manifest listing blob_names written for file, deleting objects
+        listed by previous manifest that were not written again
+        """
+        manifest_name = self.get_blob_name(file_basename)
+        previous = await self.sink.get_bytes(manifest_name)
+        if previous is not None:
+            stale = sorted(set(json.loads(previous)["objects"]) - set(blob_names))
+            await self.sink.delete(stale)
+
+        await self.sink.put_bytes(
+            manifest_name,
+            json.dumps(dict(source=file_basename, objects=blob_names)).encode(),
+            metadata,
+            "application/json",
+        )
+
+    async def delete_other_layout(self, file_basename, blob_names):
+        """
+        Delete objects of file ingested with the other layout than blob_names
+        just written, so switching partitioning on or off does not leave both
+        layouts under subpath: plain object "SUBPATH/BASENAME" if partitioned,
+        else partitions listed by manifest of file, and manifest itself
+        """
+        if self.partition_column is not None:
+            plain_blob_name = f"{self.subpath}/{file_basename}"
+            await self.delete_quarantine_of(await self.sink.get_info(plain_blob_name), blob_names)
+            await self.sink.delete([plain_blob_name])
+            return
+
+        manifest_name = f"{MANIFEST_PREFIX}/{self.subpath}/{file_basename}.json"
+        manifest = await self.sink.get_bytes(manifest_name)
+        if manifest is not None:
+            stale = sorted(set(json.loads(manifest)["objects"]) - set(blob_names))
+            await self.sink.delete(stale + [manifest_name])
+
+
+class LocalTarget:
+    """
+    Target storing raw files in local dest directory. Files are downloaded
+    directly into dest so no copy is required.
+    """
+
+    def __init__(self, dest):
+        os.makedirs(dest, exist_ok=True)
+        self.dest = dest
+        self.download_dir = dest
+        self.name = dest
+
+    async def is_unchanged(self, file_basename, source_metadata):
+        return False
+
+    def preflight(self, probe):
+        return dict(memory=0, drift=None)
+
+    async def load(
+        self,
+        raw_file,
+        file_basename,
+        source_metadata,
+        tmp_dir,
+        file_metrics=None,
+        digest=None,
+    ):
+        file_metrics = file_metrics or metrics.FileMetrics(file_basename)
+        dest_file = f"{self.dest}/{file_basename}"
+        if os.path.abspath(raw_file) != os.path.abspath(dest_file):
+            loop = asyncio.get_running_loop()
+            with file_metrics.span("copy", target=self.name):
+                await loop.run_in_executor(None, shutil.copyfile, raw_file, dest_file)
+
+
+async def extract_load_single_file(
+    session,
+    limiter,
+    url,
+    targets,
+    download_options=None,
+    work_dir=None,
+    file_metrics=None,
+    memory=None,
+):
+    """
+    Download file from url once and fan it out to all targets concurrently,
+    each target applying its own transform. Targets are skipped if file is
+    unchanged for them, based on a HEAD request to source.
+
+    Download goes directly into directory of a target storing raw files if
+    any; otherwise into work_dir if defined, where downloaded files are kept
+    until loaded so a rerun resumes partial downloads and reuses complete ones
+    downloaded from same source file version, see is_downloaded; otherwise
+    into a temporary directory.
+
+    Stages of file are recorded as spans of file_metrics if defined, and
+    download is admitted by memory budget if defined. Digest of file computed
+    while downloading is passed to targets, unless a complete file is reused.
+    """
+    download_options = download_options or {}
+    file_basename = os.path.basename(url)
+    file_metrics = file_metrics or metrics.FileMetrics(file_basename)
+
+    with file_metrics.span("head"):
+        source_metadata = await download.retry(
+            lambda: download.head(session, url),
+            on_retry=lambda error: file_metrics.add(retries=1),
+        )
+    unchanged = await asyncio.gather(*[
+        t.is_unchanged(file_basename, source_metadata) for t in targets
+    ])
+    pending = [t for (t, u) in zip(targets, unchanged) if not u]
+    if len(pending) == 0:
+        return Unchanged(file_basename)
+
+    target_dirs = [t.download_dir for t in pending if t.download_dir is not None]
+    memory = memory or scheduler.MemoryBudget()
+    tmp_dir = None
+    try:
+        async with aiofiles.tempfile.TemporaryDirectory() as tmp_dir:
+            download_dir = target_dirs[0] if target_dirs else (work_dir or tmp_dir)
+            raw_file = f"{download_dir}/{file_basename}"
+            reusable = (download_dir == work_dir) and is_downloaded(raw_file, source_metadata)
+            digest = None
+            if not reusable:
+                if download_dir == work_dir:
+                    remove_downloaded(raw_file)
+                    await memory.release_files(raw_file)
+                digest = checksum.Digest()
+                await download_single_file(
+                    session, limiter, url, download_dir,
+                    metadata=source_metadata, file_metrics=file_metrics, memory=memory,
+                    digest=digest, **download_options,
+                )
+                digest = digest.to_dict()
+                if download_dir == work_dir:
+                    write_source_metadata(raw_file, source_metadata)
+
+            await asyncio.gather(*[
+                t.load(raw_file, file_basename, source_metadata, tmp_dir, file_metrics, digest)
+                for t in pending
+            ])
+
+            if download_dir == work_dir:
+                remove_downloaded(raw_file)
+                await memory.release_files(raw_file)
+    finally:
+        if tmp_dir is not None:
+            await memory.release_files(tmp_dir)
 
     return file_basename
 
 
-async def ingest_files(urls, bucket_name, subpath, schema=None):
-    bucket = storage.Client().bucket(bucket_name)
-    async with aiohttp.ClientSession() as session:
-        ingestions = [
-            ingest_single_file(session, url, bucket, subpath, schema)
-            for url in urls
-        ]
-        uris = await asyncio.gather(*ingestions, return_exceptions=True)
+async def probe_file(session, limiter, url, targets):
+    """
+    Probe footer of file at url as a transfer admitted by limiter, without
+    downloading it, see footer.probe_footer. Return report of file size, rows,
+    row groups, and largest estimated transform memory and schema drift of
+    targets.
+    """
+    async with limiter.transfer():
+        probe = await footer.probe_footer(session, url)
+
+    checks = [t.preflight(probe) for t in targets]
+    drifts = [check["drift"] for check in checks if check["drift"] is not None]
+    return dict(
+        file=os.path.basename(url),
+        size=probe["size"],
+        rows=probe["num_rows"],
+        row_groups=len(probe["row_groups"]),
+        memory=max([check["memory"] for check in checks], default=0),
+        drift=drifts[0] if drifts else None,
+    )
+
+
+async def preflight(session, limiter, jobs, mode="warn", memory_budget=None):
+    """
+    Probe footers of all files of jobs [(url, targets)] before any download,
+    printing schema drift and probe errors of each file, and a summary of
+    files, bytes and rows to transfer, and largest estimated transform memory.
+    If mode is "fail", raise ValueError if any file has schema drift or could
+    not be probed. Return reports, see probe_file.
+    """
+    results = await asyncio.gather(*[
+        probe_file(session, limiter, url, targets) for (url, targets) in jobs
+    ], return_exceptions=True)
+
+    reports = []
+    failed = []
+    for ((url, _), result) in zip(jobs, results):
+        file_basename = os.path.basename(url)
+        if isinstance(result, Exception):
+            print(f"Failed to probe {file_basename}: {result!r}")
+            failed.append(file_basename)
+            continue
+
+        print_drift(file_basename, result["drift"])
+        if result["drift"] is not None:
+            failed.append(file_basename)
+        reports.append(result)
+
+    max_memory = max([r["memory"] for r in reports], default=0)
+    print(json.dumps(dict(preflight=dict(
+        files=len(reports),
+        bytes=sum(r["size"] for r in reports),
+        rows=sum(r["rows"] for r in reports),
+        max_memory=max_memory,
+        over_memory_budget=[
+            r["file"] for r in reports
+            if (memory_budget is not None) and (r["memory"] > memory_budget)
+        ],
+        failed=failed,
+    ))))
+    if (mode == "fail") and (len(failed) > 0):
+        raise ValueError(f"Preflight failed for files: {failed}")
+
+    return reports
+
+
+async def extract_load_files(
+    session,
+    limiter,
+    jobs,
+    download_options=None,
+    work_dir=None,
+    recorder=None,
+    memory=None,
+):
+    """
+    Extract and load files concurrently, fetching each url once for all its
+    targets, where jobs is a list of (url, targets) pairs. Metrics of each
+    file are emitted to recorder with its status, see metrics.Recorder.
+    """
+    recorder = recorder or metrics.Recorder()
+    if work_dir:
+        os.makedirs(work_dir, exist_ok=True)
+
+    async def extract_load_recorded(url, targets):
+        file_metrics = recorder.file(os.path.basename(url))
+        try:
+            result = await extract_load_single_file(
+                session, limiter, url, targets, download_options, work_dir,
+                file_metrics, memory,
+            )
+        except Exception as error:
+            recorder.emit(file_metrics, status="failed", error=f"{type(error).__name__}: {error}")
+            raise
+
+        status = "unchanged" if isinstance(result, Unchanged) else "succeeded"
+        recorder.emit(file_metrics, status=status)
+        return result
+
+    results = await asyncio.gather(
+        *[extract_load_recorded(url, targets) for (url, targets) in jobs],
+        return_exceptions=True,
+    )
+
+    target_names = sorted({t.name for (_, targets) in jobs for t in targets})
+    print(f"Loaded to: {', '.join(target_names)}")
+
+    return summarize("Extracted and loaded", [url for (url, _) in jobs], results)
+
+
+def get_url(vehicle_type, year, month, base_url=catalog.BASE_URL):
+    return f"{base_url}/{vehicle_type}_tripdata_{year}-{month:02}.parquet"
+
+
+def plan_urls(tlc_catalog, vehicle_type, year=None, month=None, base_url=catalog.BASE_URL):
+    """
+    Plan urls to extract for vehicle_type based on catalog:
+    - latest published month if year is undefined
+    - all months of year, up to latest published one, if month is undefined
+    - month of year otherwise
+
+    Return (valid_urls, invalid_urls) where invalid urls are not in catalog.
+    """
+    latest = tlc_catalog.latest(vehicle_type)
+    if year is None:
+        if latest is None:
+            raise ValueError(f"No published files for vehicle type: {vehicle_type}")
+        (year, months) = (latest[0], [latest[1]])
+    elif month is None:
+        if (latest is not None) and (year == latest[0]):
+            months = range(1, latest[1] + 1)
+        else:
+            months = range(1, 13)
+    else:
+        months = [month]
+
+    urls = [get_url(vehicle_type, year, m, base_url) for m in months]
+    return tlc_catalog.validate(urls)
+
 
-    print(f"Ingested to {bucket_name}: {uris}")
+def as_list(value):
+    """
+    Get value as list, where None is a list with a single undefined value
+    """
+    if value is None:
+        return [None]
+    if isinstance(value, (list, tuple, range)):
+        return list(value)
 
+    return [value]
 
-async def validate_urls(urls):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(WEB_URL) as res:
-            data = await res.read()
 
-    html = data.decode("utf-8")
-    exp = re.compile(re.escape(BASE_URL) + r".*\.parquet")
-    available_urls = set(exp.findall(html))
+async def extract_load(
+    vehicle_types,
+    years=None,
+    months=None,
+    bucket_name=None,
+    local_dest=None,
+    raise_if_any_not_found=True,
+    min_concurrency=scheduler.MIN_CONCURRENCY,
+    max_concurrency=scheduler.MAX_CONCURRENCY,
+    gcs_endpoint=None,
+    catalog_cache=None,
+    catalog_ttl=catalog.CATALOG_TTL,
+    download_options=None,
+    batch_size=transform.BATCH_SIZE,
+    transform_workers=None,
+    upload_workers=UPLOAD_WORKERS,
+    work_dir=None,
+    incremental=True,
+    hive_partitioning=False,
+    target_file_size=transform.TARGET_FILE_SIZE,
+    writer_profiles=None,
+    tlc_web_url=catalog.WEB_URL,
+    tlc_base_url=catalog.BASE_URL,
+    metrics_output=None,
+    metrics_textfile=None,
+    memory_budget=None,
+    deduplicate=False,
+    out_of_month=None,
+    projection=None,
+    compact=False,
+    preflight_mode=None,
+    sink_url=None,
+    upload_strategy="chunked",
+    zone_lookup=None,
+    files_in_memory=None,
+):
+    """
+    Plan, ingest, and download urls for all combinations of vehicle_types,
+    years, and months within a single event loop, sharing one HTTP session and
+    one adaptive limit on in-flight transfers between min_concurrency and
+    max_concurrency. years and months follow plan_urls() for each element,
+    where undefined values mean latest published ones.
 
-    valid_urls = []
-    invalid_urls = []
-    for url in urls:
-        if url in available_urls:
-            valid_urls.append(url)
+    Urls are planned from TLC catalog cached at local path catalog_cache if
+    defined, or in bucket otherwise, from TLC web page at tlc_web_url listing
+    files under tlc_base_url, see catalog.load_catalog. A fresh cached catalog
+    missing any planned url is revalidated once before urls are reported as
+    invalid, see catalog.revalidate_catalog.
+
+    Each url is downloaded once and fanned out to bucket and local_dest
+    targets, see extract_load_single_file. Files are ingested to Cloud Storage
+    bucket_name, or to sink at sink_url if defined, such as a local directory,
+    uploading files with upload_strategy, see sinks.get_sink. If hive_partitioning, files are
+    split into pickup date partitions in bucket, see BucketTarget. Files of
+    vehicle types in writer_profiles are encoded with mapped writer profile,
+    see transform.WRITER_PROFILES.
+
+    download_options are passed to download_single_file. Casting runs on a
+    process pool with transform_workers processes, defaulting to the number of
+    CPUs available to the container, and uploads run on a thread pool limited
+    to upload_workers concurrent uploads. Downloads and transforms are admitted
+    only while their estimated working set fits within memory_budget bytes if
+    defined, including downloaded and transformed files if files_in_memory or
+    if undefined when written to an in-memory filesystem such as tmpfs, see
+    scheduler.MemoryBudget. Return per-file summary.
+
+    If deduplicate, rows repeating trip columns of vehicle type are removed,
+    see VEHICLE_TYPE_DEDUP_COLUMNS_MAP. Rows whose pickup is outside month of
+    file are kept if out_of_month is undefined, removed if "drop", or moved to
+    "BUCKET_NAME/quarantine/vehicle_type/" if "quarantine".
+
+    Columns missing in named projection of vehicle type, if defined, are
+    neither read nor ingested to bucket, see PROJECTIONS. If compact, columns
+    are ingested with compact physical types, see BucketTarget. If
+    zone_lookup is defined, borough and zone of pickup and dropoff locations
+    are added from taxi zone lookup CSV file at that path, or copied from
+    Cloud Storage if a "gs://" url, see zones.fetch_zone_lookup and
+    BucketTarget.
+
+    If preflight_mode is "warn" or "fail", footers of all files are probed
+    before any download to report schema drift, bytes, rows and estimated
+    memory, failing fast if "fail", see preflight.
+
+    Per-file spans and counters are written as JSON lines to metrics_output
+    path, or stdout if "-", and aggregated to Prometheus textfile at
+    metrics_textfile, if defined, see metrics.Recorder.
+    """
+    download_options = download_options or {}
+    writer_profiles = writer_profiles or {}
+    if transform_workers is None:
+        transform_workers = get_available_cpus()
+
+    if (sink_url is None) and bucket_name:
+        sink_url = f"gs://{bucket_name}"
+
+    segments = download_options.get("segments", download.SEGMENTS)
+    limiter = scheduler.AdaptiveLimiter(min_concurrency, max_concurrency)
+    memory = scheduler.MemoryBudget(memory_budget, files_in_memory=files_in_memory)
+    with create_transform_executor(transform_workers) as transform_executor, \
+            concurrent.futures.ThreadPoolExecutor(upload_workers) as upload_executor, \
+            metrics.Recorder(metrics_output, metrics_textfile) as recorder, \
+            tempfile.TemporaryDirectory() as tmp_dir:
+        sink = None
+        if sink_url is not None:
+            sink = sinks.get_sink(sink_url, upload_executor, gcs_endpoint, upload_strategy)
+
+        if zone_lookup is not None:
+            zone_lookup = await zones.fetch_zone_lookup(zone_lookup, tmp_dir, upload_executor, gcs_endpoint)
+
+        if catalog_cache:
+            cache = catalog.LocalCache(catalog_cache)
+        elif sink is not None:
+            cache = catalog.SinkCache(sink)
         else:
-            invalid_urls.append(url)
+            cache = None
+
+        def get_targets(vehicle_type):
+            subpath = f"raw/{vehicle_type}"
+            schema = VEHICLE_TYPE_SCHEMA_MAP.get(vehicle_type)
+            columns = PROJECTIONS[projection].get(vehicle_type) if projection else None
+            if (schema is not None) and (columns is not None):
+                schema = transform.project_schema(schema, columns)
+
+            pickup_column = VEHICLE_TYPE_PICKUP_COLUMN_MAP.get(vehicle_type)
+            if (hive_partitioning or out_of_month) and (pickup_column is None):
+                raise ValueError(f"Unknown pickup column for vehicle type: {vehicle_type}")
+
+            targets = []
+            if sink is not None:
+                targets.append(BucketTarget(
+                    sink,
+                    subpath,
+                    schema,
+                    batch_size,
+                    transform_executor,
+                    incremental,
+                    pickup_column if hive_partitioning else None,
+                    target_file_size,
+                    writer_profiles.get(vehicle_type),
+                    memory,
+                    VEHICLE_TYPE_DEDUP_COLUMNS_MAP.get(vehicle_type) if deduplicate else None,
+                    pickup_column if out_of_month else None,
+                    f"quarantine/{vehicle_type}" if out_of_month == "quarantine" else None,
+                    compact,
+                    zone_lookup,
+                ))
+            if local_dest:
+                targets.append(LocalTarget(f"{local_dest}/{subpath}"))
 
-    return (valid_urls, invalid_urls)
+            return targets
+
+        async with scheduler.create_session(max_concurrency * segments) as session:
+            vehicle_type_targets = {
+                vehicle_type: get_targets(vehicle_type) for vehicle_type in as_list(vehicle_types)}
+
+            def plan(tlc_catalog):
+                jobs = {}
+                invalid_urls = []
+                for (vehicle_type, targets) in vehicle_type_targets.items():
+                    for year in as_list(years):
+                        for month in as_list(months):
+                            (valid, invalid) = plan_urls(
+                                tlc_catalog, vehicle_type, year, month, tlc_base_url)
+                            jobs.update((url, targets) for url in valid)
+                            invalid_urls.extend(invalid)
+
+                return (jobs, invalid_urls)
+
+            started = time.time()
+            catalog_metrics = recorder.file()
+            with catalog_metrics.span("catalog"):
+                tlc_catalog = await catalog.load_catalog(
+                    session, cache, catalog_ttl, tlc_web_url, tlc_base_url)
+                (jobs, invalid_urls) = plan(tlc_catalog)
+                if (len(invalid_urls) > 0) and (tlc_catalog.fetched_at < started):
+                    # Files published since fresh cached catalog was fetched
+                    # are missing from it, so revalidate it once
+                    tlc_catalog = await catalog.revalidate_catalog(
+                        session, tlc_catalog, cache, tlc_web_url, tlc_base_url)
+                    (jobs, invalid_urls) = plan(tlc_catalog)
+            recorder.emit(catalog_metrics)
+
+            if len(invalid_urls) > 0:
+                message = f"Invalid URLs: {invalid_urls}"
+                if raise_if_any_not_found:
+                    raise ValueError(message)
+                else:
+                    print(message)
+
+            if preflight_mode is not None:
+                preflight_metrics = recorder.file()
+                with preflight_metrics.span("preflight"):
+                    await preflight(
+                        session, limiter, list(jobs.items()), preflight_mode, memory_budget)
+                recorder.emit(preflight_metrics)
+
+            print(f"Extracting and loading {len(jobs)} files...")
+            summary = await extract_load_files(
+                session, limiter, list(jobs.items()),
+                download_options, work_dir, recorder, memory,
+            )
+
+    print(f"Concurrency limit at end: {limiter.limit}")
+    if memory_budget is not None:
+        print(f"Peak memory usage: {memory.peak_usage} of {memory_budget} bytes budget")
+
+    return summary
+
+
+def parse_writer_profiles(values, vehicle_types):
+    """
+    Map vehicle types to writer profiles from values "PROFILE", for all
+    vehicle types, or "VEHICLE_TYPE=PROFILE", taking precedence
+    """
+    writer_profiles = {}
+    for value in values:
+        (vehicle_type, _, profile) = value.rpartition("=")
+        transform.get_writer_profile(profile)
+        if vehicle_type:
+            writer_profiles[vehicle_type] = profile
+        else:
+            for vehicle_type in vehicle_types:
+                writer_profiles.setdefault(vehicle_type, profile)
+
+    return writer_profiles
 
 
 def main(
@@ -143,10 +1208,42 @@ def main(
     year=None,
     month=None,
     raise_if_any_not_found=True,
+    min_concurrency=scheduler.MIN_CONCURRENCY,
+    max_concurrency=scheduler.MAX_CONCURRENCY,
+    chunk_size=download.CHUNK_SIZE,
+    segment_size=download.SEGMENT_SIZE,
+    segments=download.SEGMENTS,
+    retries=download.RETRIES,
+    backoff=download.BACKOFF,
+    batch_size=transform.BATCH_SIZE,
+    transform_workers=None,
+    upload_workers=UPLOAD_WORKERS,
+    gcs_endpoint=None,
+    work_dir=None,
+    force=False,
+    catalog_cache=None,
+    catalog_ttl=catalog.CATALOG_TTL,
+    hive_partitioning=False,
+    target_file_size=transform.TARGET_FILE_SIZE,
+    writer_profile=None,
+    tlc_web_url=catalog.WEB_URL,
+    tlc_base_url=catalog.BASE_URL,
+    metrics_output=None,
+    metrics_textfile=None,
+    memory_budget=None,
+    deduplicate=False,
+    out_of_month=None,
+    projection=None,
+    compact=False,
+    preflight=None,
+    sink_url=None,
+    upload_strategy="chunked",
+    zone_lookup=None,
+    files_in_memory=None,
 ):
     """
     Ingest files to Cloud Storage bucket path "BUCKET_NAME/raw/vehicle_type/":
-        # Current year and month
+        # Latest published year and month
         main(bucket_name="BUCKET_NAME", vehicle_type="green")
 
         # Define year and all months
@@ -154,51 +1251,145 @@ def main(
 
     Download files directly to local destination "LOCAL_DEST/raw/vehicle_type/":
         main(local_dest="LOCAL_DEST", vehicle_type="green", year=2022)
-    """
 
-    curr = dt.datetime.now()
-    month_published = curr.month - 2  # data publication has two months delay
+    Files unchanged at source since last ingestion with same schema are
+    skipped, unless forced:
+        main(bucket_name="BUCKET_NAME", vehicle_type="green", year=2022, force=True)
 
-    if year is None:
-        year = curr.year
-        months = [month_published]
-    else:
-        assert type(year) is int, "year must be int"
+    Catalog of available files is cached in bucket, or at local path if
+    catalog_cache is defined, for catalog_ttl seconds:
+        main(local_dest="LOCAL_DEST", vehicle_type="green", catalog_cache="/tmp/tlc_catalog.json")
 
-        if month is None:
-            months = range(
-                1,
-                13 if (year < curr.year) else month_published + 1
-            )
-        else:
-            assert type(month) is int, "month must be int"
-            months = [month]
-
-    urls = [
-        f"{BASE_URL}/{vehicle_type}_tripdata_{year}-{m:02}.parquet"
-        for m in months
-    ]
-    (urls, invalid_urls) = asyncio.run(validate_urls(urls))
-    if len(invalid_urls) > 0:
-        message = f"Invalid URLs: {invalid_urls}"
-        if raise_if_any_not_found:
-            raise ValueError(message)
-        else:
-            print(message)
+    Batch multiple vehicle types, years, and months within a single process:
+        main(bucket_name="BUCKET_NAME", vehicle_type=["green", "yellow"], year=[2021, 2022])
+        main(bucket_name="BUCKET_NAME", vehicle_type="fhvhv", year=2022, month=range(1, 7))
 
-    if vehicle_type in VEHICLE_TYPE_SCHEMA_MAP:
-        schema = VEHICLE_TYPE_SCHEMA_MAP[vehicle_type]
-    else:
-        schema = None
+    Split files into "BUCKET_NAME/raw/vehicle_type/pickup_date=YYYY-MM-DD/" hive
+    partitions with files of about target_file_size bytes:
+        main(bucket_name="BUCKET_NAME", vehicle_type="green", year=2022, hive_partitioning=True)
+
+    Encode files with named writer profile, for all or specific vehicle types,
+    see transform.WRITER_PROFILES:
+        main(bucket_name="BUCKET_NAME", vehicle_type="green", writer_profile="storage-small")
+        main(
+            bucket_name="BUCKET_NAME",
+            vehicle_type=["green", "fhvhv"],
+            writer_profile=["upload-fast", "fhvhv=storage-small"],
+        )
+
+    Record per-file timing spans of each stage, bytes, rows, retries and queue
+    wait as JSON lines, and aggregates as a Prometheus textfile:
+        main(
+            bucket_name="BUCKET_NAME",
+            vehicle_type="green",
+            metrics_output="-",
+            metrics_textfile="/var/lib/node_exporter/tlc_ingest.prom",
+        )
+
+    Admit downloads and transforms only while their estimated working set fits
+    within a memory budget in bytes, e.g. below container memory limit:
+        main(bucket_name="BUCKET_NAME", vehicle_type="fhvhv", year=2022, memory_budget=3 * 1024 ** 3)
+
+    Files written to an in-memory filesystem such as tmpfs count against memory
+    budget until deleted, also where it is not detected, e.g. on Cloud Run:
+        main(bucket_name="BUCKET_NAME", vehicle_type="fhvhv", memory_budget=3 * 1024 ** 3,
+             files_in_memory=True)
+
+    Remove duplicate trips, and move trips picked up outside month of their
+    file to "BUCKET_NAME/quarantine/vehicle_type/", or drop them:
+        main(bucket_name="BUCKET_NAME", vehicle_type="yellow", deduplicate=True, out_of_month="quarantine")
+
+    Ingest only columns read by dbt staging models:
+        main(bucket_name="BUCKET_NAME", vehicle_type="yellow", projection="dbt")
+
+    Narrow integer columns and dictionary encode low cardinality strings,
+    where values of each file fit, see transform.COMPACT_INTEGER_TYPES:
+        main(bucket_name="BUCKET_NAME", vehicle_type="fhvhv", compact=True)
+
+    Probe parquet footers of all files before downloading any, reporting
+    schema drift, transfer size and estimated memory, and fail on drift:
+        main(bucket_name="BUCKET_NAME", vehicle_type="green", year=2022, preflight="fail")
+
+    Ingest files to a local directory with the same layout as the bucket,
+    see sinks.get_sink:
+        main(sink_url="file:///data/tlc", vehicle_type="green", year=2022)
+
+    Upload large files as parallel composite uploads:
+        main(bucket_name="BUCKET_NAME", vehicle_type="fhvhv", upload_strategy="composite")
+
+    Add borough and zone of pickup and dropoff locations from the taxi zone
+    lookup seeded to the warehouse, instead of joining dim_zones:
+        main(
+            bucket_name="BUCKET_NAME",
+            vehicle_type="green",
+            zone_lookup="datawarehouse/dbt/trips/seeds/taxi_zone_lookup.csv",
+        )
+    """
 
-    subpath = f"raw/{vehicle_type}"
-    if bucket_name:
-        print("Ingesting...")
-        asyncio.run(ingest_files(urls, bucket_name, subpath, schema))
+    vehicle_types = as_list(vehicle_type)
+    years = as_list(year)
+    months = as_list(month)
+    assert bucket_name or sink_url or local_dest, "bucket_name, sink_url or local_dest is required"
+    assert all(type(v) is str for v in vehicle_types), "vehicle_type must be str or list of str"
+    if year is not None:
+        assert all(type(y) is int for y in years), "year must be int or list of int"
+    if month is not None:
+        assert year is not None, "month requires year"
+        assert all((type(m) is int) and (1 <= m <= 12) for m in months), \
+            "month must be int or list of int between 1 and 12"
+    assert out_of_month in (None, "drop", "quarantine"), \
+        "out_of_month must be None, \"drop\" or \"quarantine\""
+    assert (projection is None) or (projection in PROJECTIONS), \
+        f"projection must be None or one of {list(PROJECTIONS)}"
+    assert preflight in (None, "warn", "fail"), "preflight must be None, \"warn\" or \"fail\""
+    assert (zone_lookup is None) or zone_lookup.startswith("gs://") or os.path.isfile(zone_lookup), \
+        "zone_lookup must be a path or \"gs://\" url to a CSV file"
+    writer_profiles = {}
+    if writer_profile is not None:
+        writer_profiles = parse_writer_profiles(as_list(writer_profile), vehicle_types)
 
-    if local_dest:
-        print("Downloading...")
-        asyncio.run(download_files(urls, dest=f"{local_dest}/{subpath}"))
+    return asyncio.run(extract_load(
+        vehicle_types,
+        years=years,
+        months=months,
+        bucket_name=bucket_name,
+        local_dest=local_dest,
+        raise_if_any_not_found=raise_if_any_not_found,
+        min_concurrency=min_concurrency,
+        max_concurrency=max_concurrency,
+        gcs_endpoint=gcs_endpoint,
+        catalog_cache=catalog_cache,
+        catalog_ttl=catalog_ttl,
+        download_options=dict(
+            chunk_size=chunk_size,
+            segment_size=segment_size,
+            segments=segments,
+            retries=retries,
+            backoff=backoff,
+        ),
+        batch_size=batch_size,
+        transform_workers=transform_workers,
+        upload_workers=upload_workers,
+        work_dir=work_dir,
+        incremental=not force,
+        hive_partitioning=hive_partitioning,
+        target_file_size=target_file_size,
+        writer_profiles=writer_profiles,
+        tlc_web_url=tlc_web_url,
+        tlc_base_url=tlc_base_url,
+        metrics_output=metrics_output,
+        metrics_textfile=metrics_textfile,
+        memory_budget=memory_budget,
+        deduplicate=deduplicate,
+        out_of_month=out_of_month,
+        projection=projection,
+        compact=compact,
+        preflight_mode=preflight,
+        sink_url=sink_url,
+        upload_strategy=upload_strategy,
+        zone_lookup=zone_lookup,
+        files_in_memory=files_in_memory,
+    ))
 
 
 if (__name__ == "__main__") and __debug__:
@@ -211,12 +1402,46 @@ if (__name__ == "__main__") and __debug__:
     )
 elif __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--bucket-name", required=True)
-    parser.add_argument("--vehicle-type", required=True)
-    parser.add_argument("--year", default=None, type=int)
-    parser.add_argument("--month", default=None, type=int)
+    parser.add_argument("--bucket-name", default=None)
+    parser.add_argument("--vehicle-type", required=True, nargs="+")
+    parser.add_argument("--year", default=None, type=int, nargs="+")
+    parser.add_argument("--month", default=None, type=int, nargs="+")
     parser.add_argument("--raise-if-any-not-found", default=False, action="store_true")
+    parser.add_argument("--min-concurrency", default=scheduler.MIN_CONCURRENCY, type=int)
+    parser.add_argument("--max-concurrency", default=scheduler.MAX_CONCURRENCY, type=int)
+    parser.add_argument("--chunk-size", default=download.CHUNK_SIZE, type=int)
+    parser.add_argument("--segment-size", default=download.SEGMENT_SIZE, type=int)
+    parser.add_argument("--segments", default=download.SEGMENTS, type=int)
+    parser.add_argument("--retries", default=download.RETRIES, type=int)
+    parser.add_argument("--backoff", default=download.BACKOFF, type=float)
+    parser.add_argument("--batch-size", default=transform.BATCH_SIZE, type=int)
+    parser.add_argument("--transform-workers", default=None, type=int)
+    parser.add_argument("--upload-workers", default=UPLOAD_WORKERS, type=int)
+    parser.add_argument("--gcs-endpoint", default=None)
+    parser.add_argument("--work-dir", default=None)
+    parser.add_argument("--force", default=False, action="store_true")
+    parser.add_argument("--catalog-cache", default=None)
+    parser.add_argument("--catalog-ttl", default=catalog.CATALOG_TTL, type=int)
+    parser.add_argument("--hive-partitioning", default=False, action="store_true")
+    parser.add_argument("--target-file-size", default=transform.TARGET_FILE_SIZE, type=int)
+    parser.add_argument("--writer-profile", default=None, nargs="+")
+    parser.add_argument("--tlc-web-url", default=catalog.WEB_URL)
+    parser.add_argument("--tlc-base-url", default=catalog.BASE_URL)
+    parser.add_argument("--metrics-output", default=None)
+    parser.add_argument("--metrics-textfile", default=None)
+    parser.add_argument("--memory-budget", default=None, type=int)
+    parser.add_argument("--files-in-memory", default=None, action="store_true")
+    parser.add_argument("--deduplicate", default=False, action="store_true")
+    parser.add_argument("--out-of-month", default=None, choices=["drop", "quarantine"])
+    parser.add_argument("--projection", default=None, choices=list(PROJECTIONS))
+    parser.add_argument("--compact", default=False, action="store_true")
+    parser.add_argument("--preflight", default=None, choices=["warn", "fail"])
+    parser.add_argument("--sink-url", default=None)
+    parser.add_argument("--upload-strategy", default="chunked", choices=list(sinks.UPLOAD_STRATEGIES))
+    parser.add_argument("--zone-lookup", default=None)
 
     args = vars(parser.parse_args())
     print("Args:", args)
-    main(**args)
+    summary = main(**args)
+    if summary["failed"]:
+        sys.exit(1)
@@ -0,0 +1,397 @@
+"""
+Local fakes of TLC CloudFront and Cloud Storage, for running the ingest
+pipeline offline, see benchmark
+"""
+
+import asyncio
+import base64
+import calendar
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import shutil
+import re
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import google_crc32c
+import pyarrow.parquet as pq
+from aiohttp import web
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+RANGE_EXP = re.compile(r"bytes=(\d*)-(\d*)")
+CONTENT_RANGE_EXP = re.compile(r"bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)")
+
+
+def random_integers(low, high, num_rows, seed):
+    """
+    Make random int64 array of values between low and high, exclusive
+    """
+    values = pc.multiply(pc.random(num_rows, initializer=seed), high - low)
+    return pc.add(pc.cast(pc.floor(values), pa.int64()), low)
+
+
+def make_array(field, num_rows, start, end, seed):
+    """
+    Make random array of field type, with timestamps between start and end
+    """
+    if pa.types.is_timestamp(field.type):
+        seconds = random_integers(int(start.timestamp()), int(end.timestamp()), num_rows, seed)
+        return seconds.cast(pa.timestamp("s")).cast(field.type)
+    if pa.types.is_integer(field.type):
+        return random_integers(1, 266, num_rows, seed).cast(field.type)
+    if pa.types.is_floating(field.type):
+        return pc.multiply(pc.random(num_rows, initializer=seed), 100).cast(field.type)
+    if pa.types.is_string(field.type):
+        values = pa.array(["N", "Y", "B00001", "B02510", "B02764"], field.type)
+        return values.take(random_integers(0, len(values), num_rows, seed))
+
+    return pa.nulls(num_rows, field.type)
+
+
+def make_trips_file(path, schema, year, month, num_rows, seed=0):
+    """
+    Write parquet file of num_rows random trips shaped like schema, with
+    timestamps within year and month, give or take a day as some TLC trips
+    """
+    start = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+    end = start + datetime.timedelta(days=calendar.monthrange(year, month)[1] + 1)
+    start -= datetime.timedelta(days=1)
+    arrays = [
+        make_array(field, num_rows, start, end, seed * len(schema) + i)
+        for (i, field) in enumerate(schema)
+    ]
+    pq.write_table(pa.Table.from_arrays(arrays, schema=schema), path)
+
+
+def make_zone_lookup_file(path, num_zones=265):
+    """
+    Write taxi zone lookup CSV file shaped like the warehouse seed, with
+    num_zones location IDs from 1
+    """
+    boroughs = ["Bronx", "Brooklyn", "EWR", "Manhattan", "Queens", "Staten Island"]
+    location_ids = list(range(1, num_zones + 1))
+    table = pa.table(dict(
+        locationid=pa.array(location_ids, pa.int64()),
+        borough=[boroughs[i % len(boroughs)] for i in location_ids],
+        zone=[f"Zone {i}" for i in location_ids],
+        service_zone=["Boro Zone"] * num_zones,
+    ))
+    pv.write_csv(table, path)
+
+
+def get_hashes(path):
+    """
+    Get base64 MD5 and CRC32C hashes of file, as reported by Cloud Storage
+    """
+    md5 = hashlib.md5()
+    crc32c = google_crc32c.Checksum()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(STREAM_CHUNK_SIZE), b""):
+            md5.update(chunk)
+            crc32c.update(chunk)
+
+    return dict(
+        md5Hash=base64.b64encode(md5.digest()).decode(),
+        crc32c=base64.b64encode(crc32c.digest()).decode(),
+    )
+
+
+async def throttle(nbytes, bandwidth):
+    if bandwidth:
+        await asyncio.sleep(nbytes / bandwidth)
+
+
+class FakeTLCServer:
+    """
+    Fake of TLC web page at "/page" listing files served from directory at
+    "/trip-data/", with Range and If-Range support, waiting latency seconds
+    before each response and streaming at most bandwidth bytes per second per
+    response
+    """
+
+    def __init__(self, directory, latency=0, bandwidth=None):
+        self.directory = directory
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.app = web.Application()
+        self.app.router.add_get("/page", self.page)
+        self.app.router.add_route("HEAD", "/trip-data/{name}", self.head)
+        self.app.router.add_get("/trip-data/{name}", self.get, allow_head=False)
+        self.url = None
+
+    def get_base_url(self):
+        return f"{self.url}/trip-data"
+
+    def get_web_url(self):
+        return f"{self.url}/page"
+
+    async def page(self, req):
+        await asyncio.sleep(self.latency)
+        links = [
+            f'<a href="{self.get_base_url()}/{name}">{name}</a>'
+            for name in sorted(os.listdir(self.directory))
+        ]
+        return web.Response(text="\n".join(links), content_type="text/html")
+
+    def get_headers(self, name):
+        path = os.path.join(self.directory, name)
+        if not os.path.isfile(path):
+            raise web.HTTPNotFound()
+
+        stat = os.stat(path)
+        return (path, stat.st_size, {
+            "Accept-Ranges": "bytes",
+            "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+        })
+
+    async def head(self, req):
+        await asyncio.sleep(self.latency)
+        (_, size, headers) = self.get_headers(req.match_info["name"])
+        res = web.StreamResponse(headers=headers)
+        res.content_length = size
+        return res
+
+    async def get(self, req):
+        await asyncio.sleep(self.latency)
+        (path, size, headers) = self.get_headers(req.match_info["name"])
+        (start, end, status) = (0, size - 1, 200)
+        match = RANGE_EXP.fullmatch(req.headers.get("Range", ""))
+        if_range = req.headers.get("If-Range")
+        if (if_range is not None) and (if_range not in (headers["ETag"], headers["Last-Modified"])):
+            match = None  # file changed since validator, sent whole
+        if match and match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+        elif match and match.group(2):
+            start = max(size - int(match.group(2)), 0)
+        if match:
+            if start >= size:
+                raise web.HTTPRequestRangeNotSatisfiable(
+                    headers={"Content-Range": f"bytes */{size}"})
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+        res = web.StreamResponse(status=status, headers=headers)
+        res.content_length = end - start + 1
+        await res.prepare(req)
+        with open(path, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file.read(min(STREAM_CHUNK_SIZE, remaining))
+                await throttle(len(chunk), self.bandwidth)
+                await res.write(chunk)
+                remaining -= len(chunk)
+
+        await res.write_eof()
+        return res
+
+
+class FakeGCSServer:
+    """
+    Fake of Cloud Storage JSON API endpoints used by the storage client for
+    object metadata and listing, media downloads, multipart and resumable
+    uploads, composes, copies, and deletes, storing objects in directory. Metadata of uploaded objects is kept
+    in memory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.objects = {}  # (bucket, name) -> resource
+        self.uploads = {}  # upload id -> (bucket, resource, path of received bytes)
+        self.app = web.Application(client_max_size=1024 ** 3)
+        router = self.app.router
+        router.add_get("/storage/v1/b/{bucket}/o", self.list_objects)
+        router.add_get("/storage/v1/b/{bucket}/o/{name:.+}", self.get_object)
+        router.add_delete("/storage/v1/b/{bucket}/o/{name:.+}", self.delete_object)
+        router.add_post("/storage/v1/b/{bucket}/o/{name:.+}/compose", self.compose)
+        router.add_post(
+            "/storage/v1/b/{bucket}/o/{name:.+}/copyTo/b/{dest_bucket}/o/{dest_name:.+}", self.copy)
+        router.add_get("/download/storage/v1/b/{bucket}/o/{name:.+}", self.download)
+        router.add_post("/upload/storage/v1/b/{bucket}/o", self.upload)
+        router.add_put("/upload/storage/v1/b/{bucket}/o", self.upload_chunk)
+        self.url = None
+
+    def get_path(self, bucket, name):
+        return os.path.join(self.directory, bucket, name)
+
+    def get_resource(self, req):
+        key = (req.match_info["bucket"], req.match_info["name"])
+        if key not in self.objects:
+            raise web.HTTPNotFound(
+                text=json.dumps(dict(error=dict(code=404, message="Not Found"))),
+                content_type="application/json",
+            )
+
+        return self.objects[key]
+
+    def store(self, bucket, resource, path):
+        """
+        Store received file at path as object of resource, rejecting it if
+        resource has CRC32C or MD5 hashes not matching its content
+        """
+        size = os.path.getsize(path)
+        hashes = get_hashes(path)
+        for key in ("crc32c", "md5Hash"):
+            if (resource.get(key) is not None) and (resource[key] != hashes[key]):
+                os.remove(path)
+                raise web.HTTPBadRequest(
+                    text=json.dumps(dict(error=dict(code=400, message=f"Provided {key} does not match"))),
+                    content_type="application/json",
+                )
+        os.replace(path, self.get_path(bucket, resource["name"]))
+        key = (bucket, resource["name"])
+        generation = int(self.objects.get(key, {}).get("generation", 0)) + 1
+        resource = dict(
+            resource,
+            bucket=bucket,
+            size=str(size),
+            generation=str(generation),
+            metageneration="1",
+            updated=datetime.datetime.utcnow().isoformat() + "Z",
+            **hashes,
+        )
+        self.objects[key] = resource
+        return resource
+
+    def create_upload_file(self, bucket, name):
+        path = self.get_path(bucket, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{uuid.uuid4().hex}.upload"
+
+    async def get_object(self, req):
+        return web.json_response(self.get_resource(req))
+
+    async def list_objects(self, req):
+        """
+        List objects of bucket by prefix, in a single page
+        """
+        bucket = req.match_info["bucket"]
+        prefix = req.query.get("prefix", "")
+        items = [
+            resource for ((b, name), resource) in sorted(self.objects.items())
+            if (b == bucket) and name.startswith(prefix)
+        ]
+        return web.json_response(dict(kind="storage#objects", items=items))
+
+    async def delete_object(self, req):
+        self.get_resource(req)
+        (bucket, name) = (req.match_info["bucket"], req.match_info["name"])
+        del self.objects[(bucket, name)]
+        os.remove(self.get_path(bucket, name))
+        return web.Response(status=204)
+
+    async def compose(self, req):
+        """
+        Compose source objects into destination object, which has a CRC32C but
+        no MD5 hash, as composite objects of Cloud Storage
+        """
+        bucket = req.match_info["bucket"]
+        body = await req.json()
+        resource = dict(body.get("destination") or {}, name=req.match_info["name"])
+        path = self.create_upload_file(bucket, resource["name"])
+        with open(path, "wb") as file:
+            for source in body["sourceObjects"]:
+                if (bucket, source["name"]) not in self.objects:
+                    raise web.HTTPNotFound()
+                with open(self.get_path(bucket, source["name"]), "rb") as source_file:
+                    while True:
+                        chunk = source_file.read(STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        file.write(chunk)
+
+        resource = {k: v for (k, v) in self.store(bucket, resource, path).items() if k != "md5Hash"}
+        self.objects[(bucket, resource["name"])] = resource
+        return web.json_response(resource)
+
+    async def copy(self, req):
+        """
+        Copy source object with its metadata to destination object, keeping
+        hashes of source, so a composite object stays without MD5 hash
+        """
+        source = self.get_resource(req)
+        (bucket, name) = (req.match_info["dest_bucket"], req.match_info["dest_name"])
+        path = self.create_upload_file(bucket, name)
+        shutil.copyfile(self.get_path(source["bucket"], source["name"]), path)
+        fields = ("contentType", "metadata")
+        resource = dict({k: source[k] for k in fields if k in source}, name=name)
+        resource = self.store(bucket, resource, path)
+        if "md5Hash" not in source:
+            resource = {k: v for (k, v) in resource.items() if k != "md5Hash"}
+        self.objects[(bucket, name)] = resource
+        return web.json_response(resource)
+
+    async def download(self, req):
+        resource = self.get_resource(req)
+        return web.FileResponse(self.get_path(resource["bucket"], resource["name"]))
+
+    async def upload(self, req):
+        bucket = req.match_info["bucket"]
+        upload_type = req.query.get("uploadType")
+        if upload_type == "resumable":
+            resource = await req.json()
+            upload_id = uuid.uuid4().hex
+            path = self.create_upload_file(bucket, resource["name"])
+            open(path, "wb").close()
+            self.uploads[upload_id] = (bucket, resource, path)
+            location = f"{self.url}/upload/storage/v1/b/{bucket}/o?uploadType=resumable&upload_id={upload_id}"
+            return web.Response(headers={"Location": location})
+
+        if upload_type == "multipart":
+            (resource, data) = parse_multipart(await req.read(), req.headers["Content-Type"])
+            path = self.create_upload_file(bucket, resource["name"])
+            with open(path, "wb") as file:
+                file.write(data)
+            return web.json_response(self.store(bucket, resource, path))
+
+        raise web.HTTPBadRequest(text=f"Unsupported upload type: {upload_type}")
+
+    async def upload_chunk(self, req):
+        (bucket, resource, path) = self.uploads[req.query["upload_id"]]
+        match = CONTENT_RANGE_EXP.fullmatch(req.headers.get("Content-Range", ""))
+        if match is None:
+            raise web.HTTPBadRequest(text="Invalid Content-Range")
+
+        data = await req.read()
+        with open(path, "ab") as file:
+            file.write(data)
+        received = os.path.getsize(path)
+
+        total = match.group(3)
+        if (total == "*") or (received < int(total)):
+            return web.Response(status=308, headers={"Range": f"bytes=0-{received - 1}"})
+
+        del self.uploads[req.query["upload_id"]]
+        return web.json_response(self.store(bucket, resource, path))
+
+
+def parse_multipart(body, content_type):
+    """
+    Parse multipart/related upload body into (resource, data)
+    """
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1)
+    parts = body.split(b"--" + boundary.encode())[1:-1]
+    (metadata, data) = [part.split(b"\r\n\r\n", 1)[1][:-2] for part in parts]
+    return (json.loads(metadata), data)
+
+
+async def start_server(server, host="127.0.0.1", port=0):
+    """
+    Start fake server app on host, on a free port by default, setting its url.
+    Return runner to clean up.
+    """
+    runner = web.AppRunner(server.app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    (host, port) = runner.addresses[0][:2]
+    server.url = f"http://{host}:{port}"
+    return runner
@@ -0,0 +1,122 @@
+"""
+Parquet footers probed over HTTP with Range requests, for learning schema,
+row groups, and column statistics of remote files without downloading them
+"""
+
+import struct
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dtc_de.extract_load import download
+
+
+PROBE_SIZE = 64 * 1024  # bytes requested from end of file by first request
+MAGIC = b"PAR1"
+TAIL_SIZE = 8  # bytes of footer length and magic ending parquet files
+
+
+def parse_content_range(value):
+    """
+    Get (start, total size) from a "bytes START-END/SIZE" Content-Range header
+    """
+    (start_end, total) = value.split(" ", 1)[1].split("/")
+    return (int(start_end.split("-")[0]), int(total))
+
+
+async def fetch_range(session, url, range_value):
+    """
+    Fetch byte range of url, return (body, start offset, total size)
+    """
+    async with session.get(url, headers={"Range": f"bytes={range_value}"}) as res:
+        res.raise_for_status()
+        if res.status != 206:
+            raise ValueError(f"Range request not honored by server: {url}")
+
+        (start, size) = parse_content_range(res.headers["Content-Range"])
+        return (await res.read(), start, size)
+
+
+async def fetch_footer(session, url, probe_size=PROBE_SIZE):
+    """
+    Fetch footer of parquet file at url with at most two Range requests: the
+    last probe_size bytes, which hold whole footer of most files, then the
+    rest of footer if longer. Return (footer with magic and length, file size).
+    """
+    (tail, start, size) = await fetch_range(session, url, f"-{probe_size}")
+    if (len(tail) < TAIL_SIZE) or (tail[-4:] != MAGIC):
+        raise ValueError(f"Not a parquet file: {url}")
+
+    (footer_length,) = struct.unpack("<I", tail[-TAIL_SIZE:-4])
+    footer_start = size - TAIL_SIZE - footer_length
+    if footer_start < len(MAGIC):
+        raise ValueError(f"Invalid parquet footer length {footer_length}: {url}")
+    if footer_start < start:
+        (head, start, _) = await fetch_range(session, url, f"{footer_start}-{start - 1}")
+        tail = head + tail
+
+    return (tail[footer_start - start:], size)
+
+
+def parse_footer(footer):
+    """
+    Parse footer bytes, ending with footer length and magic, into a parquet
+    file whose metadata and Arrow schema are readable, but not its data
+    """
+    return pq.ParquetFile(pa.BufferReader(MAGIC + footer))
+
+
+def get_column_statistics(row_group):
+    """
+    Get {column: dict(min, max, null_count)} of row group metadata, where min
+    and max are None if not recorded
+    """
+    columns = {}
+    for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        statistics = column.statistics
+        has_min_max = (statistics is not None) and statistics.has_min_max
+        columns[column.path_in_schema] = dict(
+            min=statistics.min if has_min_max else None,
+            max=statistics.max if has_min_max else None,
+            null_count=statistics.null_count if statistics is not None else None,
+        )
+
+    return columns
+
+
+async def probe_footer(session, url, retries=download.RETRIES, backoff=download.BACKOFF, on_retry=None):
+    """
+    Probe parquet file at url from its footer only, retrying transient errors,
+    see download.retry:
+        probe = await probe_footer(session, "https://.../green_tripdata_2022-01.parquet")
+        probe["schema"], probe["num_rows"]
+
+    Return dict of:
+    - size: bytes of file
+    - num_rows: rows of file
+    - schema: Arrow schema of file
+    - metadata: parquet file metadata
+    - row_groups: list of dict(num_rows, total_byte_size, columns), see
+      get_column_statistics
+    """
+    (footer, size) = await download.retry(
+        lambda: fetch_footer(session, url), retries, backoff, on_retry)
+    parquet_file = parse_footer(footer)
+    metadata = parquet_file.metadata
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        row_groups.append(dict(
+            num_rows=row_group.num_rows,
+            total_byte_size=row_group.total_byte_size,
+            columns=get_column_statistics(row_group),
+        ))
+
+    return dict(
+        size=size,
+        num_rows=metadata.num_rows,
+        schema=parquet_file.schema_arrow,
+        metadata=metadata,
+        row_groups=row_groups,
+    )
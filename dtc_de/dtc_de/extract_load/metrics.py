@@ -0,0 +1,172 @@
+"""
+Per-file timing spans and counters of the ingest pipeline, written as JSON
+lines and optionally aggregated into a Prometheus textfile for node exporter
+textfile collectors
+"""
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import time
+
+
+COUNTERS = ("bytes_in", "bytes_out", "rows", "duplicates", "out_of_month", "retries", "queue_wait")
+PEAKS = ("rss",)
+PROMETHEUS_PREFIX = "tlc_ingest"
+
+
+class FileMetrics:
+    """
+    Timing spans and counters of one file, where each span is a stage such as
+    "download" or "upload" with its duration and attributes, and counters are:
+    - bytes_in: bytes downloaded
+    - bytes_out: bytes uploaded or stored
+    - rows: rows read
+    - duplicates, out_of_month: rows removed by row filter
+    - retries: retried requests
+    - queue_wait: seconds waiting for a transfer slot or an executor worker
+
+    Peaks are maxima rather than totals, written as "peak_KEY":
+    - rss: resident set size in bytes of processes running transforms
+    """
+
+    def __init__(self, file=None):
+        self.file = file
+        self.spans = []
+        self.counters = collections.Counter()
+        self.peaks = dict.fromkeys(PEAKS, 0)
+
+    @contextlib.contextmanager
+    def span(self, stage, **attributes):
+        """
+        Time block as span of stage, whose attributes can be set within block:
+            with metrics.span("download") as span:
+                span["bytes"] = await download(...)
+        """
+        span = dict(stage=stage, start=time.time(), **attributes)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span["seconds"] = time.perf_counter() - start
+            self.spans.append(span)
+
+    def add_span(self, stage, seconds, **attributes):
+        """
+        Add span timed elsewhere, such as in an executor worker process
+        """
+        self.spans.append(dict(stage=stage, seconds=seconds, **attributes))
+
+    def add(self, **counts):
+        self.counters.update(counts)
+
+    def peak(self, **values):
+        for (key, value) in values.items():
+            self.peaks[key] = max(self.peaks[key], value)
+
+    def to_dict(self, **fields):
+        return dict(
+            file=self.file,
+            **fields,
+            spans=self.spans,
+            **{key: self.counters[key] for key in COUNTERS},
+            **{f"peak_{key}": self.peaks[key] for key in PEAKS},
+        )
+
+
+class Recorder:
+    """
+    Recorder of file metrics, writing one JSON line per file to output path,
+    or to stdout if output is "-", and aggregates per stage and status to a
+    Prometheus textfile if defined, replaced atomically on close:
+        with Recorder("metrics.jsonl", "/var/lib/node_exporter/tlc_ingest.prom") as recorder:
+            metrics = recorder.file("green_tripdata_2022-01.parquet")
+            with metrics.span("download"):
+                ...
+            recorder.emit(metrics, status="succeeded")
+    """
+
+    def __init__(self, output=None, textfile=None):
+        self.output = output
+        self.textfile = textfile
+        self.stage_seconds = collections.Counter()
+        self.stage_count = collections.Counter()
+        self.counters = collections.Counter()
+        self.peaks = dict.fromkeys(PEAKS, 0)
+        self.files = collections.Counter()
+        self._file = None
+
+    def __enter__(self):
+        if self.output == "-":
+            self._file = sys.stdout
+        elif self.output is not None:
+            self._file = open(self.output, "a")
+
+        return self
+
+    def __exit__(self, *exc_info):
+        if (self._file is not None) and (self._file is not sys.stdout):
+            self._file.close()
+        self._file = None
+
+        if self.textfile is not None:
+            self.write_textfile()
+
+    def file(self, file=None):
+        return FileMetrics(file)
+
+    def emit(self, metrics, **fields):
+        """
+        Write file metrics as a JSON line with fields, such as status, and add
+        them to aggregates
+        """
+        for span in metrics.spans:
+            self.stage_seconds[span["stage"]] += span["seconds"]
+            self.stage_count[span["stage"]] += 1
+        self.counters.update(metrics.counters)
+        for key in PEAKS:
+            self.peaks[key] = max(self.peaks[key], metrics.peaks[key])
+        if "status" in fields:
+            self.files[fields["status"]] += 1
+
+        if self._file is not None:
+            self._file.write(json.dumps(metrics.to_dict(**fields)) + "\n")
+            self._file.flush()
+
+    def write_textfile(self):
+        lines = []
+
+        def add_metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+            for (labels, value) in samples:
+                label_text = ",".join(f'{key}="{label}"' for (key, label) in labels.items())
+                if label_text:
+                    label_text = f"{{{label_text}}}"
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{label_text} {value}")
+
+        add_metric(
+            "stage_seconds_total", "counter", "Seconds spent per stage",
+            [(dict(stage=stage), seconds) for (stage, seconds) in sorted(self.stage_seconds.items())],
+        )
+        add_metric(
+            "stage_spans_total", "counter", "Spans recorded per stage",
+            [(dict(stage=stage), count) for (stage, count) in sorted(self.stage_count.items())],
+        )
+        add_metric(
+            "files_total", "counter", "Files processed per status",
+            [(dict(status=status), count) for (status, count) in sorted(self.files.items())],
+        )
+        for key in COUNTERS:
+            add_metric(f"{key}_total", "counter", f"Total {key} of files", [({}, self.counters[key])])
+        for key in PEAKS:
+            add_metric(f"peak_{key}", "gauge", f"Peak {key} of files", [({}, self.peaks[key])])
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {time.time()}")
+
+        tmp_file = f"{self.textfile}.tmp"
+        with open(tmp_file, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.textfile)
@@ -0,0 +1,288 @@
+"""
+Scheduling of concurrent transfers sharing a single HTTP session, and
+admission of work within a memory budget
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+
+import aiohttp
+
+
+DNS_CACHE_TTL = 300  # seconds
+KEEPALIVE_TIMEOUT = 60  # seconds
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 8
+THROUGHPUT_TOLERANCE = 0.05  # relative throughput change considered as noise
+MEMORY_SAMPLE_INTERVAL = 0.5  # seconds between memory usage samples
+IN_MEMORY_FILESYSTEMS = ("tmpfs", "ramfs")  # filesystems whose files use memory
+
+
+def create_session(max_connections=MAX_CONCURRENCY):
+    """
+    Create HTTP session to be shared by all requests of an invocation, with a
+    connection pool keeping connections alive and caching DNS resolution
+    """
+    connector = aiohttp.TCPConnector(
+        limit=max_connections,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+class Transfer:
+    """
+    Transfer admitted by AdaptiveLimiter, reporting transferred bytes and
+    seconds it waited for admission
+    """
+
+    def __init__(self, queue_wait=0):
+        self.nbytes = 0
+        self.queue_wait = queue_wait
+
+
+class AdaptiveLimiter:
+    """
+    Global limit on in-flight transfers adapting between min_limit and max_limit
+    based on observed throughput and errors:
+    - after every round of `limit` completed transfers, limit increases by one
+      if aggregate throughput improved, and decreases by one if it worsened
+    - on transfer error, limit is halved
+
+    Limiter must be created within a running event loop:
+        limiter = AdaptiveLimiter(max_limit=8)
+        async with limiter.transfer() as transfer:
+            transfer.nbytes = await stream_to_file(res, file)
+    """
+
+    def __init__(
+        self,
+        min_limit=MIN_CONCURRENCY,
+        max_limit=MAX_CONCURRENCY,
+        initial_limit=None,
+    ):
+        assert 1 <= min_limit <= max_limit, "limits must satisfy 1 <= min_limit <= max_limit"
+
+        if initial_limit is None:
+            initial_limit = max(min_limit, max_limit // 2)
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(initial_limit, min_limit), max_limit)
+        self.in_flight = 0
+
+        self._condition = asyncio.Condition()
+        self._throughput = None
+        self._reset_round()
+
+    def _reset_round(self):
+        self._round_bytes = 0
+        self._round_count = 0
+        self._round_start = time.monotonic()
+
+    def _adapt(self, nbytes, error):
+        if error:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._reset_round()
+            return
+
+        self._round_bytes += nbytes
+        self._round_count += 1
+        if self._round_count < self.limit:
+            return
+
+        elapsed = time.monotonic() - self._round_start
+        throughput = self._round_bytes / elapsed if elapsed > 0 else 0
+        if (self._throughput is None) or (throughput > self._throughput * (1 + THROUGHPUT_TOLERANCE)):
+            self.limit = min(self.max_limit, self.limit + 1)
+        elif throughput < self._throughput * (1 - THROUGHPUT_TOLERANCE):
+            self.limit = max(self.min_limit, self.limit - 1)
+
+        self._throughput = throughput
+        self._reset_round()
+
+    @contextlib.asynccontextmanager
+    async def transfer(self):
+        start = time.monotonic()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+        transfer = Transfer(time.monotonic() - start)
+        error = False
+        try:
+            yield transfer
+        except Exception:
+            error = True
+            raise
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._adapt(transfer.nbytes, error)
+                self._condition.notify_all()
+
+
+def get_memory_usage():
+    """
+    Get memory in bytes used by container from cgroup v2 memory stats, as
+    anonymous memory, which includes transform worker processes, plus shared
+    memory, which includes files of in-memory filesystems such as tmpfs that
+    cannot be reclaimed until deleted, but not reclaimable page cache of files
+    on disk, or resident memory of this process if unavailable, or 0 if unknown
+    """
+    try:
+        with open("/sys/fs/cgroup/memory.stat", "r") as file:
+            stats = dict(line.split() for line in file)
+        return int(stats["anon"]) + int(stats.get("shmem", 0))
+    except (OSError, ValueError, KeyError):
+        pass
+
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def get_filesystem_type(path):
+    """
+    Get type of filesystem mounted at longest mount point containing path,
+    from /proc/mounts, or None if unknown
+    """
+    path = os.path.realpath(path)
+    (longest, fstype) = ("", None)
+    try:
+        with open("/proc/mounts", "r") as file:
+            for line in file:
+                (_, mount_point, mount_type) = line.split()[:3]
+                mount_point = mount_point.replace("\\040", " ")
+                prefix = mount_point.rstrip("/") + "/"
+                contains = (path == mount_point) or path.startswith(prefix)
+                if contains and (len(prefix) > len(longest)):
+                    (longest, fstype) = (prefix, mount_type)
+    except (OSError, ValueError):
+        return None
+
+    return fstype
+
+
+class Reservation:
+    """
+    Reservation admitted by MemoryBudget, reporting seconds it waited for
+    admission
+    """
+
+    def __init__(self, nbytes, queue_wait=0):
+        self.nbytes = nbytes
+        self.queue_wait = queue_wait
+
+
+class MemoryBudget:
+    """
+    Admission of work such as downloads and transforms only while memory in
+    use plus estimated working set of admitted work fits within budget bytes:
+    - memory in use is memory sampled when budget is created, plus estimates
+      reserved by admitted work, plus memory sampled beyond both, which
+      corrects underestimates until work is released
+    - files written by work on an in-memory filesystem such as tmpfs, e.g.
+      Cloud Run's, use memory until deleted, so their estimated sizes are
+      reserved with work and kept reserved after it is released, until files
+      are released once deleted
+    - work is always admitted when no other work is in progress, so that an
+      estimate larger than budget runs alone rather than waiting forever
+    - all work is admitted if budget is undefined
+
+    Files are on an in-memory filesystem if files_in_memory, or if undefined
+    when their filesystem is one of IN_MEMORY_FILESYSTEMS.
+
+    Budget must be created within a running event loop:
+        memory = MemoryBudget(3 * 1024 ** 3)
+        async with memory.reserve(estimate, files={output_file: output_size}):
+            await transform(...)
+        ...
+        os.remove(output_file)
+        await memory.release_files(output_file)
+    """
+
+    def __init__(self, budget=None, sample_interval=MEMORY_SAMPLE_INTERVAL, files_in_memory=None):
+        self.budget = budget
+        self.sample_interval = sample_interval
+        self.files_in_memory = files_in_memory
+        self.baseline = get_memory_usage()
+        self.reserved = 0
+        self.in_progress = 0
+        self.peak_usage = self.baseline
+
+        self._condition = asyncio.Condition()
+        self._excess = 0
+        self._sampled_at = time.monotonic()
+        self._files = {}
+        self._filesystems = {}
+
+    def _sample(self):
+        now = time.monotonic()
+        if now - self._sampled_at >= self.sample_interval:
+            usage = get_memory_usage()
+            self.peak_usage = max(self.peak_usage, usage)
+            self._excess = max(0, usage - self.baseline - self.reserved)
+            self._sampled_at = now
+
+        return self._excess
+
+    def fits(self, nbytes):
+        if (self.budget is None) or (self.in_progress == 0):
+            return True
+
+        return self.baseline + self.reserved + self._sample() + nbytes <= self.budget
+
+    def is_in_memory(self, path):
+        if self.budget is None:
+            return False
+        if self.files_in_memory is not None:
+            return self.files_in_memory
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory not in self._filesystems:
+            self._filesystems[directory] = get_filesystem_type(directory)
+        return self._filesystems[directory] in IN_MEMORY_FILESYSTEMS
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, nbytes, files=None):
+        """
+        Reserve nbytes while work runs, plus estimated sizes of files
+        {path: bytes} written by work if on an in-memory filesystem, kept
+        reserved until released by release_files
+        """
+        files = {path: size for (path, size) in (files or {}).items() if self.is_in_memory(path)}
+        total = nbytes + sum(files.values())
+        start = time.monotonic()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.fits(total))
+            self.reserved += total
+            self.in_progress += 1
+            for (path, size) in files.items():
+                self._files[path] = self._files.get(path, 0) + size
+
+        try:
+            yield Reservation(total, time.monotonic() - start)
+        finally:
+            async with self._condition:
+                self.reserved -= nbytes
+                self.in_progress -= 1
+                self._sample()
+                self._condition.notify_all()
+
+    async def release_files(self, *paths):
+        """
+        Release reservations of deleted files at paths or under directories
+        at paths
+        """
+        prefixes = tuple(f"{path.rstrip('/')}/" for path in paths)
+        async with self._condition:
+            for path in [p for p in self._files if (p in paths) or p.startswith(prefixes)]:
+                self.reserved -= self._files.pop(path)
+            self._sample()
+            self._condition.notify_all()
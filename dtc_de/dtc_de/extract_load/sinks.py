@@ -0,0 +1,558 @@
+"""
+Storage sinks behind one async API, storing objects by key along with custom
+metadata in Cloud Storage buckets, local directories, or memory, so the
+pipeline ingests to any of them and upload strategies change without
+touching extract logic:
+    sink = get_sink("gs://BUCKET_NAME", upload_strategy="composite")
+    await sink.put_file("green.parquet", "raw/green/green.parquet", metadata={"schema_version": "raw"})
+    info = await sink.get_info("raw/green/green.parquet")
+
+Uploads are validated against digests of files computed while they were
+downloaded or written if given, see checksum.Digest.
+"""
+
+import asyncio
+import json
+import math
+import os
+import shutil
+import time
+import uuid
+
+import aiofiles
+from google.api_core import exceptions
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+
+from dtc_de.extract_load import checksum, metrics
+
+
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # resumable upload chunk, multiple of 256 KiB
+UPLOAD_STRATEGIES = ("chunked", "composite")
+COMPOSITE_THRESHOLD = 64 * 1024 * 1024  # bytes above which "composite" strategy splits files
+COMPOSITE_PART_SIZE = 32 * 1024 * 1024  # bytes per part, raised to fit MAX_COMPOSE_SOURCES
+COMPOSITE_PREFIX = "tmp/composite"  # outside data paths read by external tables
+MAX_COMPOSE_SOURCES = 32  # Cloud Storage limit of objects per compose request
+METADATA_DIR = ".metadata"  # hidden from dataset readers, as are dot-prefixed paths
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def get_bucket(bucket_name, endpoint=None):
+    """
+    Get Cloud Storage bucket using default credentials:
+        get_bucket("BUCKET_NAME")
+
+    Get bucket from a local endpoint such as a fake GCS server, without credentials:
+        get_bucket("BUCKET_NAME", endpoint="http://localhost:4443")
+    """
+    if endpoint is None:
+        client = storage.Client()
+    else:
+        client = storage.Client(
+            credentials=AnonymousCredentials(),
+            project="local",
+            client_options={"api_endpoint": endpoint},
+        )
+
+    return client.bucket(bucket_name)
+
+
+def check_digest(key, digest, expected):
+    """
+    Raise ValueError if digest of object at key, as checksum.Digest.to_dict,
+    does not match expected digest, comparing hashes defined in both
+    """
+    for name in ("crc32c", "md5_hash"):
+        if (digest.get(name) is not None) and (expected.get(name) is not None) \
+                and (digest[name] != expected[name]):
+            raise ValueError(f"{name} {digest[name]} of {key} does not match expected {expected[name]}")
+
+
+async def iterate_chunks(chunks):
+    """
+    Iterate chunks of an iterable or async iterable of bytes
+    """
+    if hasattr(chunks, "__aiter__"):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
+
+
+class Sink:
+    """
+    Base of sinks storing objects by key with custom metadata. Blocking
+    operations run on executor (a thread pool), or on default executor
+    threads if undefined. Object info returned by put and get_info methods
+    is dict(size, crc32c, md5_hash, metadata), with base64 hashes or None
+    if unknown.
+
+    Subclasses implement put_file, put_stream, get_info, get_bytes,
+    get_file, list_keys, delete, and get_url.
+    """
+
+    executor = None
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def get_url(self, key=""):
+        raise NotImplementedError()
+
+    async def put_file(self, local_file, key, metadata=None, digest=None, file_metrics=None):
+        """
+        Store local file as object at key with custom metadata, validated
+        against digest if defined. Upload is recorded as a span of
+        file_metrics if defined.
+        """
+        raise NotImplementedError()
+
+    async def put_stream(self, key, chunks, metadata=None, content_type=None):
+        """
+        Store chunks of bytes, from an iterable or async iterable, as object
+        at key with custom metadata, holding one chunk at a time
+        """
+        raise NotImplementedError()
+
+    async def put_bytes(self, key, data, metadata=None, content_type=None):
+        return await self.put_stream(key, [data], metadata, content_type)
+
+    async def put_batch(self, files, metadata=None, file_metrics=None):
+        """
+        Store [(local file, key)] concurrently with same custom metadata,
+        return their object info
+        """
+        return await asyncio.gather(*[
+            self.put_file(local_file, key, metadata, file_metrics=file_metrics)
+            for (local_file, key) in files
+        ])
+
+    async def get_info(self, key):
+        """
+        Get info of object at key, or None if it does not exist
+        """
+        raise NotImplementedError()
+
+    async def exists(self, key):
+        return (await self.get_info(key)) is not None
+
+    async def get_bytes(self, key):
+        """
+        Get content of object at key, or None if it does not exist
+        """
+        raise NotImplementedError()
+
+    async def get_file(self, key, local_file):
+        """
+        Copy object at key to local file, return its info or None if it does
+        not exist
+        """
+        raise NotImplementedError()
+
+    async def list_keys(self, prefix=""):
+        """
+        List sorted keys of objects starting with prefix
+        """
+        raise NotImplementedError()
+
+    async def delete(self, keys):
+        """
+        Delete objects at keys, ignoring missing ones
+        """
+        raise NotImplementedError()
+
+
+class GCSSink(Sink):
+    """
+    Sink storing objects in Cloud Storage bucket, through blocking storage
+    client calls run on executor to allow concurrent uploads.
+
+    Files are uploaded with upload_strategy:
+    - "chunked": one resumable upload in chunks of chunk_size bytes
+    - "composite": files larger than composite_threshold bytes are split in
+      parts of composite_part_size bytes, uploaded concurrently as temporary
+      objects under COMPOSITE_PREFIX, composed into a temporary object and
+      copied to object, see put_composite; smaller files are chunked
+
+    A digest of file is sent with chunked uploads so Cloud Storage rejects
+    content not matching it; without digest, CRC32C is computed by the
+    storage client while uploading and checked against the one reported by
+    Cloud Storage. Composite objects are checked against CRC32C of digest
+    once composed, before being copied to their key, since compose does not
+    take hashes.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        executor=None,
+        upload_strategy="chunked",
+        chunk_size=UPLOAD_CHUNK_SIZE,
+        composite_threshold=COMPOSITE_THRESHOLD,
+        composite_part_size=COMPOSITE_PART_SIZE,
+    ):
+        if upload_strategy not in UPLOAD_STRATEGIES:
+            raise ValueError(f"Unknown upload strategy: {upload_strategy}")
+
+        self.bucket = bucket
+        self.executor = executor
+        self.upload_strategy = upload_strategy
+        self.chunk_size = chunk_size
+        self.composite_threshold = composite_threshold
+        self.composite_part_size = composite_part_size
+
+    def get_url(self, key=""):
+        return f"gs://{self.bucket.name}/{key}"
+
+    @staticmethod
+    def get_blob_info(blob):
+        return dict(
+            size=blob.size,
+            crc32c=blob.crc32c,
+            md5_hash=blob.md5_hash,
+            metadata=blob.metadata or {},
+        )
+
+    def upload_chunked(self, local_file, key, metadata=None, digest=None):
+        blob = self.bucket.blob(key, chunk_size=self.chunk_size)
+        blob.metadata = metadata
+        if digest is not None:
+            blob.crc32c = digest["crc32c"]
+            if digest["md5_hash"] is not None:
+                blob.md5_hash = digest["md5_hash"]
+        blob.upload_from_filename(local_file, checksum=None if digest is not None else "crc32c")
+
+        return self.get_blob_info(blob)
+
+    def upload_part(self, local_file, blob_name, offset, size):
+        blob = self.bucket.blob(blob_name, chunk_size=self.chunk_size)
+        with open(local_file, "rb") as file:
+            file.seek(offset)
+            blob.upload_from_file(file, size=size, checksum="crc32c")
+
+        return blob
+
+    def compose(self, key, parts, metadata=None):
+        blob = self.bucket.blob(key)
+        blob.metadata = metadata
+        blob.compose(parts)
+        return blob
+
+    def copy(self, blob, key):
+        return self.bucket.copy_blob(blob, self.bucket, key)
+
+    async def put_composite(self, local_file, key, size, metadata=None, digest=None):
+        """
+        Upload file of size bytes as concurrent parts composed into a temporary
+        object, copied to object at key once its CRC32C matches digest if
+        defined, so a failed upload leaves any previous object at key intact.
+        Parts and temporary object are deleted once copied or failed.
+        """
+        part_size = max(self.composite_part_size, math.ceil(size / MAX_COMPOSE_SOURCES))
+        prefix = f"{COMPOSITE_PREFIX}/{uuid.uuid4().hex}"
+        offsets = range(0, size, part_size)
+        composed_name = f"{prefix}/composed"
+        try:
+            parts = await asyncio.gather(*[
+                self.run(
+                    self.upload_part,
+                    local_file, f"{prefix}/{i}", offset, min(part_size, size - offset),
+                )
+                for (i, offset) in enumerate(offsets)
+            ])
+            composed = await self.run(self.compose, composed_name, parts, metadata)
+            if digest is not None:
+                check_digest(key, dict(crc32c=composed.crc32c), digest)
+            blob = await self.run(self.copy, composed, key)
+        finally:
+            await self.delete([f"{prefix}/{i}" for i in range(len(offsets))] + [composed_name])
+
+        return self.get_blob_info(blob)
+
+    async def put_file(self, local_file, key, metadata=None, digest=None, file_metrics=None):
+        file_metrics = file_metrics or metrics.FileMetrics()
+        nbytes = os.path.getsize(local_file)
+        composite = (self.upload_strategy == "composite") and (nbytes > self.composite_threshold)
+        submitted = time.monotonic()
+
+        with file_metrics.span(
+            "upload",
+            object=key,
+            bytes=nbytes,
+            strategy="composite" if composite else "chunked",
+            validation="client" if (digest is None) or composite else "server",
+        ) as span:
+            if composite:
+                info = await self.put_composite(local_file, key, nbytes, metadata, digest)
+            else:
+                def upload():
+                    file_metrics.add(queue_wait=time.monotonic() - submitted)
+                    return self.upload_chunked(local_file, key, metadata, digest)
+
+                info = await self.run(upload)
+            span["crc32c"] = info["crc32c"]
+        file_metrics.add(bytes_out=nbytes)
+
+        return info
+
+    async def put_stream(self, key, chunks, metadata=None, content_type=None):
+        blob = self.bucket.blob(key, chunk_size=self.chunk_size)
+        blob.metadata = metadata
+        writer = await self.run(
+            lambda: blob.open("wb", ignore_flush=True, content_type=content_type, checksum="crc32c"))
+        try:
+            async for chunk in iterate_chunks(chunks):
+                await self.run(writer.write, chunk)
+        finally:
+            await self.run(writer.close)
+
+        await self.run(blob.reload)
+        return self.get_blob_info(blob)
+
+    async def put_bytes(self, key, data, metadata=None, content_type=None):
+        blob = self.bucket.blob(key)
+        blob.metadata = metadata
+        await self.run(
+            lambda: blob.upload_from_string(data, content_type=content_type, checksum="crc32c"))
+        return self.get_blob_info(blob)
+
+    async def get_info(self, key):
+        blob = await self.run(self.bucket.get_blob, key)
+        return None if blob is None else self.get_blob_info(blob)
+
+    async def get_bytes(self, key):
+        try:
+            return await self.run(self.bucket.blob(key).download_as_bytes)
+        except exceptions.NotFound:
+            return None
+
+    def download(self, key, local_file):
+        blob = self.bucket.get_blob(key)
+        if blob is None:
+            return None
+
+        blob.download_to_filename(local_file, checksum="crc32c")
+        return self.get_blob_info(blob)
+
+    async def get_file(self, key, local_file):
+        return await self.run(self.download, key, local_file)
+
+    async def list_keys(self, prefix=""):
+        return await self.run(
+            lambda: sorted(blob.name for blob in self.bucket.list_blobs(prefix=prefix)))
+
+    async def delete(self, keys):
+        if len(keys) > 0:
+            await self.run(lambda: self.bucket.delete_blobs(keys, on_error=lambda blob: None))
+
+
+class LocalSink(Sink):
+    """
+    Sink storing objects as files under root directory, with their info in
+    JSON files under "ROOT/.metadata/". Objects are streamed to a temporary
+    file renamed once complete, and hashed while written so they are
+    validated against digest without another read.
+    """
+
+    def __init__(self, root, executor=None):
+        self.root = root
+        self.executor = executor
+
+    def get_url(self, key=""):
+        return f"file://{os.path.abspath(os.path.join(self.root, key))}"
+
+    def get_path(self, key):
+        return os.path.join(self.root, key)
+
+    def get_info_path(self, key):
+        return os.path.join(self.root, METADATA_DIR, f"{key}.json")
+
+    def commit(self, key, tmp_path, info):
+        """
+        Replace object at key by temporary file, along with its info
+        """
+        info_path = self.get_info_path(key)
+        os.makedirs(os.path.dirname(info_path), exist_ok=True)
+        with open(f"{info_path}.tmp", "w") as file:
+            json.dump(info, file)
+        os.replace(tmp_path, self.get_path(key))
+        os.replace(f"{info_path}.tmp", info_path)
+
+    async def put_stream(self, key, chunks, metadata=None, content_type=None, digest=None):
+        path = self.get_path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        written = checksum.Digest()
+        try:
+            async with aiofiles.open(tmp_path, "wb") as file:
+                async for chunk in iterate_chunks(chunks):
+                    written.update(chunk)
+                    await file.write(chunk)
+            info = dict(size=written.nbytes, **written.to_dict(), metadata=metadata or {})
+            if digest is not None:
+                check_digest(key, info, digest)
+            await self.run(self.commit, key, tmp_path, info)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return info
+
+    async def put_file(self, local_file, key, metadata=None, digest=None, file_metrics=None):
+        file_metrics = file_metrics or metrics.FileMetrics()
+        nbytes = os.path.getsize(local_file)
+
+        async def read_chunks():
+            async with aiofiles.open(local_file, "rb") as file:
+                while True:
+                    chunk = await file.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        with file_metrics.span("upload", object=key, bytes=nbytes, validation="local") as span:
+            info = await self.put_stream(key, read_chunks(), metadata, digest=digest)
+            span["crc32c"] = info["crc32c"]
+        file_metrics.add(bytes_out=nbytes)
+
+        return info
+
+    def read_info(self, key):
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        if not os.path.exists(self.get_info_path(key)):
+            return dict(size=os.path.getsize(path), crc32c=None, md5_hash=None, metadata={})
+
+        with open(self.get_info_path(key)) as file:
+            return json.load(file)
+
+    async def get_info(self, key):
+        return await self.run(self.read_info, key)
+
+    async def get_bytes(self, key):
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+
+        async with aiofiles.open(path, "rb") as file:
+            return await file.read()
+
+    def copy(self, key, local_file):
+        info = self.read_info(key)
+        if info is not None:
+            shutil.copyfile(self.get_path(key), local_file)
+
+        return info
+
+    async def get_file(self, key, local_file):
+        return await self.run(self.copy, key, local_file)
+
+    def walk(self, prefix):
+        """
+        List keys starting with prefix, skipping object info and temporary
+        files
+        """
+        keys = []
+        for (dirpath, dirnames, filenames) in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d != METADATA_DIR]
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(dirpath, filename), self.root)
+                if key.startswith(prefix) and not filename.endswith(".tmp"):
+                    keys.append(key)
+
+        return sorted(keys)
+
+    async def list_keys(self, prefix=""):
+        return await self.run(self.walk, prefix)
+
+    def remove(self, keys):
+        for key in keys:
+            for path in (self.get_path(key), self.get_info_path(key)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    async def delete(self, keys):
+        await self.run(self.remove, keys)
+
+
+class MemorySink(Sink):
+    """
+    Sink storing objects in memory as {key: (content, info)}, for running
+    the pipeline without storage
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_url(self, key=""):
+        return f"memory://{key}"
+
+    def store(self, key, data, metadata=None, expected=None):
+        digest = checksum.Digest()
+        digest.update(data)
+        info = dict(size=len(data), **digest.to_dict(), metadata=metadata or {})
+        if expected is not None:
+            check_digest(key, info, expected)
+        self.objects[key] = (data, info)
+
+        return info
+
+    async def put_file(self, local_file, key, metadata=None, digest=None, file_metrics=None):
+        file_metrics = file_metrics or metrics.FileMetrics()
+        with file_metrics.span("upload", object=key, validation="local") as span:
+            with open(local_file, "rb") as file:
+                data = await self.run(file.read)
+            info = self.store(key, data, metadata, digest)
+            span["bytes"] = info["size"]
+            span["crc32c"] = info["crc32c"]
+        file_metrics.add(bytes_out=info["size"])
+
+        return info
+
+    async def put_stream(self, key, chunks, metadata=None, content_type=None):
+        data = b"".join([chunk async for chunk in iterate_chunks(chunks)])
+        return self.store(key, data, metadata)
+
+    async def get_info(self, key):
+        return self.objects[key][1] if key in self.objects else None
+
+    async def get_bytes(self, key):
+        return self.objects[key][0] if key in self.objects else None
+
+    async def get_file(self, key, local_file):
+        if key not in self.objects:
+            return None
+
+        (data, info) = self.objects[key]
+        with open(local_file, "wb") as file:
+            await self.run(file.write, data)
+
+        return info
+
+    async def list_keys(self, prefix=""):
+        return sorted(key for key in self.objects if key.startswith(prefix))
+
+    async def delete(self, keys):
+        for key in keys:
+            self.objects.pop(key, None)
+
+
+def get_sink(url, executor=None, gcs_endpoint=None, upload_strategy="chunked"):
+    """
+    Get sink of url:
+    - "gs://BUCKET_NAME": GCSSink of bucket, through gcs_endpoint if defined,
+      with upload_strategy
+    - "file:///PATH" or "/PATH": LocalSink of directory
+    - "memory://": MemorySink
+    """
+    if url.startswith("gs://"):
+        bucket_name = url[len("gs://"):].strip("/")
+        return GCSSink(get_bucket(bucket_name, gcs_endpoint), executor, upload_strategy)
+    if url.startswith("memory://"):
+        return MemorySink()
+
+    return LocalSink(url[len("file://"):] if url.startswith("file://") else url, executor)
@@ -0,0 +1,727 @@
+"""
+Transformations applied to trips parquet files before loading them
+"""
+
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import resource
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from dtc_de.extract_load import checksum, zones
+
+
+BATCH_SIZE = 128 * 1024  # rows per record batch
+PARTITION_KEY = "pickup_date"
+ROW_GROUP_SIZE = 1024 * 1024  # max rows per row group, as pyarrow default
+PROJECTED_OUT_KEY = b"projected_out"  # schema metadata key of columns projected out
+TARGET_FILE_SIZE = 128 * 1024 * 1024  # bytes per partitioned file, approximate
+
+# Named parquet writer profiles, as rows per row group and pyarrow writer
+# options, trading encoding time for file size and scan efficiency:
+# - "upload-fast": fast zstd and small row groups for quick encode and upload
+# - "storage-small": high zstd level and large row groups for least storage
+# - "bq-scan-optimized": statistics and page index for pruning by readers
+WRITER_PROFILES = {
+    "upload-fast": dict(
+        row_group_size=128 * 1024,
+        options=dict(
+            compression="zstd",
+            compression_level=1,
+            use_dictionary=True,
+            write_statistics=False,
+        ),
+    ),
+    "storage-small": dict(
+        row_group_size=1024 * 1024,
+        options=dict(
+            compression="zstd",
+            compression_level=15,
+            use_dictionary=True,
+            write_statistics=True,
+        ),
+    ),
+    "bq-scan-optimized": dict(
+        row_group_size=256 * 1024,
+        options=dict(
+            compression="snappy",
+            use_dictionary=True,
+            write_statistics=True,
+            write_page_index=True,
+        ),
+    ),
+}
+
+# Compact physical types by lowercase column name, applied by compact schema
+# mode to columns of the same kind: integers narrowed to their value domain,
+# and low cardinality strings dictionary encoded. BigQuery reads narrow
+# parquet integers as INT64 and dictionary encoded strings as STRING, so
+# compact files keep schemas seen by BigQuery.
+COMPACT_INTEGER_TYPES = {
+    "ratecodeid": pa.int8(),
+    "pulocationid": pa.int16(),
+    "dolocationid": pa.int16(),
+    "passenger_count": pa.int8(),
+    "payment_type": pa.int8(),
+    "trip_type": pa.int8(),
+    "sr_flag": pa.int8(),
+    "trip_time": pa.int32(),
+}
+COMPACT_DICTIONARY_COLUMNS = {
+    "vendorid",
+    "ratecodeid",
+    "store_and_fwd_flag",
+    "hvfhs_license_num",
+    "shared_request_flag",
+    "shared_match_flag",
+    "access_a_ride_flag",
+    "wav_request_flag",
+    "wav_match_flag",
+}
+COMPACT_DICTIONARY_INDEX_TYPE = pa.int8()
+
+_cast_plans = {}
+
+
+def get_schema_fingerprint(schema):
+    """
+    Get fingerprint of schema fields, ignoring schema metadata
+    """
+    text = schema.to_string(show_field_metadata=False, show_schema_metadata=False)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def project_schema(schema, columns):
+    """
+    Project schema to columns, matched case-insensitively, keeping order of
+    schema fields. Source columns missing in a cast target schema are not
+    read, so projected columns are the only ones decoded, cast, and written.
+    Names of columns projected out are kept in schema metadata, so they are
+    not reported as drift.
+    """
+    names = {column.lower() for column in columns}
+    missing = names - {name.lower() for name in schema.names}
+    if len(missing) > 0:
+        raise ValueError(f"Unknown columns to project: {sorted(missing)}")
+
+    projected_out = [name for name in schema.names if name.lower() not in names]
+    metadata = {**(schema.metadata or {}), PROJECTED_OUT_KEY: json.dumps(projected_out).encode()}
+    return pa.schema([field for field in schema if field.name.lower() in names], metadata=metadata)
+
+
+def get_compact_type(field):
+    """
+    Get compact type of field, or its type if it has none
+    """
+    name = field.name.lower()
+    if pa.types.is_integer(field.type) and (name in COMPACT_INTEGER_TYPES):
+        return COMPACT_INTEGER_TYPES[name]
+    if pa.types.is_string(field.type) and (name in COMPACT_DICTIONARY_COLUMNS):
+        return pa.dictionary(COMPACT_DICTIONARY_INDEX_TYPE, field.type)
+
+    return field.type
+
+
+def get_integer_range(pa_type):
+    bits = pa_type.bit_width
+    if pa.types.is_signed_integer(pa_type):
+        return (-2 ** (bits - 1), 2 ** (bits - 1) - 1)
+
+    return (0, 2 ** bits - 1)
+
+
+def get_column_range(parquet_file, name):
+    """
+    Get (min, max) of column of parquet file from row group statistics, or
+    from values read if any row group has none. Return None if all null.
+    """
+    metadata = parquet_file.metadata
+    index = parquet_file.schema_arrow.get_field_index(name)
+    statistics = [metadata.row_group(i).column(index).statistics for i in range(metadata.num_row_groups)]
+    if all((s is not None) and s.has_min_max for s in statistics):
+        if len(statistics) == 0:
+            return None
+        return (min(s.min for s in statistics), max(s.max for s in statistics))
+
+    min_max = pc.min_max(parquet_file.read(columns=[name]).column(0))
+    if not min_max["min"].is_valid:
+        return None
+
+    return (min_max["min"].as_py(), min_max["max"].as_py())
+
+
+def fit_compact_schema(parquet_file, schema):
+    """
+    Get compact schema of schema for parquet file, where fields take their
+    compact type, see COMPACT_INTEGER_TYPES, if values of their source column
+    fit in it: integers within its range, checked on row group statistics
+    where available, and strings with fewer distinct values than dictionary
+    indices. Fields whose values do not fit keep their type, so casts never
+    overflow. Return (compact schema, names of fields kept wide).
+    """
+    source_names = {name.lower(): name for name in parquet_file.schema_arrow.names}
+    fields = []
+    wide = []
+    for field in schema:
+        compact_type = get_compact_type(field)
+        source_name = source_names.get(field.name.lower())
+        if compact_type.equals(field.type) or (source_name is None):
+            fields.append(field.with_type(compact_type))
+            continue
+
+        if pa.types.is_dictionary(compact_type):
+            column = parquet_file.read(columns=[source_name]).column(0)
+            fits = pc.count_distinct(column).as_py() <= get_integer_range(compact_type.index_type)[1] + 1
+        else:
+            column_range = get_column_range(parquet_file, source_name)
+            (low, high) = get_integer_range(compact_type)
+            fits = (column_range is None) or ((low <= column_range[0]) and (column_range[1] <= high))
+
+        if fits:
+            fields.append(field.with_type(compact_type))
+        else:
+            fields.append(field)
+            wide.append(field.name)
+
+    return (pa.schema(fields, metadata=schema.metadata), wide)
+
+
+def cast_array(array, pa_type):
+    """
+    Cast array to type with a vectorized compute cast, dictionary encoding it
+    if type is a dictionary
+    """
+    if pa.types.is_dictionary(pa_type):
+        return pc.dictionary_encode(pc.cast(array, pa_type.value_type)).cast(pa_type)
+
+    return pc.cast(array, pa_type)
+
+
+class CastPlan:
+    """
+    Plan for casting record batches of source schema to target schema, where
+    each target field is either:
+    - passed through zero-copy from source column with same name and type
+    - converted with a vectorized compute cast from source column with same
+      name, case-insensitively, and different type
+    - filled with nulls if missing in source
+
+    Source columns missing in target are not read. Differences between schemas
+    are reported by drift, where missing or extra columns are drift, while
+    columns renamed by case only (e.g. "airport_fee" of "Airport_fee") and
+    casts are informative:
+        {"missing": [...], "extra": [...], "renamed": {...}, "cast": {...}}
+    """
+
+    def __init__(self, source_schema, target_schema):
+        source_names = {name.lower(): name for name in source_schema.names}
+
+        self.target_schema = target_schema
+        self.columns = []  # source column names to read
+        self.steps = []  # (target field, index in read columns or None, cast or not)
+        self.drift = dict(missing=[], extra=[], renamed={}, cast={})
+
+        for field in target_schema:
+            source_name = source_names.pop(field.name.lower(), None)
+            if source_name is None:
+                self.drift["missing"].append(field.name)
+                self.steps.append((field, None, False))
+                continue
+
+            if source_name != field.name:
+                self.drift["renamed"][source_name] = field.name
+
+            source_type = source_schema.field(source_name).type
+            must_cast = not source_type.equals(field.type)
+            if must_cast:
+                self.drift["cast"][field.name] = f"{source_type} -> {field.type}"
+
+            self.steps.append((field, len(self.columns), must_cast))
+            self.columns.append(source_name)
+
+        projected_out = json.loads((target_schema.metadata or {}).get(PROJECTED_OUT_KEY, b"[]"))
+        for name in projected_out:
+            source_names.pop(name.lower(), None)
+        self.drift["extra"] = sorted(source_names.values())
+
+    def has_drift(self):
+        return any(len(self.drift[key]) > 0 for key in ("missing", "extra"))
+
+    def apply(self, batch):
+        """
+        Cast record batch read with plan columns to target schema
+        """
+        arrays = []
+        for (field, index, must_cast) in self.steps:
+            if index is None:
+                arrays.append(pa.nulls(batch.num_rows, field.type))
+            elif must_cast:
+                arrays.append(cast_array(batch.column(index), field.type))
+            else:
+                arrays.append(batch.column(index))
+
+        return pa.RecordBatch.from_arrays(arrays, schema=self.target_schema)
+
+
+class RowFilter:
+    """
+    Filter of rows of a trips file of year and month, computed over the whole
+    file with vectorized Arrow compute before its batches are streamed:
+    - rows whose month_column is outside year and month, or null, are out of
+      month
+    - among rows in month, rows repeating dedup_columns values of an earlier
+      row are duplicates, found by hash grouping on dedup_columns
+    Each check is skipped if its columns are undefined. Column names are
+    matched case-insensitively as in CastPlan.
+    """
+
+    def __init__(self, year, month, month_column=None, dedup_columns=None):
+        self.year = year
+        self.month = month
+        self.month_column = month_column
+        self.dedup_columns = dedup_columns
+
+    def get_month_bounds(self, pa_type):
+        start = datetime.datetime(self.year, self.month, 1)
+        end = datetime.datetime(self.year + self.month // 12, self.month % 12 + 1, 1)
+        return (pa.scalar(start).cast(pa_type), pa.scalar(end).cast(pa_type))
+
+    def compute(self, parquet_file):
+        """
+        Compute masks over rows of parquet file, reading only filter columns.
+        Return (kept rows mask, out of month rows mask, duplicates count).
+        """
+        source_names = {name.lower(): name for name in parquet_file.schema_arrow.names}
+        columns = [*(self.dedup_columns or []), *([self.month_column] if self.month_column else [])]
+        missing = [c for c in columns if c.lower() not in source_names]
+        if len(missing) > 0:
+            raise ValueError(f"Missing columns to filter rows: {missing}")
+
+        table = parquet_file.read(columns=sorted({source_names[c.lower()] for c in columns}))
+        in_month = pa.repeat(True, table.num_rows)
+        if self.month_column is not None:
+            pickup = table.column(source_names[self.month_column.lower()]).combine_chunks()
+            (start, end) = self.get_month_bounds(pickup.type)
+            in_month = pc.fill_null(
+                pc.and_(pc.greater_equal(pickup, start), pc.less(pickup, end)), False)
+
+        keep = in_month
+        duplicates = 0
+        if self.dedup_columns:
+            keys = [source_names[c.lower()] for c in self.dedup_columns]
+            # Row index 0..N-1 built by Arrow compute, without a Python object per row
+            rows = pc.subtract(pc.cumulative_sum(pa.repeat(pa.scalar(1, pa.int64()), table.num_rows)), 1)
+            indexed = table.select(keys).append_column("row", rows).filter(in_month)
+            first_rows = indexed.group_by(keys).aggregate([("row", "min")]).column("row_min")
+            keep = pc.is_in(rows, value_set=first_rows.combine_chunks())
+            duplicates = indexed.num_rows - len(first_rows)
+
+        return (keep, pc.invert(in_month), duplicates)
+
+
+def get_cast_plan(source_schema, target_schema):
+    """
+    Get cast plan memoized by fingerprints of source and target schemas, so it
+    is computed once per distinct source schema within a process
+    """
+    key = (get_schema_fingerprint(source_schema), get_schema_fingerprint(target_schema))
+    if key not in _cast_plans:
+        _cast_plans[key] = CastPlan(source_schema, target_schema)
+
+    return _cast_plans[key]
+
+
+def get_writer_profile(name=None):
+    """
+    Get writer profile by name, or profile of pyarrow defaults if undefined
+    """
+    if name is None:
+        return dict(row_group_size=ROW_GROUP_SIZE, options={})
+
+    if name not in WRITER_PROFILES:
+        raise ValueError(f"Unknown writer profile: {name}")
+
+    return WRITER_PROFILES[name]
+
+
+def get_file_schema(parquet_file, schema=None, compact=False):
+    """
+    Get (target schema of parquet file, names of fields kept wide), where
+    schema is compacted for file if compact, see fit_compact_schema
+    """
+    if (not compact) or (schema is None):
+        return (schema, [])
+
+    return fit_compact_schema(parquet_file, schema)
+
+
+def get_drift(plan, wide=()):
+    """
+    Get schema drift of plan, with fields kept wide by compact schema, or None
+    """
+    drift = None if (plan is None) or (not plan.has_drift()) else plan.drift
+    if len(wide) > 0:
+        drift = dict(drift or {}, wide=list(wide))
+
+    return drift
+
+
+def run_transform(fn, *args):
+    """
+    Run transform fn(*args) returning (*result, stats), adding peak resident
+    set size of process running it to stats, so memory of transform worker
+    processes is reported by the process submitting transforms
+    """
+    (*result, stats) = fn(*args)
+    stats["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return (*result, stats)
+
+
+def get_stats(src):
+    """
+    Get stats of a transform of file at src, measured where it runs since it
+    may run in a worker process:
+    - started: epoch time when transform started
+    - decode, cast, enrich, encode: seconds spent reading batches, casting
+      them, adding zone columns, and writing them
+    - rows: rows read
+    - duplicates, out_of_month: rows removed by row filter, see RowFilter
+    - bytes_in, bytes_out: bytes of source and written files
+    - digest: base64 CRC32C and MD5 of written file, computed while encoding,
+      if written as a single file, see checksum.Digest
+    - peak_rss: peak resident set size in bytes of process running transform,
+      set once done if run by run_transform
+    """
+    return dict(
+        started=time.time(),
+        decode=0.0,
+        cast=0.0,
+        enrich=0.0,
+        encode=0.0,
+        rows=0,
+        duplicates=0,
+        out_of_month=0,
+        bytes_in=os.path.getsize(src),
+        bytes_out=0,
+        digest=None,
+    )
+
+
+def estimate_memory(src, batch_size=BATCH_SIZE, writer_profile=None, partitioned=False, whole_columns=()):
+    """
+    Estimate peak memory in bytes of transforming parquet file at src from its
+    footer metadata, see estimate_metadata_memory
+    """
+    return estimate_metadata_memory(
+        pq.read_metadata(src), batch_size, writer_profile, partitioned, whole_columns)
+
+
+def get_whole_columns(schema=None, filter_columns=(), compact=False):
+    """
+    Get names of source columns read for the whole file before streaming its
+    batches: filter_columns of row filter, see RowFilter.compute, and string
+    columns of schema dictionary encoded if compact, see fit_compact_schema
+    """
+    columns = list(filter_columns)
+    if compact and (schema is not None):
+        columns.extend(
+            field.name for field in schema if pa.types.is_dictionary(get_compact_type(field)))
+
+    return columns
+
+
+def get_columns_size(metadata, names):
+    """
+    Get uncompressed bytes of columns of parquet file metadata whose names
+    match names case-insensitively
+    """
+    names = {name.lower() for name in names}
+    size = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if column.path_in_schema.split(".")[0].lower() in names:
+                size += column.total_uncompressed_size
+
+    return size
+
+
+def estimate_metadata_memory(
+    metadata,
+    batch_size=BATCH_SIZE,
+    writer_profile=None,
+    partitioned=False,
+    whole_columns=(),
+):
+    """
+    Estimate peak memory in bytes of transforming parquet file of metadata, as
+    uncompressed bytes per row times rows held at once: one source row group
+    and one batch while reading, plus one row group of writer profile while
+    writing, or the whole file if partitioned since the dataset writer may
+    buffer row groups of every open partition. Uncompressed bytes of
+    whole_columns read for the whole file, see get_whole_columns, are added.
+    """
+    if metadata.num_rows == 0:
+        return 0
+
+    row_groups = [metadata.row_group(i) for i in range(metadata.num_row_groups)]
+    bytes_per_row = sum(rg.total_byte_size for rg in row_groups) / metadata.num_rows
+    if partitioned:
+        rows = metadata.num_rows
+    else:
+        read_rows = max(rg.num_rows for rg in row_groups) + batch_size
+        write_rows = get_writer_profile(writer_profile)["row_group_size"]
+        rows = min(read_rows, metadata.num_rows) + min(write_rows, metadata.num_rows)
+
+    return int(bytes_per_row * rows) + get_columns_size(metadata, whole_columns)
+
+
+def iter_batches(parquet_file, plan=None, batch_size=BATCH_SIZE, stats=None):
+    """
+    Iterate record batches of parquet file, cast by plan if defined, adding
+    decode and cast times and rows to stats if defined
+    """
+    columns = None if plan is None else plan.columns
+    batches = parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+    while True:
+        start = time.perf_counter()
+        batch = next(batches, None)
+        decoded = time.perf_counter()
+        if batch is None:
+            break
+        if plan is not None:
+            batch = plan.apply(batch)
+
+        if stats is not None:
+            stats["decode"] += decoded - start
+            stats["cast"] += time.perf_counter() - decoded
+            stats["rows"] += batch.num_rows
+        yield batch
+
+
+def filter_batches(
+    parquet_file,
+    plan=None,
+    batch_size=BATCH_SIZE,
+    stats=None,
+    row_filter=None,
+    quarantine_dest=None,
+    enrichment=None,
+):
+    """
+    Iterate record batches of parquet file like iter_batches, enriched by
+    enrichment if defined, see get_zone_enrichment, keeping rows kept by
+    row_filter if defined. Out of month rows are written, enriched alike, to
+    parquet file at quarantine_dest if defined and there are any, or dropped.
+    """
+    batches = iter_batches(parquet_file, plan, batch_size, stats)
+    if enrichment is not None:
+        batches = zones.enrich_batches(batches, enrichment, stats)
+    if row_filter is None:
+        yield from batches
+        return
+
+    (keep, out_of_month, duplicates) = row_filter.compute(parquet_file)
+    out_of_month_count = pc.sum(out_of_month).as_py() or 0
+    if stats is not None:
+        stats["duplicates"] += duplicates
+        stats["out_of_month"] += out_of_month_count
+
+    schema = parquet_file.schema_arrow if plan is None else plan.target_schema
+    if enrichment is not None:
+        schema = enrichment.schema
+    with contextlib.ExitStack() as stack:
+        quarantine_writer = None
+        if (quarantine_dest is not None) and (out_of_month_count > 0):
+            quarantine_writer = stack.enter_context(pq.ParquetWriter(quarantine_dest, schema))
+
+        offset = 0
+        for batch in batches:
+            if quarantine_writer is not None:
+                quarantine_writer.write_batch(
+                    batch.filter(out_of_month.slice(offset, batch.num_rows)))
+            yield batch.filter(keep.slice(offset, batch.num_rows))
+            offset += batch.num_rows
+
+
+def write_batches(writer, batches, row_group_size=ROW_GROUP_SIZE, stats=None):
+    """
+    Write record batches to parquet writer in row groups of row_group_size
+    rows, buffering at most one row group of batches, adding encode time to
+    stats if defined
+    """
+    def write_table(table):
+        start = time.perf_counter()
+        writer.write_table(table, row_group_size=row_group_size)
+        if stats is not None:
+            stats["encode"] += time.perf_counter() - start
+
+    buffered = []
+    num_rows = 0
+    for batch in batches:
+        buffered.append(batch)
+        num_rows += batch.num_rows
+        if num_rows < row_group_size:
+            continue
+
+        table = pa.Table.from_batches(buffered)
+        num_rows = (table.num_rows // row_group_size) * row_group_size
+        write_table(table.slice(0, num_rows))
+        buffered = table.slice(num_rows).to_batches()
+        num_rows = table.num_rows - num_rows
+
+    if num_rows > 0:
+        write_table(pa.Table.from_batches(buffered))
+
+
+def get_zone_enrichment(schema, zone_lookup=None):
+    """
+    Get enrichment of record batches of schema with zone columns from taxi
+    zone lookup CSV file at zone_lookup if defined, read once per process,
+    see zones.get_zone_lookup, or None otherwise
+    """
+    if zone_lookup is None:
+        return None
+
+    return zones.ZoneEnrichment(schema, zones.get_zone_lookup(zone_lookup))
+
+
+def cast_parquet_file(
+    src,
+    dest,
+    schema=None,
+    batch_size=BATCH_SIZE,
+    writer_profile=None,
+    row_filter=None,
+    quarantine_dest=None,
+    compact=False,
+    zone_lookup=None,
+):
+    """
+    Cast parquet file at src to schema, if defined, and write it to dest with
+    writer_profile one record batch at a time, so memory usage depends on
+    batch_size and profile row group size rather than file size:
+        cast_parquet_file("raw.parquet", "cast.parquet", VEHICLE_TYPE_SCHEMA_MAP["green"])
+
+    Rows are filtered by row_filter if defined, writing out of month rows to
+    quarantine_dest if defined, see filter_batches. If compact, schema fields
+    take compact types fitting values of file, see fit_compact_schema. Zone
+    columns of pickup and dropoff locations are added from taxi zone lookup
+    CSV file at zone_lookup if defined, to quarantined rows too, see
+    zones.ZoneEnrichment.
+
+    Return (schema drift of source file against schema, see CastPlan, stats of
+    transform, see get_stats). Fields kept wide in compact schema are listed
+    in drift as "wide".
+    """
+    stats = get_stats(src)
+    parquet_file = pq.ParquetFile(src)
+    (schema, wide) = get_file_schema(parquet_file, schema, compact)
+    plan = None if schema is None else get_cast_plan(parquet_file.schema_arrow, schema)
+    schema = parquet_file.schema_arrow if schema is None else schema
+    enrichment = get_zone_enrichment(schema, zone_lookup)
+    batches = filter_batches(
+        parquet_file, plan, batch_size, stats, row_filter, quarantine_dest, enrichment)
+    if enrichment is not None:
+        schema = enrichment.schema
+    profile = get_writer_profile(writer_profile)
+    with checksum.DigestWriter(dest) as sink, \
+            pq.ParquetWriter(sink, schema, **profile["options"]) as writer:
+        write_batches(writer, batches, profile["row_group_size"], stats)
+    stats["bytes_out"] = os.path.getsize(dest)
+    stats["digest"] = sink.digest.to_dict()
+
+    return (get_drift(plan, wide), stats)
+
+
+def partition_parquet_file(
+    src,
+    dest_dir,
+    pickup_column,
+    schema=None,
+    batch_size=BATCH_SIZE,
+    target_file_size=TARGET_FILE_SIZE,
+    basename=None,
+    writer_profile=None,
+    row_filter=None,
+    quarantine_dest=None,
+    compact=False,
+    zone_lookup=None,
+):
+    """
+    Split parquet file at src, cast to schema if defined, into hive partitions
+    "pickup_date=YYYY-MM-DD/" of dest_dir by date of pickup_column timestamps:
+        partition_parquet_file("raw.parquet", "parts", "lpep_pickup_datetime", schema)
+
+    Grouping is vectorized by Arrow dataset writer while batches are streamed,
+    and files are split to approximate target_file_size based on bytes per row
+    of source file. Written files are named "BASENAME-N.parquet" with basename
+    defaulting to stem of src, and encoded with writer_profile. Rows are
+    filtered by row_filter if defined, see filter_batches, cast to compact
+    types if compact, and enriched with zone columns if zone_lookup is
+    defined, see cast_parquet_file.
+
+    Return (paths of written files relative to dest_dir, schema drift, stats),
+    where encode time of stats includes grouping by partition.
+    """
+    stats = get_stats(src)
+    parquet_file = pq.ParquetFile(src)
+    (schema, wide) = get_file_schema(parquet_file, schema, compact)
+    plan = None if schema is None else get_cast_plan(parquet_file.schema_arrow, schema)
+    schema = parquet_file.schema_arrow if schema is None else schema
+
+    num_rows = parquet_file.metadata.num_rows
+    bytes_per_row = os.path.getsize(src) / max(num_rows, 1)
+    max_rows_per_file = max(1, int(target_file_size / bytes_per_row))
+
+    profile = get_writer_profile(writer_profile)
+    enrichment = get_zone_enrichment(schema, zone_lookup)
+    batches = filter_batches(
+        parquet_file, plan, batch_size, stats, row_filter, quarantine_dest, enrichment)
+    if enrichment is not None:
+        schema = enrichment.schema
+    pickup_index = schema.get_field_index(pickup_column)
+    partitioned_schema = schema.append(pa.field(PARTITION_KEY, pa.date32()))
+
+    def partitioned_batches():
+        for batch in batches:
+            dates = pc.cast(batch.column(pickup_index), pa.date32())
+            yield pa.RecordBatch.from_arrays(
+                [*batch.columns, dates], schema=partitioned_schema)
+
+    if basename is None:
+        basename = os.path.splitext(os.path.basename(src))[0]
+
+    # Rows are buffered per partition up to a full row group, instead of
+    # writing a small row group for each batch spanning several dates
+    rows_per_group = min(max_rows_per_file, profile["row_group_size"])
+    written = []
+    start = time.perf_counter()
+    ds.write_dataset(
+        partitioned_batches(),
+        dest_dir,
+        schema=partitioned_schema,
+        format="parquet",
+        file_options=ds.ParquetFileFormat().make_write_options(**profile["options"]),
+        partitioning=ds.partitioning(
+            pa.schema([partitioned_schema.field(PARTITION_KEY)]), flavor="hive"),
+        basename_template=f"{basename}-{{i}}.parquet",
+        max_rows_per_file=max_rows_per_file,
+        min_rows_per_group=rows_per_group,
+        max_rows_per_group=rows_per_group,
+        existing_data_behavior="overwrite_or_ignore",
+        file_visitor=lambda f: written.append(os.path.relpath(f.path, dest_dir)),
+    )
+
+    stats["encode"] = time.perf_counter() - start - stats["decode"] - stats["cast"] - stats["enrich"]
+    stats["bytes_out"] = sum(os.path.getsize(os.path.join(dest_dir, path)) for path in written)
+
+    return (sorted(written), get_drift(plan, wide), stats)
@@ -0,0 +1,141 @@
+"""
+Taxi zone enrichment of trips record batches, adding borough and zone of
+pickup and dropoff locations at ingestion with vectorized Arrow take, from
+the taxi zone lookup seeded to the warehouse as dim_zones
+"""
+
+import hashlib
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from dtc_de.extract_load import sinks
+
+
+LOCATION_COLUMN = "locationid"
+ZONE_COLUMNS = ("borough", "zone")
+
+# Trip location columns by lowercase name, and prefix of their zone columns
+# as named by fact models
+LOCATION_PREFIXES = {
+    "pulocationid": "pickup",
+    "dolocationid": "dropoff",
+}
+
+_zone_lookups = {}
+
+
+class ZoneLookup:
+    """
+    Zone columns of taxi zone lookup laid out as arrays indexed by location
+    ID, where IDs missing in lookup are null, so zone columns of any number
+    of trips are looked up with one take per column:
+        lookup = ZoneLookup(pv.read_csv("taxi_zone_lookup.csv"))
+        lookup.take(batch.column("PULocationID"))["borough"]
+
+    Location IDs out of lookup range or null get null zone columns.
+    """
+
+    def __init__(self, table, columns=ZONE_COLUMNS):
+        location_ids = pc.cast(table.column(LOCATION_COLUMN), pa.int64()).combine_chunks()
+        size = (pc.max(location_ids).as_py() or 0) + 1
+        # Row of each location ID in table, or null if missing
+        positions = pc.index_in(pa.array(range(size), pa.int64()), value_set=location_ids)
+        self.size = size
+        self.columns = {
+            name: pc.take(pc.cast(table.column(name), pa.string()).combine_chunks(), positions)
+            for name in columns
+        }
+
+    def take(self, location_ids):
+        """
+        Get {zone column: array of values at location_ids}
+        """
+        location_ids = pc.cast(location_ids, pa.int64())
+        in_range = pc.and_(pc.greater_equal(location_ids, 0), pc.less(location_ids, self.size))
+        indices = pc.if_else(in_range, location_ids, pa.scalar(None, pa.int64()))
+
+        return {name: pc.take(values, indices) for (name, values) in self.columns.items()}
+
+
+def get_lookup_version(path):
+    """
+    Get fingerprint of content of taxi zone lookup CSV file at path
+    """
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()[:8]
+
+
+def get_zone_lookup(path):
+    """
+    Get zone lookup of taxi zone lookup CSV file at path, memoized by path
+    and modification time, so it is read once per process for all files
+    """
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in _zone_lookups:
+        _zone_lookups[key] = ZoneLookup(pv.read_csv(path))
+
+    return _zone_lookups[key]
+
+
+async def fetch_zone_lookup(url, dest_dir, executor=None, gcs_endpoint=None):
+    """
+    Copy taxi zone lookup CSV file at "gs://BUCKET_NAME/KEY" url to dest_dir
+    through its sink, see sinks.get_sink, so it is read locally by transform
+    processes. Return local path of file, or url if it is a local path.
+    """
+    if not url.startswith("gs://"):
+        return url
+
+    (bucket_name, key) = url[len("gs://"):].split("/", 1)
+    sink = sinks.get_sink(f"gs://{bucket_name}", executor, gcs_endpoint)
+    path = os.path.join(dest_dir, os.path.basename(key))
+    if await sink.get_file(key, path) is None:
+        raise ValueError(f"Missing taxi zone lookup: {url}")
+
+    return path
+
+
+class ZoneEnrichment:
+    """
+    Enrichment of record batches of schema, appending "PREFIX_borough" and
+    "PREFIX_zone" columns for each location column of schema, matched
+    case-insensitively, see LOCATION_PREFIXES. Location columns missing in
+    schema, such as projected out, are skipped.
+    """
+
+    def __init__(self, schema, lookup):
+        self.lookup = lookup
+        self.locations = []  # (index of location column, prefix)
+        fields = []
+        for (i, name) in enumerate(schema.names):
+            prefix = LOCATION_PREFIXES.get(name.lower())
+            if prefix is None:
+                continue
+
+            self.locations.append((i, prefix))
+            fields.extend(pa.field(f"{prefix}_{column}", pa.string()) for column in lookup.columns)
+        self.schema = pa.schema(list(schema) + fields, metadata=schema.metadata)
+
+    def apply(self, batch):
+        arrays = list(batch.columns)
+        for (i, _) in self.locations:
+            arrays.extend(self.lookup.take(batch.column(i)).values())
+
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+def enrich_batches(batches, enrichment, stats=None):
+    """
+    Iterate record batches enriched by enrichment, adding enrich time to
+    stats if defined
+    """
+    for batch in batches:
+        start = time.perf_counter()
+        batch = enrichment.apply(batch)
+        if stats is not None:
+            stats["enrich"] += time.perf_counter() - start
+        yield batch
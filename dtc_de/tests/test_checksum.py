@@ -0,0 +1,26 @@
+import os
+
+import google_crc32c
+import pytest
+
+from dtc_de.extract_load import checksum
+
+
+@pytest.mark.parametrize("length1,length2", [(0, 0), (0, 7), (7, 0), (1, 1), (1000, 3), (4096, 65537)])
+def test_crc32c_combine(length1, length2):
+    data1 = os.urandom(length1)
+    data2 = os.urandom(length2)
+
+    combined = checksum.crc32c_combine(google_crc32c.value(data1), google_crc32c.value(data2), length2)
+
+    assert combined == google_crc32c.value(data1 + data2)
+
+
+def test_crc32c_combine_chunks():
+    chunks = [os.urandom(n) for n in (5, 1024, 0, 333, 8192)]
+
+    crc = 0
+    for chunk in chunks:
+        crc = checksum.crc32c_combine(crc, google_crc32c.value(chunk), len(chunk))
+
+    assert crc == google_crc32c.value(b"".join(chunks))
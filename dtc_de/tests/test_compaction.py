@@ -0,0 +1,50 @@
+import random
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dtc_de.extract_load import compact_trips_in_gs
+
+
+def write_runs(tmp_path, keys, run_size):
+    table = pa.table({
+        "key": pa.array(keys, pa.int64()),
+        "row": pa.array(range(len(keys)), pa.int64()),
+    })
+    pq.write_table(table, tmp_path / "source.parquet")
+    (runs, _, _) = compact_trips_in_gs.sort_runs(
+        str(tmp_path / "source.parquet"), str(tmp_path / "runs"), "key", batch_size=100, run_size=run_size)
+
+    return runs
+
+
+def test_merge_runs_ordering(tmp_path):
+    rng = random.Random(0)
+    keys = [rng.randrange(1000) for _ in range(5000)]
+    runs = write_runs(tmp_path, keys, run_size=16 * 1024)
+    assert len(runs) > 1
+
+    merged = pa.concat_tables(compact_trips_in_gs.merge_runs(runs, "key"))
+
+    assert merged.column("key").to_pylist() == sorted(keys)
+    assert sorted(merged.column("row").to_pylist()) == list(range(len(keys)))
+
+
+def test_merge_runs_nulls_last(tmp_path):
+    rng = random.Random(1)
+    keys = [None if rng.random() < 0.2 else rng.randrange(100) for _ in range(3000)]
+    runs = write_runs(tmp_path, keys, run_size=8 * 1024)
+
+    merged = pa.concat_tables(compact_trips_in_gs.merge_runs(runs, "key")).column("key").to_pylist()
+
+    non_null = sorted(key for key in keys if key is not None)
+    assert merged == non_null + [None] * (len(keys) - len(non_null))
+
+
+def test_merge_runs_all_nulls(tmp_path):
+    runs = write_runs(tmp_path, [None] * 500, run_size=4 * 1024)
+
+    merged = pa.concat_tables(compact_trips_in_gs.merge_runs(runs, "key"))
+
+    assert merged.num_rows == 500
+    assert merged.column("key").null_count == 500
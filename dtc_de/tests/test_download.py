@@ -0,0 +1,87 @@
+import asyncio
+import os
+
+import aiohttp
+
+from dtc_de.extract_load import checksum, download, fakes
+
+
+def download_partial(tmp_path, source, partial, validator=None):
+    """
+    Download source file served by fake TLC server to a path holding partial
+    bytes, recorded as partial of validator if defined, as a single stream.
+    Return (bytes downloaded, digest, downloaded file content).
+    """
+    (tmp_path / "source").mkdir()
+    (tmp_path / "source" / "a.parquet").write_bytes(source)
+    path = str(tmp_path / "a.parquet.part")
+    with open(path, "wb") as file:
+        file.write(partial)
+
+    async def run():
+        server = fakes.FakeTLCServer(str(tmp_path / "source"))
+        runner = await fakes.start_server(server)
+        try:
+            async with aiohttp.ClientSession() as session:
+                url = f"{server.get_base_url()}/a.parquet"
+                metadata = await download.head(session, url)
+                if validator is not None:
+                    download.write_validator(path, validator(metadata))
+                digest = checksum.Digest()
+                nbytes = await download.download(
+                    session, url, path, segments=1, metadata=metadata, digest=digest)
+                return (nbytes, digest)
+        finally:
+            await runner.cleanup()
+
+    (nbytes, digest) = asyncio.run(run())
+    with open(path, "rb") as file:
+        return (nbytes, digest, file.read())
+
+
+def test_resume_same_version(tmp_path):
+    source = os.urandom(300_000)
+
+    (nbytes, digest, content) = download_partial(
+        tmp_path, source, source[:100_000], download.get_validator)
+
+    assert content == source
+    assert nbytes == 200_000
+    assert digest.to_dict() == checksum.update_from_file(checksum.Digest(), tmp_path / "a.parquet.part").to_dict()
+
+
+def test_restart_changed_version(tmp_path):
+    source = os.urandom(300_000)
+
+    (nbytes, _, content) = download_partial(
+        tmp_path, source, os.urandom(100_000), lambda metadata: '"previous"')
+
+    assert content == source
+    assert nbytes == 300_000
+
+
+def test_restart_without_validator(tmp_path):
+    source = os.urandom(300_000)
+
+    (nbytes, digest, content) = download_partial(tmp_path, source, os.urandom(100_000))
+
+    assert content == source
+    assert nbytes == 300_000
+    assert digest.to_dict() == checksum.update_from_file(checksum.Digest(), tmp_path / "a.parquet.part").to_dict()
+
+
+def test_restart_partial_larger_than_source(tmp_path):
+    source = os.urandom(300_000)
+
+    (_, _, content) = download_partial(tmp_path, source, os.urandom(400_000), download.get_validator)
+
+    assert content == source
+
+
+def test_complete_partial(tmp_path):
+    source = os.urandom(300_000)
+
+    (nbytes, _, content) = download_partial(tmp_path, source, source, download.get_validator)
+
+    assert content == source
+    assert nbytes == 0
@@ -0,0 +1,60 @@
+import asyncio
+
+from dtc_de.extract_load import scheduler
+
+
+def create_budget(budget, files_in_memory):
+    """
+    Create memory budget of budget bytes above memory in use, never sampling
+    memory again so that only reservations count
+    """
+    memory = scheduler.MemoryBudget(0, sample_interval=3600, files_in_memory=files_in_memory)
+    memory.budget = memory.baseline + budget
+    return memory
+
+
+def test_file_in_memory_stays_reserved_until_released():
+    async def run():
+        memory = create_budget(100, files_in_memory=True)
+        async with memory.reserve(10, {"/tmp/work/a.parquet": 60}):
+            pass
+        reserved = memory.reserved
+
+        admitted = asyncio.Event()
+
+        async def reserve():
+            async with memory.reserve(10, {"/tmp/work/b.parquet": 60}):
+                admitted.set()
+
+        async with memory.reserve(10):
+            task = asyncio.create_task(reserve())
+            await asyncio.sleep(0.01)
+            waiting = not admitted.is_set()
+            await memory.release_files("/tmp/work")
+            await asyncio.wait_for(admitted.wait(), 1)
+        await task
+
+        return (reserved, waiting, memory.reserved)
+
+    assert asyncio.run(run()) == (60, True, 60)
+
+
+def test_file_on_disk_is_not_reserved():
+    async def run():
+        memory = create_budget(100, files_in_memory=False)
+        async with memory.reserve(10, {"/data/a.parquet": 60}) as reservation:
+            nbytes = reservation.nbytes
+        return (nbytes, memory.reserved)
+
+    assert asyncio.run(run()) == (10, 0)
+
+
+def test_work_alone_is_admitted_despite_reserved_files():
+    async def run():
+        memory = create_budget(100, files_in_memory=True)
+        async with memory.reserve(0, {"/tmp/work/a.parquet": 90}):
+            pass
+        async with memory.reserve(50):
+            return memory.reserved
+
+    assert asyncio.run(asyncio.wait_for(run(), 1)) == 140
@@ -0,0 +1,83 @@
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from dtc_de.extract_load import transform
+
+
+def write_trips(tmp_path, pickups, vendors):
+    table = pa.table({
+        "VendorID": pa.array(vendors, pa.string()),
+        "Pickup_Datetime": pa.array(pickups, pa.timestamp("us")),
+    })
+    pq.write_table(table, tmp_path / "trips.parquet")
+
+    return pq.ParquetFile(tmp_path / "trips.parquet")
+
+
+IN_MONTH = datetime.datetime(2022, 3, 15)
+PICKUPS = [
+    IN_MONTH,
+    datetime.datetime(2022, 2, 28, 23, 59),  # before month
+    datetime.datetime(2022, 3, 1),  # first instant of month
+    datetime.datetime(2022, 4, 1),  # first instant of next month
+    None,
+    IN_MONTH,
+]
+VENDORS = ["1", "1", "2", "2", "1", "1"]
+
+
+def test_row_filter_out_of_month(tmp_path):
+    parquet_file = write_trips(tmp_path, PICKUPS, VENDORS)
+    row_filter = transform.RowFilter(2022, 3, month_column="pickup_datetime")
+
+    (keep, out_of_month, duplicates) = row_filter.compute(parquet_file)
+
+    assert keep.to_pylist() == [True, False, True, False, False, True]
+    assert out_of_month.to_pylist() == [False, True, False, True, True, False]
+    assert duplicates == 0
+
+
+def test_row_filter_duplicates(tmp_path):
+    parquet_file = write_trips(tmp_path, PICKUPS, VENDORS)
+    row_filter = transform.RowFilter(2022, 3, dedup_columns=["vendorid", "pickup_datetime"])
+
+    (keep, out_of_month, duplicates) = row_filter.compute(parquet_file)
+
+    assert keep.to_pylist() == [True, True, True, True, True, False]
+    assert out_of_month.to_pylist() == [False] * len(PICKUPS)
+    assert duplicates == 1
+
+
+def test_row_filter_duplicates_in_month(tmp_path):
+    pickups = [datetime.datetime(2022, 4, 2), *PICKUPS, datetime.datetime(2022, 4, 2)]
+    parquet_file = write_trips(tmp_path, pickups, ["1", *VENDORS, "1"])
+    row_filter = transform.RowFilter(
+        2022, 3, month_column="Pickup_Datetime", dedup_columns=["VendorID", "Pickup_Datetime"])
+
+    (keep, out_of_month, duplicates) = row_filter.compute(parquet_file)
+
+    assert keep.to_pylist() == [False, True, False, True, False, False, False, False]
+    assert out_of_month.to_pylist() == [True, False, True, False, True, True, False, True]
+    assert duplicates == 1
+
+
+def test_row_filter_december(tmp_path):
+    pickups = [datetime.datetime(2022, 12, 31, 23, 59), datetime.datetime(2023, 1, 1)]
+    parquet_file = write_trips(tmp_path, pickups, ["1", "1"])
+    row_filter = transform.RowFilter(2022, 12, month_column="pickup_datetime")
+
+    (keep, out_of_month, _) = row_filter.compute(parquet_file)
+
+    assert keep.to_pylist() == [True, False]
+    assert out_of_month.to_pylist() == [False, True]
+
+
+def test_row_filter_missing_column(tmp_path):
+    parquet_file = write_trips(tmp_path, PICKUPS, VENDORS)
+    row_filter = transform.RowFilter(2022, 3, month_column="dropoff_datetime")
+
+    with pytest.raises(ValueError, match="dropoff_datetime"):
+        row_filter.compute(parquet_file)
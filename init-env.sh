@@ -179,4 +179,7 @@ DBT_SCHEMA=$BQ_DATASET
 GS_FHV_RAW_URI="gs://$GCS_DATA_BUCKET_NAME/raw/fhv/*.parquet"
 GS_GREEN_RAW_URI="gs://$GCS_DATA_BUCKET_NAME/raw/green/*.parquet"
 GS_YELLOW_RAW_URI="gs://$GCS_DATA_BUCKET_NAME/raw/yellow/*.parquet"
+GS_FHV_COMPACTED_MANIFEST_URI="gs://$GCS_DATA_BUCKET_NAME/manifests/compacted/fhv.txt"
+GS_GREEN_COMPACTED_MANIFEST_URI="gs://$GCS_DATA_BUCKET_NAME/manifests/compacted/green.txt"
+GS_YELLOW_COMPACTED_MANIFEST_URI="gs://$GCS_DATA_BUCKET_NAME/manifests/compacted/yellow.txt"
 EOF
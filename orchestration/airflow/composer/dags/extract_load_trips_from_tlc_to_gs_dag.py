@@ -74,6 +74,7 @@ def create_job_extract_load(bucket_name, image, parent, vehicle_type, year, data
             "-O", "-m", "dtc_de.extract_load.extract_load_trips_from_tlc_to_gs",
             "--bucket-name", bucket_name,
             "--vehicle-type", vehicle_type,
+            "--memory-budget", str(3 * 1024 ** 3),
             *conditional_args
         ],
         resources=run_v2.ResourceRequirements(